@@ -0,0 +1,483 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# This file has benchmarks for the parts of psync that need to be
+# fast.  Each benchmark builds its own test data in a temporary
+# directory, so you can run them anywhere, like so:
+#
+# cd src
+# python benchmark.py walk
+#
+# Running with no arguments lists the benchmarks.
+
+import fnmatch
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from fs import (FileSystem, FileHasher, ChunkSettings, GearChunker,
+                PathFilter, get_hash_type)
+from fs.FileSystem import scandir
+from fs.scan import rechunk_appended_file
+from history import (HistoryStore, HistoryEntry, HistoryColumns,
+                     group_history_by_gpath, group_histories_by_gpath,
+                     diff_histories)
+from history.store import TABLE_NAME, TABLE_FIELDS
+from util import SqlDb
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+class NullLog:
+    """ A slog that drops everything, so logging doesn't skew timings."""
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def time_best(func, repeat = 3):
+    """Returns (best secs, result) of calling func repeat times."""
+    best, result = None, None
+    for _ in xrange(repeat):
+        before = time.time()
+        result = func()
+        elapsed = time.time() - before
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def report(name, secs, count, unit):
+    print "{0:<30} {1:>8.3f} secs {2:>12,.0f} {3}/sec".format(
+        name, secs, count / secs if secs else 0, unit)
+
+def get_rss():
+    """Returns the bytes of memory we're using now (only on Linux)."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def report_memory(name, used, count, unit):
+    print "{0:<30} {1:>8.1f} MB {2:>14,.0f} bytes/{3}".format(
+        name, used / 1e6, used / float(count) if count else 0, unit)
+
+def make_tree(root, depth, dirs_per_dir, files_per_dir):
+    """Makes a tree of small files, returning the number of files."""
+    count = 0
+    for index in xrange(files_per_dir):
+        with open(os.path.join(root, "file{0}.txt".format(index)), "wb") as f:
+            f.write("x" * index)
+        count += 1
+    if depth > 0:
+        for index in xrange(dirs_per_dir):
+            child = os.path.join(root, "dir{0}".format(index))
+            os.mkdir(child)
+            count += make_tree(child, depth - 1, dirs_per_dir, files_per_dir)
+    return count
+
+@benchmark
+def walk(depth = 3, dirs_per_dir = 8, files_per_dir = 50, threads = 4):
+    """Compares list+stats to walk_stats, serially and in parallel."""
+    fs = FileSystem(NullLog())
+    root = tempfile.mkdtemp()
+    try:
+        count = make_tree(root, int(depth), int(dirs_per_dir),
+                          int(files_per_dir))
+        print "walking {0} files ({1})".format(
+            count, "scandir" if scandir else "no scandir")
+
+        secs, stats = time_best(lambda: list(fs.stats(fs.list(root))))
+        report("list + stats", secs, len(stats), "files")
+
+        secs, stats = time_best(lambda: list(fs.walk_stats(root)))
+        report("walk_stats", secs, len(stats), "files")
+
+        threads = int(threads)
+        secs, stats = time_best(
+            lambda: list(fs.walk_stats(root, threads = threads)))
+        report("walk_stats ({0} threads)".format(threads),
+               secs, len(stats), "files")
+    finally:
+        shutil.rmtree(root)
+
+@benchmark
+def hashing(max_mb = 128, total_mb = 256):
+    """Compares _iter_chunks to FileHasher at several file sizes."""
+    fs = FileSystem(NullLog())
+    root = tempfile.mkdtemp()
+    max_size = int(max_mb) * 1024 * 1024
+    total_size = int(total_mb) * 1024 * 1024
+    hash_type = get_hash_type("sha1")
+
+    def iter_chunks_hash(path):
+        hasher = hash_type.constructor()
+        for chunk in fs._iter_chunks(path, 100000):
+            hasher.update(chunk)
+        return hasher.digest()
+
+    # Each FileHasher is kept between runs, like it would be while
+    # scanning, so the tuned one gets to tune.
+    fixed = FileHasher(block_size = 1024 * 1024)
+    tuned = FileHasher()
+    mapped = FileHasher(use_mmap = True, mmap_threshold = 0)
+    hashers = [
+        ("read(100000)", iter_chunks_hash),
+        ("readinto(1MB)", lambda path: fixed.hash(path, hash_type)),
+        ("readinto(tuned)", lambda path: tuned.hash(path, hash_type)),
+        ("mmap", lambda path: mapped.hash(path, hash_type))]
+
+    try:
+        size = 64 * 1024
+        while size <= max_size:
+            count = max(1, total_size // size)
+            path = os.path.join(root, "file")
+            with open(path, "wb") as file:
+                file.write(os.urandom(size))
+
+            print "{0} files of {1:,} bytes".format(count, size)
+            expected = iter_chunks_hash(path)
+            for name, hash_file in hashers:
+                secs, digest = time_best(
+                    lambda: [hash_file(path) for _ in xrange(count)][-1])
+                assert digest == expected, name
+                report("  " + name, secs, count * size / 1e6, "MB")
+            size *= 8
+    finally:
+        shutil.rmtree(root)
+
+@benchmark
+def chunking(size_mb = 16, avg_kb = 64):
+    """Compares hashing to hashing and chunking (FastCDC) together."""
+    root = tempfile.mkdtemp()
+    size = int(size_mb) * 1024 * 1024
+    avg_size = int(avg_kb) * 1024
+    hash_type = get_hash_type("sha1")
+    hasher = FileHasher()
+    try:
+        path = os.path.join(root, "file")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+
+        secs, _ = time_best(lambda: hasher.hash(path, hash_type))
+        report("hash", secs, size / 1e6, "MB")
+
+        for (min_size, max_size) in ((avg_size // 4, avg_size * 4),
+                                     (avg_size // 2, avg_size * 4)):
+            settings = ChunkSettings(min_size, avg_size, max_size)
+            def hash_and_chunk():
+                chunker = GearChunker(settings, hash_type)
+                hasher.hash_many(path, [hash_type], chunker)
+                return chunker.chunks
+            secs, chunks = time_best(hash_and_chunk)
+            report("hash + chunk {0}K/{1}K/{2}K".format(
+                       min_size // 1024, avg_size // 1024, max_size // 1024),
+                   secs, size / 1e6, "MB")
+            print "  {0} chunks, {1:,.0f} bytes on average".format(
+                len(chunks), size / float(len(chunks)))
+    finally:
+        shutil.rmtree(root)
+
+@benchmark
+def appending(size_mb = 16, append_kb = 256):
+    """Compares chunking an appended file again to chunking its end."""
+    root = tempfile.mkdtemp()
+    size = int(size_mb) * 1024 * 1024
+    append_size = int(append_kb) * 1024
+    hash_type = get_hash_type("sha1")
+    settings = ChunkSettings()
+    fs = FileSystem(NullLog())
+    try:
+        path = os.path.join(root, "file")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+        chunker = GearChunker(settings, hash_type)
+        fs.hash_many(path, [], chunker)
+        old_chunks = chunker.chunks
+        with open(path, "ab") as file:
+            file.write(os.urandom(append_size))
+
+        def chunk_all():
+            chunker = GearChunker(settings, hash_type)
+            fs.hash_many(path, [], chunker)
+            return chunker.chunks
+        secs, chunks = time_best(chunk_all)
+        report("chunk everything", secs, (size + append_size) / 1e6, "MB")
+
+        secs, appended_chunks = time_best(lambda: rechunk_appended_file(
+            fs, path, hash_type, settings, old_chunks))
+        report("chunk the end", secs, (size + append_size) / 1e6, "MB")
+        print "  same chunks: {0}".format(chunks == appended_chunks)
+    finally:
+        shutil.rmtree(root)
+
+# Like the names and globs psync ignores by default, and then some.
+IGNORED_NAMES = [".psync", "Library", ".Trash", ".DS_Store", ".cache",
+                 ".mozilla", ".local", ".hg", ".git"]
+IGNORED_GLOBS = ["*.hds", "*.mem", "*.pyc", "*.o", "*.swp", "*~", "~*.tmp",
+                 ".config/google-chrome/*",
+                 ".config/google-googletalkplugin/*",
+                 ".config/Slack/*", "node_modules/*", "build/*"]
+
+def make_paths(count):
+    """Makes count paths like those in a home directory."""
+    rand = random.Random(0)
+    dirs = ["Documents", "Documents/taxes", "Photos/2015", "Photos/2016",
+            "src/psync/src/fs", "src/psync/.git/objects", "build/lib",
+            ".config/google-chrome/Default/Cache", ".config/other",
+            "Music/Some Band/Some Album"]
+    exts = [".txt", ".doc", ".jpg", ".py", ".pyc", ".mp3", ".o", ".txt~"]
+    return ["{0}/file{1}{2}".format(rand.choice(dirs), index,
+                                    rand.choice(exts))
+            for index in xrange(count)]
+
+@benchmark
+def pathfilter(path_count = 100000):
+    """Compares a glob at a time to one compiled (and cached) filter."""
+    paths = make_paths(int(path_count))
+    names = frozenset(IGNORED_NAMES)
+    patterns = [re.compile(fnmatch.translate(glob), re.IGNORECASE)
+                for glob in IGNORED_GLOBS]
+
+    def ignore_path_per_glob(path):
+        return bool(frozenset(path.split("/")) & names or
+                    any(pattern.match(path) for pattern in patterns))
+
+    secs, expected = time_best(lambda: map(ignore_path_per_glob, paths))
+    report("a glob at a time", secs, len(paths), "paths")
+
+    secs, ignored = time_best(lambda: map(
+        PathFilter(IGNORED_GLOBS, IGNORED_NAMES).ignore_path, paths))
+    report("compiled (not cached)", secs, len(paths), "paths")
+
+    path_filter = PathFilter(IGNORED_GLOBS, IGNORED_NAMES)
+    map(path_filter.ignore_path, paths)
+    secs, ignored = time_best(lambda: map(path_filter.ignore_path, paths))
+    report("compiled (cached)", secs, len(paths), "paths")
+    print "  {0} of {1} ignored, same as a glob at a time: {2}".format(
+        sum(ignored), len(paths), ignored == expected)
+
+    fs = FileSystem(NullLog())
+    root = tempfile.mkdtemp()
+    try:
+        chrome = os.path.join(root, ".config", "google-chrome")
+        os.makedirs(chrome)
+        count = make_tree(root, 2, 4, 20) + make_tree(chrome, 3, 6, 20)
+        print "walking {0} files, mostly in .config/google-chrome".format(
+            count)
+        secs, stats = time_best(lambda: list(fs.walk_stats(root)))
+        report("walk everything", secs, count, "files")
+        secs, stats = time_best(lambda: list(fs.walk_stats(
+            root, ignore_dir = path_filter.ignore_dir)))
+        report("walk, skipping ignored dirs", secs, count, "files")
+        print "  {0} files not ignored".format(len(stats))
+    finally:
+        shutil.rmtree(root)
+
+# If given a path_count, paths repeat, as if changed over and over.
+def make_history_entries(peerid, count, path_count = None):
+    path_count = path_count or count
+    return [HistoryEntry(utime, peerid, "group",
+                         "dir/file{0}".format(utime % path_count),
+                         utime, utime, "{0:040x}".format(utime), peerid,
+                         utime, "created", "sha1")
+            for utime in xrange(count)]
+
+@benchmark
+def history(peer_count = 10, entries_per_peer = 50000):
+    """Compares reading one peer's history to reading everyone's."""
+    db = SqlDb(sqlite3.connect(":memory:"))
+    store = HistoryStore(db, NullLog())
+    entries_per_peer = int(entries_per_peer)
+    for index in xrange(int(peer_count)):
+        store.add_entries(make_history_entries(
+            "peer{0}".format(index), entries_per_peer))
+    print "{0} peers with {1} entries each".format(peer_count,
+                                                   entries_per_peer)
+
+    def select_all_and_filter():
+        return [entry for entry in db.select(TABLE_NAME, TABLE_FIELDS,
+                                             into = HistoryEntry)
+                if entry.peerid == "peer0"]
+    secs, entries = time_best(select_all_and_filter)
+    report("select all, filter by peer", secs, len(entries), "entries")
+
+    secs, entries = time_best(lambda: list(store.select_entries("peer0")))
+    report("select where peerid", secs, len(entries), "entries")
+
+    secs, entries = time_best(lambda: store.read_entries_since(
+        "peer0", entries_per_peer - 100))
+    report("select since utime", secs, len(entries), "entries")
+
+    def read_all_pages():
+        return [entry for (page, _) in store.iter_entries_since("peer0")
+                for entry in page]
+    secs, entries = time_best(read_all_pages)
+    report("read every page", secs, len(entries), "entries")
+
+@benchmark
+def latest(path_count = 10000, versions_per_path = 15):
+    """Compares getting the latest entries from all history to reading
+    only the latest table."""
+    path_count = int(path_count)
+    db = SqlDb(sqlite3.connect(":memory:"))
+    store = HistoryStore(db, NullLog())
+    store.add_entries(make_history_entries(
+        "peer", path_count * int(versions_per_path), path_count))
+    print "{0} paths with {1} versions each".format(path_count,
+                                                    versions_per_path)
+
+    def latests_from_all_history():
+        entries = list(store.select_entries("peer"))
+        return [history.latest for history in
+                group_history_by_gpath(entries).itervalues()]
+    secs, latests = time_best(latests_from_all_history)
+    report("read all history, group", secs, len(latests), "paths")
+
+    secs, latests = time_best(lambda: store.read_latests("peer"))
+    report("read latest table", secs, len(latests), "paths")
+
+@benchmark
+def columns(entry_count = 500000, path_count = 50000):
+    """Compares the memory and grouping time of history read from a db
+    into a list of entries and into HistoryColumns."""
+    entry_count = int(entry_count)
+    db = SqlDb(sqlite3.connect(":memory:"))
+    store = HistoryStore(db, NullLog())
+    store.add_entries(make_history_entries(
+        "peer", entry_count, int(path_count)))
+
+    for (name, into) in (("list of entries", list),
+                         ("HistoryColumns", HistoryColumns)):
+        before = get_rss()
+        entries = into(store.select_entries("peer"))
+        report_memory(name, get_rss() - before, entry_count, "entry")
+        secs, history_by_gpath = time_best(
+            lambda: group_history_by_gpath(entries), repeat = 1)
+        report("  group by gpath", secs, entry_count, "entries")
+        entries = history_by_gpath = None
+
+@benchmark
+def diff(entry_count = 500000, path_count = 50000):
+    """Compares the memory and time of grouping two peers' histories
+    by gpath and diffing them, as lists of entries and as
+    HistoryColumns (which are keyed by ints rather than gpaths)."""
+    entry_count, path_count = int(entry_count), int(path_count)
+    db = SqlDb(sqlite3.connect(":memory:"))
+    store = HistoryStore(db, NullLog())
+    for peerid in ("peer1", "peer2"):
+        store.add_entries(make_history_entries(
+            peerid, entry_count, path_count))
+
+    for (name, into) in (("list of entries", list),
+                         ("HistoryColumns", HistoryColumns)):
+        entries1 = into(store.select_entries("peer1"))
+        entries2 = into(store.select_entries("peer2"))
+        before = get_rss()
+        secs, histories = time_best(lambda: group_histories_by_gpath(
+            entries1, entries2), repeat = 1)
+        report_memory(name, get_rss() - before, path_count * 2, "path")
+        report("  group by gpath", secs, entry_count * 2, "entries")
+        secs, _ = time_best(lambda: list(diff_histories(*histories)))
+        report("  diff", secs, path_count * 2, "paths")
+        entries1 = entries2 = histories = None
+
+@benchmark
+def records(count = 1000000):
+    """Times making Records, getting their fields, and altering them,
+    compared to plain tuples."""
+    count = int(count)
+    values = tuple(make_history_entries("peer", 1)[0])
+    entry = HistoryEntry(*values)
+    loop = xrange(count)
+    print "{0} bytes per entry, {1} with a tuple".format(
+        sys.getsizeof(entry), sys.getsizeof(values))
+
+    for (name, func) in (
+            ("tuple(values)", lambda: [tuple(values) for _ in loop]),
+            ("HistoryEntry(*values)",
+             lambda: [HistoryEntry(*values) for _ in loop]),
+            ("HistoryEntry.new(*values)",
+             lambda: [HistoryEntry.new(*values) for _ in loop]),
+            ("tuple[3]", lambda: [values[3] for _ in loop]),
+            ("entry.path", lambda: [entry.path for _ in loop]),
+            ("entry.get_path()", lambda: [entry.get_path() for _ in loop]),
+            ("entry.alter(path, size)",
+             lambda: [entry.alter(path = "other", size = 1) for _ in loop]),
+            ("entry.set_path()",
+             lambda: [entry.set_path("other") for _ in loop])):
+        secs, _ = time_best(func)
+        report(name, secs, count, "ops")
+
+@benchmark
+def inserts(entry_count = 150000, batch_size = 1000, single_count = 2000):
+    """Compares inserting history with and without a write-ahead log."""
+    entries = make_history_entries("peer", int(entry_count))
+    batch_size = int(batch_size)
+    single_entries = entries[:int(single_count)]
+    root = tempfile.mkdtemp()
+    try:
+        for (name, journal_mode, synchronous) in (
+                ("delete journal, full sync", "delete", "full"),
+                ("write-ahead log, normal sync", "wal", "normal")):
+            print name
+            def open_store(index):
+                path = os.path.join(root, "{0}{1}.db".format(journal_mode,
+                                                             index))
+                db = SqlDb(sqlite3.connect(path))
+                db.configure(journal_mode, synchronous)
+                return HistoryStore(db, NullLog())
+
+            store = open_store(0)
+            secs, _ = time_best(lambda: [store.add_entries([entry])
+                                         for entry in single_entries],
+                                repeat = 1)
+            report("  one at a time", secs, len(single_entries), "entries")
+
+            store = open_store(1)
+            secs, _ = time_best(lambda: [
+                store.add_entries(entries[start:start + batch_size])
+                for start in xrange(0, len(entries), batch_size)],
+                                repeat = 1)
+            report("  {0} at a time".format(batch_size),
+                   secs, len(entries), "entries")
+
+            store = open_store(2)
+            secs, _ = time_best(lambda: store.add_entries(entries),
+                                repeat = 1)
+            report("  all at once", secs, len(entries), "entries")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        for name, func in sorted(BENCHMARKS.iteritems()):
+            print "{0:<10} {1}".format(name, func.__doc__)
+    else:
+        BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,259 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to hash files quickly.  Reading a file
+# with file.read(n) allocates a new string for every block, which
+# then has to be freed, so instead we read into one bytearray per
+# thread (with readinto) and hash a memoryview of the part that was
+# read, so no bytes are copied outside of the kernel.
+#
+# The best block size depends on the disk and the hash, so we don't
+# hard-code it.  A BlockSizeTuner measures the throughput of full
+# blocks (small files don't tell us anything) and keeps doubling the
+# block size while that makes things faster.  Once it stops helping,
+# the tuner settles on the best size it saw.
+#
+# For big files, a FileHasher can optionally mmap the file and hash
+# it in place.  That saves a copy into user space, but if another
+# process truncates the file while we're hashing, we get a SIGBUS,
+# so it's off by default.
+#
+# A sparse file (see sparse.py) is hashed by reading only its data,
+# and hashing zeros for its holes, which gives the same hash without
+# reading them.
+
+import io
+import mmap
+import threading
+import time
+
+from sparse import get_sparse_data_extents
+
+KB = 1024
+MB = 1024 * KB
+
+MIN_BLOCK_SIZE = 64 * KB
+MAX_BLOCK_SIZE = 8 * MB
+DEFAULT_BLOCK_SIZE = 256 * KB
+
+# How many bytes to read at a block size before judging it.
+TUNING_SAMPLE_BYTES = 32 * MB
+# How much faster a bigger block size must be to be worth moving to.
+TUNING_MIN_GAIN = 0.05
+
+DEFAULT_MMAP_THRESHOLD = 64 * MB
+
+class BlockSizeTuner:
+    """Picks a block size by measuring the throughput of each size,
+    starting small and doubling until a bigger size isn't at least
+    TUNING_MIN_GAIN faster.  Safe to use from many threads."""
+    def __init__(self, initial_size = DEFAULT_BLOCK_SIZE,
+                 min_size = MIN_BLOCK_SIZE, max_size = MAX_BLOCK_SIZE,
+                 sample_bytes = TUNING_SAMPLE_BYTES):
+        self.size = max(min_size, min(initial_size, max_size))
+        self.max_size = max_size
+        self.sample_bytes = sample_bytes
+        self.settled = False
+        self.rates = {}  # block size => bytes/sec
+        self.sampled_bytes = 0
+        self.sampled_secs = 0.0
+        self.lock = threading.Lock()
+
+    # Only full blocks should be recorded, since a short read (at the
+    # end of a file) doesn't show how fast a block of size can be.
+    def record(self, size, byte_count, secs):
+        if self.settled:
+            return
+
+        with self.lock:
+            if self.settled or size != self.size:
+                return  # Measured at a size we've moved on from.
+
+            self.sampled_bytes += byte_count
+            self.sampled_secs += secs
+            if self.sampled_bytes >= self.sample_bytes:
+                self.judge_sample()
+
+    def judge_sample(self):
+        rate = self.sampled_bytes / max(self.sampled_secs, 1e-9)
+        self.rates[self.size] = rate
+        self.sampled_bytes = 0
+        self.sampled_secs = 0.0
+
+        smaller_rate = self.rates.get(self.size // 2)
+        if (smaller_rate is not None and
+            rate < smaller_rate * (1 + TUNING_MIN_GAIN)):
+            self.settle()
+        elif self.size * 2 > self.max_size:
+            self.settle()
+        else:
+            self.size *= 2
+
+    def settle(self):
+        self.size = max(self.rates, key = self.rates.get)
+        self.settled = True
+
+class FixedBlockSize:
+    """A stand-in for BlockSizeTuner that never changes."""
+    def __init__(self, size):
+        self.size = size
+
+    def record(self, size, byte_count, secs):
+        pass
+
+class FileHasher:
+    """Hashes files, reusing one buffer per thread.  If block_size is
+    given, it's used for every read.  Otherwise, it's tuned as we go.
+    If use_mmap, files of at least mmap_threshold bytes are mmap'ed
+    rather than read.  If given an IoThrottle, every block counts as
+    background IO."""
+    def __init__(self, block_size = None, use_mmap = False,
+                 mmap_threshold = DEFAULT_MMAP_THRESHOLD, throttle = None):
+        if block_size:
+            self.block_size = FixedBlockSize(block_size)
+        else:
+            self.block_size = BlockSizeTuner()
+        self.use_mmap = use_mmap
+        self.mmap_threshold = mmap_threshold
+        self.throttle = throttle
+        self.buffers = threading.local()
+
+    # Takes an encoded path and a HashType (see hashtypes.py).
+    # Raises IOError if the file can't be read.
+    def hash(self, encoded_path, hash_type):
+        return self.hash_many(encoded_path, [hash_type])[0]
+
+    # Like hash, but hashes the file with each of the hash_types while
+    # reading it only once.  returns [digest], in the same order.  If
+    # given a chunker (a GearChunker), it's fed the same blocks, and
+    # finished.  If given a start and/or length, only that part of the
+    # file is read.
+    def hash_many(self, encoded_path, hash_types, chunker = None,
+                  start = 0, length = None):
+        hashers = [hash_type.constructor() for hash_type in hash_types]
+        updates = [hasher.update for hasher in hashers]
+        if chunker is not None:
+            updates.append(chunker.update)
+        if len(updates) == 1:
+            update = updates[0]
+        else:
+            def update(data):
+                for update_one in updates:
+                    update_one(data)
+
+        with io.open(encoded_path, "rb", buffering = 0) as file:
+            hashed = False
+            if start:
+                file.seek(start)
+            elif length is None:
+                size, extents = get_sparse_data_extents(file.fileno())
+                if extents is not None:
+                    self.hash_sparse(file, size, extents, update)
+                    hashed = True
+                elif self.use_mmap and size >= self.mmap_threshold:
+                    try:
+                        self.hash_mapped(file, size, update)
+                        hashed = True
+                    except (EnvironmentError, ValueError):
+                        # Some file systems can't mmap.  We haven't
+                        # hashed anything yet, so just read instead.
+                        file.seek(0)
+
+            if not hashed:
+                self.hash_read(file, update, length)
+        if chunker is not None:
+            chunker.finish()
+        return [hasher.digest() for hasher in hashers]
+
+    # Reads to the end of the file, or up to length bytes.
+    def hash_read(self, file, update, length = None):
+        tuner = self.block_size
+        throttle = self.throttle
+        clock = time.time
+        while True:
+            size = tuner.size
+            buffer, view = self.get_buffer(size)
+            if length is not None:
+                if length <= 0:
+                    return
+                if length < size:
+                    buffer = view[:length]
+                length -= size
+            before = clock()
+            read_count = file.readinto(buffer)
+            if not read_count:
+                return
+
+            if read_count == size:
+                update(view)
+                tuner.record(size, read_count, clock() - before)
+            else:
+                update(view[:read_count])
+            if throttle is not None:
+                throttle.take(read_count)
+
+    # Reads just the extents [(loc, size)] of data, and hashes zeros
+    # for the holes between them.
+    def hash_sparse(self, file, size, extents, update):
+        loc = 0
+        for (data_loc, data_size) in extents + [(size, 0)]:
+            if data_loc > loc:
+                self.hash_zeros(data_loc - loc, update)
+            if data_size:
+                file.seek(data_loc)
+                self.hash_read(file, update, data_size)
+            loc = data_loc + data_size
+
+    def hash_zeros(self, count, update):
+        zeros = buffer("\0" * min(count, self.block_size.size))
+        while count >= len(zeros):
+            update(zeros)
+            count -= len(zeros)
+        if count:
+            update(buffer(zeros, 0, count))
+
+    def hash_mapped(self, file, size, update):
+        mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            # buffer(...) is a view, not a copy.  We go a block at a
+            # time, so the kernel can drop pages we've already hashed.
+            block_size = self.block_size.size
+            throttle = self.throttle
+            for start in xrange(0, size, block_size):
+                update(buffer(mapped, start, block_size))
+                if throttle is not None:
+                    throttle.take(min(block_size, size - start))
+        finally:
+            mapped.close()
+
+    # returns (bytearray, memoryview) of size for the current thread.
+    def get_buffer(self, size):
+        buffers = self.buffers
+        if getattr(buffers, "size", None) != size:
+            buffers.buffer = bytearray(size)
+            buffers.view = memoryview(buffers.buffer)
+            buffers.size = size
+        return buffers.buffer, buffers.view
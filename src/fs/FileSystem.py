@@ -28,18 +28,77 @@
 # especially for the purpose of scanning it to see what files are
 # different.  It works really hard to do so fast.
 
-import hashlib
 import logging
 import os
 import platform
+import Queue
 import shutil
 import sys
+import threading
+
+from util import Record, start_thread
+
+from FileHasher import FileHasher
+from hashtypes import get_hash_type
+from throttle import FOREGROUND
+from sparse import get_sparse_data_extents
+from ignorefiles import is_ignored, push_ignore_rules
+
+# os.scandir (python 3.5+), or the scandir backport for older pythons,
+# gives us the file type of every child of a directory for free, which
+# saves 2-3 syscalls per file when walking a tree.  Without either, we
+# fall back to listdir + isdir + islink + stat.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class ListDirEntry(Record("name", "path")):
+    """What we use instead of a scandir DirEntry if we don't have
+    scandir.  It has the same methods, but each one is a syscall."""
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+class CachedDirEntry(Record("name", "path", "kind")):
+    """What we use instead of a scandir DirEntry when the children of
+    a directory come from a DirCache."""
+    def is_dir(self):
+        return self.kind != FILE_KIND
+
+    def is_symlink(self):
+        return self.kind == DIR_LINK_KIND
+
+    def stat(self):
+        return os.stat(self.path)
+
+def get_dir_entry_kind(entry):
+    if entry.is_dir():
+        return DIR_LINK_KIND if entry.is_symlink() else DIR_KIND
+    else:
+        return FILE_KIND
 
-from util import Record
+def listdir_entries(encoded_dir):
+    join = os.path.join
+    return (ListDirEntry(name, join(encoded_dir, name))
+            for name in os.listdir(encoded_dir))
 
 DELETED_SIZE = 0
 DELETED_MTIME = 0
 
+# The kinds of children of a directory, as stored in a DirCache.
+DIR_KIND = "d"
+DIR_LINK_KIND = "l"
+FILE_KIND = "f"
+
 class RootedPath(Record("root", "rel")):
     """ Represents a path (rel) that is relative to another path
     (root).  For examples, when scanning a large directory, it is
@@ -60,6 +119,20 @@ class FileStat(Record("rpath", "size", "mtime")):
     def deleted(entry):
         return entry.mtime == DELETED_MTIME
 
+# Which file a path is, as far as the OS can tell.  If a file is
+# moved on the same device, its identity stays the same.
+class FileIdentity(Record("dev", "ino", "size", "mtime_ns")):
+    @classmethod
+    def from_stat(cls, stats):
+        mtime_ns = getattr(stats, "st_mtime_ns", None)
+        if mtime_ns is None:
+            mtime_ns = int(stats.st_mtime * 1000000000)
+        return cls.new(stats.st_dev, stats.st_ino, stats.st_size, mtime_ns)
+
+SHA1 = get_hash_type("sha1")
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
 STAT_SIZE_INDEX  = 6
 STAT_MTIME_INDEX = 8
  
@@ -109,6 +182,10 @@ class UnixPathEncoder(Record("encoding", "decoding")):
     def decode_path(self, path):
         return path.decode(self.decoding)
 
+    # Encodes just one path component, like a file name.
+    def encode_name(self, name):
+        return self.encode_path(name)
+
 class WindowsPathEncoder(Record("encoding", "decoding")):
     def encode_path(self, path):
         win_path = "\\\\?\\" + os.path.abspath(path.replace(PATH_SEP, os.sep))
@@ -120,7 +197,14 @@ class WindowsPathEncoder(Record("encoding", "decoding")):
     def decode_path(self, win_path):
         return win_path.replace(os.sep, PATH_SEP).decode(self.decoding)
 
-class FileSystem(Record("slog", "path_encoder")):
+    # Encodes just one path component, like a file name.
+    def encode_name(self, name):
+        if self.encoding:
+            return name.encode(self.encoding)
+        else:
+            return name
+
+class FileSystem(Record("slog", "path_encoder", "hasher", "throttle")):
     """Encapsulates all of the operations we need on the FileSystem.
     The most important part is probably listing/stating."""
 
@@ -129,8 +213,14 @@ class FileSystem(Record("slog", "path_encoder")):
     EXISTING_WRITE_MODE = "r+b"
 
     # slog needs to have 
-    def __new__(cls, slog):
-        return cls.new(slog, PathEncoder())
+    #
+    # If given a throttle (an IoThrottle), copying is throttled as
+    # foreground IO.  To throttle hashing, give the same throttle to
+    # the hasher.
+    def __new__(cls, slog, hasher = None, throttle = None):
+        if hasher is None:
+            hasher = FileHasher(throttle = throttle)
+        return cls.new(slog, PathEncoder(), hasher, throttle)
 
     def encode_path(fs, path):
         return fs.path_encoder.encode_path(path)
@@ -138,6 +228,18 @@ class FileSystem(Record("slog", "path_encoder")):
     def decode_path(fs, path):
         return fs.path_encoder.decode_path(path)
 
+    def encode_name(fs, name):
+        return fs.path_encoder.encode_name(name)
+
+    # Returns None if the path can't be decoded.
+    def decode_path_or_log(fs, encoded_path):
+        try:
+            return fs.decode_path(encoded_path)
+        except Exception as err:
+            fs.slog.path_error("Could not decode file path {0}: {1}"
+                               .format(repr(encoded_path), err))
+            return None
+
     def exists(fs, path):
         encoded_path = fs.encode_path(path)
         return os.path.exists(encoded_path)
@@ -167,52 +269,269 @@ class FileSystem(Record("slog", "path_encoder")):
     #
     # On my faster linux desktop machine, it's about 30,000 files/sec
     # when cached, even for 200,00 files, which is a big improvement.
-    def list_stats(fs, root, root_marker = None, names_to_ignore = frozenset()):
-        return fs.stats(fs.list(
-            root, root_marker = root_marker, names_to_ignore = names_to_ignore))
+    #
+    # With scandir, it's about 2-3x faster because we do one stat per
+    # file rather than 3 or 4.  On network file systems, where every
+    # syscall is a round trip, use threads > 1 to list many
+    # directories at once.
+    #
+    # If given a DirCache, directories that haven't changed since the
+    # last scan aren't listed again.  Only their files are stat'ed.
+    #
+    # If given a set of dirs, every directory walked is added to it,
+    # which is what a FileWatcher needs to watch.
+    #
+    # If given a subtree (a directory in the root), only it is walked,
+    # but the RootedPaths are still relative to the root.
+    #
+    # If given an ignore_dir function (such as PathFilter.ignore_dir),
+    # it's called with the path of each directory relative to its
+    # root, and if it returns True, nothing in the directory is walked.
+    #
+    # If given IgnoreFiles (see ignorefiles.py), the rules of the
+    # ignore files found while walking are followed, and ignored
+    # directories aren't walked.
+    def list_stats(fs, root, root_marker = None, names_to_ignore = frozenset(),
+                   threads = 1, dir_cache = None, dirs = None,
+                   subtree = None, ignore_dir = None, ignore_files = None):
+        return fs.walk_stats(root, root_marker = root_marker,
+                             names_to_ignore = names_to_ignore,
+                             threads = threads, dir_cache = dir_cache,
+                             dirs = dirs, subtree = subtree,
+                             ignore_dir = ignore_dir,
+                             ignore_files = ignore_files)
+
+    # yields FileStat, with the same "root marker" and "names to ignore"
+    # rules as self.list(...).  Rather than listing and then stating
+    # every path, we use scandir, which tells us whether a child is a
+    # directory or a link without any more syscalls (using d_type), so
+    # the only syscall per file is the stat.
+    #
+    # If threads > 1, directories are listed in parallel, and the
+    # FileStats are yielded in no particular order.
+    def walk_stats(fs, root, root_marker = None, names_to_ignore = frozenset(),
+                   threads = 1, dir_cache = None, dirs = None,
+                   subtree = None, ignore_dir = None, ignore_files = None):
+        scan_dir = fs.dir_scanner(root_marker, names_to_ignore,
+                                  dir_cache, dirs, ignore_dir, ignore_files)
+        encoded_root = fs.encode_path(root)
+        if subtree is None:
+            top = (root, encoded_root, encoded_root, ())
+        else:
+            # The ignore files above the subtree apply in it too.
+            ignore_stack = ()
+            if ignore_files is not None:
+                ignore_stack = fs.read_ignore_stack(
+                    ignore_files, root, subtree[len(root)+1:])
+                if ignore_stack is None:
+                    return iter([])
+            top = (root, encoded_root, fs.encode_path(subtree), ignore_stack)
+        if threads > 1:
+            return walk_in_parallel(scan_dir, top, threads)
+        else:
+            return walk_serially(scan_dir, top)
+
+    # Returns a function of (root, encoded_root, encoded_dir,
+    # ignore_stack) -> ([FileStat], [(root, encoded_root,
+    # encoded_child_dir, child_ignore_stack)]), which lists one
+    # directory.  It's the unit of work for walking.  An ignore_stack
+    # holds the rules of the ignore files above a directory (see
+    # ignorefiles.py).
+    def dir_scanner(fs, root_marker, names_to_ignore,
+                    dir_cache = None, dirs = None, ignore_dir = None,
+                    ignore_files = None):
+        if dir_cache is None:
+            list_entries = scandir or listdir_entries
+        else:
+            list_entries = fs.cached_dir_lister(dir_cache)
+        decode = fs.decode_path_or_log
+        if ignore_files is not None:
+            encoded_ignore_name = fs.encode_name(ignore_files.name)
+
+        def scan_dir(root, encoded_root, encoded_dir, ignore_stack):
+            if dirs is not None:
+                dir = decode(encoded_dir)
+                if dir is not None:
+                    dirs.add(dir)
+
+            # We need all of the children before we know if there is a
+            # root marker.
+            entries = list(list_entries(encoded_dir))
+            if root_marker is not None:
+                if any(entry.name == root_marker for entry in entries):
+                    encoded_root = encoded_dir
+                    root = decode(encoded_root)
+                    ignore_stack = ()
+
+            # We only know the directory's path relative to its root
+            # once we've looked for a root marker in it.
+            if (ignore_dir is not None and root is not None and
+                is_ignored_dir(ignore_dir, decode, encoded_root, encoded_dir)):
+                return [], []
+
+            if ignore_files is not None and root is not None:
+                rel_dir = decode(encoded_dir[len(encoded_root)+1:])
+                if rel_dir is not None:
+                    ignore_file = None
+                    for entry in entries:
+                        if entry.name == encoded_ignore_name:
+                            ignore_file = entry
+                    if ignore_file is None:
+                        ignore_files.forget(root, rel_dir)
+                    else:
+                        rules = ignore_files.load(root, rel_dir,
+                                                  ignore_file.path)
+                        if rules is not None:
+                            ignore_stack = push_ignore_rules(
+                                ignore_stack, rel_dir, rules)
+
+            file_stats = []
+            child_dirs = []
+            # If decoding root fails, no point in traversing any futher.
+            if root is not None:
+                for entry in entries:
+                    if entry.name not in names_to_ignore:
+                        if ignore_stack:
+                            rel = decode(entry.path[len(encoded_root)+1:])
+                            if rel is None or is_ignored(
+                                    ignore_stack, rel, entry.is_dir()):
+                                continue
+
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                child_dirs.append((root, encoded_root,
+                                                   entry.path, ignore_stack))
+                        else:
+                            try:
+                                stats = entry.stat()
+                            except OSError:
+                                continue  # Probably a link
+
+                            rel = decode(entry.path[len(encoded_root)+1:])
+                            if rel:
+                                file_stats.append(FileStat(
+                                    RootedPath(root, rel),
+                                    stats[STAT_SIZE_INDEX],
+                                    stats[STAT_MTIME_INDEX]))
+            return file_stats, child_dirs
+
+        return scan_dir
+
+    # returns the ignore stack (see dir_scanner) for rel_dir of root
+    # from the ignore files above it (which are read), or None if
+    # rel_dir is itself ignored.
+    def read_ignore_stack(fs, ignore_files, root, rel_dir):
+        ignore_stack = ()
+        names = rel_dir.split(PATH_SEP) if rel_dir else []
+        for depth in xrange(len(names)):
+            parent = PATH_SEP.join(names[:depth])
+            rules = ignore_files.load(root, parent, fs.encode_path(
+                join_paths(root, parent, ignore_files.name) if parent
+                else join_paths(root, ignore_files.name)))
+            if rules is not None:
+                ignore_stack = push_ignore_rules(ignore_stack, parent, rules)
+            if ignore_stack and is_ignored(
+                    ignore_stack, PATH_SEP.join(names[:depth+1]), True):
+                return None
+        return ignore_stack
+
+    # Returns a function like scandir, but which only lists a
+    # directory if its mtime is different than in the dir_cache.  It
+    # costs one stat per directory, which is much less than listing.
+    def cached_dir_lister(fs, dir_cache):
+        list_entries = scandir or listdir_entries
+        join = os.path.join
+        stat = os.stat
+        decode = fs.decode_path_or_log
+        encode_name = fs.encode_name
+
+        def list_cached_entries(encoded_dir):
+            dir = decode(encoded_dir)
+            if dir is None:
+                return list_entries(encoded_dir)
+
+            mtime = stat(encoded_dir).st_mtime
+            children = dir_cache.get(dir, mtime)
+            if children is not None:
+                return [CachedDirEntry(
+                            name, join(encoded_dir, encode_name(name)), kind)
+                        for (kind, name) in children]
+
+            entries = list(list_entries(encoded_dir))
+            children = [(get_dir_entry_kind(entry), decode(entry.name))
+                        for entry in entries]
+            if all(name is not None for (kind, name) in children):
+                dir_cache.set(dir, mtime, children)
+            return entries
+
+        return list_cached_entries
 
     # yields a RootedPath for each file found in the root.  The intial
     # root is the given root.  Deeper in, if there is a "root_marker"
-    # file in a directory, that directory becomes a new root.
-    def list(fs, root, root_marker = None, names_to_ignore = frozenset()):
+    # file in a directory, that directory becomes a new root.  If
+    # given an ignore_dir function or IgnoreFiles, files and
+    # directories are skipped as in list_stats.
+    def list(fs, root, root_marker = None, names_to_ignore = frozenset(),
+             ignore_dir = None, ignore_files = None):
         listdir = os.listdir
         join = os.path.join
         isdir = os.path.isdir
         islink = os.path.islink
-
-        def decode(encoded_path):
-            try:
-                return fs.decode_path(encoded_path)
-            except Exception as err:
-                fs.slog.path_error("Could not decode file path {0}: {1}"
-                                   .format(repr(encoded_path)), err)
-                return None
+        decode = fs.decode_path_or_log
 
         # We pass root around so that we only have to decode it once.
-        def walk(root, encoded_root, encoded_parent):
+        def walk(root, encoded_root, encoded_parent, ignore_stack):
             child_names = listdir(encoded_parent)
             if root_marker is not None:
                 if root_marker in child_names:
                     encoded_root = encoded_parent
                     root = decode(encoded_root)
+                    ignore_stack = ()
+
+            if (ignore_dir is not None and root is not None and
+                is_ignored_dir(ignore_dir, decode, encoded_root,
+                               encoded_parent)):
+                return
+
+            if ignore_files is not None and root is not None:
+                rel_parent = decode(encoded_parent[len(encoded_root)+1:])
+                if rel_parent is not None:
+                    if encoded_ignore_name in child_names:
+                        rules = ignore_files.load(
+                            root, rel_parent,
+                            join(encoded_parent, encoded_ignore_name))
+                        if rules is not None:
+                            ignore_stack = push_ignore_rules(
+                                ignore_stack, rel_parent, rules)
+                    else:
+                        ignore_files.forget(root, rel_parent)
 
             # If decoding root fails, no point in traversing any futher.
             if root is not None:
                 for child_name in child_names:
                     if child_name not in names_to_ignore:
                         encoded_full = join(encoded_parent, child_name)
-                        if isdir(encoded_full):
+                        is_dir = isdir(encoded_full)
+                        if ignore_stack:
+                            rel = decode(encoded_full[len(encoded_root)+1:])
+                            if rel is None or is_ignored(
+                                    ignore_stack, rel, is_dir):
+                                continue
+
+                        if is_dir:
                             if not islink(encoded_full):
-                                for child in \
-                                        walk(root, encoded_root, encoded_full):
+                                for child in walk(root, encoded_root,
+                                                  encoded_full, ignore_stack):
                                     yield child
                         else:
                             rel = decode(encoded_full[len(encoded_root)+1:])
                             if rel:
                                 yield RootedPath(root, rel)
 
+        if ignore_files is not None:
+            encoded_ignore_name = fs.encode_name(ignore_files.name)
         encoded_root = fs.encode_path(root)
-        return walk(root, encoded_root, encoded_root)
+        return walk(root, encoded_root, encoded_root, ())
 
     # yields FileStats
     def stats(fs, rpaths):
@@ -233,6 +552,11 @@ class FileSystem(Record("slog", "path_encoder")):
         stats = os.stat(encoded_path)
         return stats[STAT_SIZE_INDEX], stats[STAT_MTIME_INDEX]
 
+    # returns FileIdentity
+    def identify(fs, path):
+        encoded_path = fs.encode_path(path)
+        return FileIdentity.from_stat(os.stat(encoded_path))
+
     # Will not throw OSError for no path.  Will return False in that case.
     def stat_eq(fs, path, size, mtime):
         try:
@@ -258,18 +582,31 @@ class FileSystem(Record("slog", "path_encoder")):
     # totalling 145GB (about 3MB each file) in 48min, which is 17
     # files totalling 50MB/sec.  So, if you scan 30GB of new files, it
     # will take 10min.  During that time, CPU usage is ~80%.
-    def hash(fs, path, hash_type = hashlib.sha1, chunk_size = 100000):
+    #
+    # The reading is done by fs.hasher (a FileHasher), which doesn't
+    # allocate a string per block like _iter_chunks does.  hash_type
+    # is a HashType (see hashtypes.py).
+    def hash(fs, path, hash_type = SHA1):
         if hash_type == None:
             return ""
 
-        hasher = hash_type()
-        for chunk_data in fs._iter_chunks(path, chunk_size):
-            hasher.update(chunk_data)
-        return hasher.digest()
+        encoded_path = fs.encode_path(path)
+        return fs.hasher.hash(encoded_path, hash_type)
+
+    # Like hash, but with many hash types at once, while only reading
+    # the file once.  returns [digest].  If given a chunker (see
+    # chunker.py), the file is also split into chunks in the same read.
+    # If given a start and/or length, only that part of the file is
+    # hashed.
+    def hash_many(fs, path, hash_types, chunker = None,
+                  start = 0, length = None):
+        encoded_path = fs.encode_path(path)
+        return fs.hasher.hash_many(encoded_path, hash_types, chunker,
+                                   start, length)
 
     def _iter_chunks(fs, path, chunk_size):
         encoded_path = fs.encode_path(path)
-        with open(path, fs.READ_MODE) as file:
+        with open(encoded_path, fs.READ_MODE) as file:
             chunk = file.read(chunk_size)
             while chunk:
                 yield chunk
@@ -321,7 +658,13 @@ class FileSystem(Record("slog", "path_encoder")):
         encoded_from_path = fs.encode_path(from_path)
         encoded_to_path = fs.encode_path(to_path)
         fs.create_parent_dirs(to_path)
-        shutil.copyfile(encoded_from_path, encoded_to_path)
+        if not copy_file_sparse(encoded_from_path, encoded_to_path,
+                                fs.throttle):
+            if fs.throttle is None:
+                shutil.copyfile(encoded_from_path, encoded_to_path)
+            else:
+                copy_file_throttled(encoded_from_path, encoded_to_path,
+                                    fs.throttle)
         if mtime is not None:
             fs.touch(to_path, mtime)
 
@@ -337,3 +680,126 @@ class FileSystem(Record("slog", "path_encoder")):
             os.removedirs(encoded_parent_path)
         except OSError:
             pass  # Not empty
+
+# Like shutil.copyfile, but every block read and written counts as
+# foreground IO for the throttle.
+def copy_file_throttled(encoded_from_path, encoded_to_path, throttle,
+                        block_size = COPY_BLOCK_SIZE):
+    with open(encoded_from_path, "rb") as from_file:
+        with open(encoded_to_path, "wb") as to_file:
+            while True:
+                data = from_file.read(block_size)
+                if not data:
+                    break
+                to_file.write(data)
+                throttle.take(len(data) * 2, 2, FOREGROUND)
+
+# If the file is sparse (see sparse.py), copies only its data, so the
+# copy has the same holes, and returns True.  Otherwise, copies
+# nothing and returns False.  If given a throttle, every block read
+# and written counts as foreground IO.
+def copy_file_sparse(encoded_from_path, encoded_to_path, throttle = None,
+                     block_size = COPY_BLOCK_SIZE):
+    with open(encoded_from_path, "rb") as from_file:
+        size, extents = get_sparse_data_extents(from_file.fileno())
+        if extents is None:
+            return False
+
+        with open(encoded_to_path, "wb") as to_file:
+            for (loc, data_size) in extents:
+                from_file.seek(loc)
+                to_file.seek(loc)
+                while data_size > 0:
+                    data = from_file.read(min(block_size, data_size))
+                    if not data:
+                        break
+                    to_file.write(data)
+                    data_size -= len(data)
+                    if throttle is not None:
+                        throttle.take(len(data) * 2, 2, FOREGROUND)
+            # Leaves a hole at the end, if there is one.
+            to_file.truncate(size)
+    return True
+
+# returns whether ignore_dir says to skip a directory (by encoded
+# path) in a root.  Roots themselves are never skipped.
+def is_ignored_dir(ignore_dir, decode, encoded_root, encoded_dir):
+    if encoded_dir == encoded_root:
+        return False
+    rel = decode(encoded_dir[len(encoded_root)+1:])
+    return rel is not None and ignore_dir(rel)
+
+# yields FileStat from scan_dir (see FileSystem.dir_scanner), one
+# directory at a time.
+def walk_serially(scan_dir, top):
+    dirs = [top]
+    while dirs:
+        file_stats, child_dirs = scan_dir(*dirs.pop())
+        for file_stat in file_stats:
+            yield file_stat
+        # Reversed so that we walk in the same order as a recursive walk.
+        dirs.extend(reversed(child_dirs))
+
+# yields FileStat from scan_dir (see FileSystem.dir_scanner), as they
+# are found by a pool of threads.  Each thread takes a directory from
+# the queue, lists it, puts its child directories back on the queue,
+# and sends the results back to us.  We count the outstanding
+# directories so we know when we're done.  Only a few directories of
+# results are allowed to pile up, so memory stays bounded if whoever
+# is consuming the FileStats is slower than the scan.
+#
+# If a directory can't be listed, the error is raised here, just
+# like when walking serially.
+def walk_in_parallel(scan_dir, top, thread_count, max_queued_dirs = None):
+    if max_queued_dirs is None:
+        max_queued_dirs = thread_count * 4
+    dir_queue = Queue.Queue()
+    result_queue = Queue.Queue(max_queued_dirs)
+    stopped = threading.Event()
+
+    def put_result(result):
+        while not stopped.is_set():
+            try:
+                result_queue.put(result, timeout = 0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def work():
+        while True:
+            dir = dir_queue.get()
+            if dir is None or stopped.is_set():
+                return
+
+            try:
+                file_stats, child_dirs = scan_dir(*dir)
+            except Exception:
+                put_result((None, 0, sys.exc_info()))
+            else:
+                # The result has to go first, or we could count a
+                # child directory as done before its parent.
+                put_result((file_stats, len(child_dirs), None))
+                for child_dir in child_dirs:
+                    dir_queue.put(child_dir)
+
+    threads = [start_thread(work, "walk_{0}".format(index))
+               for index in xrange(thread_count)]
+
+    dir_queue.put(top)
+    pending = 1
+    try:
+        while pending:
+            file_stats, child_count, error = result_queue.get()
+            if error is not None:
+                err_type, err, trace = error
+                raise err_type, err, trace
+
+            pending += child_count - 1
+            for file_stat in file_stats:
+                yield file_stat
+    finally:
+        stopped.set()
+        for _ in threads:
+            dir_queue.put(None)
+        for thread in threads:
+            thread.join()
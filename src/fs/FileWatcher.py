@@ -0,0 +1,367 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to notice when files change, so that we
+# know which directories to scan again, rather than scanning
+# everything.  We talk to inotify directly (Linux only) rather than
+# through pyinotify, which was way too slow and used a lot of CPU.
+#
+# We only watch the directories that the last scan found (see the
+# "dirs" argument of FileSystem.list_stats), and never add watches
+# on our own.  If a new directory is created, its parent is marked
+# dirty, the scanner scans the parent, and the next call to watch()
+# adds the new directory.
+#
+# Events come in bursts (writing a big file causes lots of
+# IN_MODIFY), so we coalesce them: once things have been quiet for
+# coalesce_secs (or max_delay_secs has passed since the first
+# event), we publish the set of dirty directories.  While coalescing,
+# a delete and create of the same name (or a IN_MOVED_FROM and
+# IN_MOVED_TO with the same cookie) is recorded as a move.  Only the
+# last MAX_MOVES moves are kept until they're taken.
+#
+# A watch stays on a directory when it's moved, so when we see a
+# watched directory moved (an IN_MOVED_FROM and IN_MOVED_TO pair), we
+# change the paths of its watch and those under it to the new path.
+#
+# When idle, the watcher thread is blocked in poll(), so it uses no
+# CPU, and the memory is just a dict of watch descriptors.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+
+from util import Record, start_thread
+
+from FileSystem import PATH_SEP, join_paths, parent_path
+
+IN_MODIFY        = 0x00000002
+IN_ATTRIB        = 0x00000004
+IN_CLOSE_WRITE   = 0x00000008
+IN_MOVED_FROM    = 0x00000040
+IN_MOVED_TO      = 0x00000080
+IN_CREATE        = 0x00000100
+IN_DELETE        = 0x00000200
+IN_DELETE_SELF   = 0x00000400
+IN_MOVE_SELF     = 0x00000800
+IN_Q_OVERFLOW    = 0x00004000
+IN_IGNORED       = 0x00008000
+IN_ONLYDIR       = 0x01000000
+IN_DONT_FOLLOW   = 0x02000000
+IN_EXCL_UNLINK   = 0x04000000
+IN_ISDIR         = 0x40000000
+
+IN_CLOEXEC       = 0o2000000
+IN_NONBLOCK      = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+              IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+# struct inotify_event {int wd; uint32 mask; uint32 cookie; uint32 len;}
+# followed by len bytes of null-padded name.
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+# The most moves kept that haven't been taken.
+MAX_MOVES = 10000
+
+class WatchError(Exception):
+    pass
+
+class FileMove(Record("from_path", "to_path")):
+    pass
+
+def load_inotify():
+    """Returns libc if it has inotify, or None."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+libc = load_inotify()
+
+def watching_supported():
+    return libc is not None
+
+class FileWatcher:
+    """Watches directories with inotify, and collects the directories
+    that have changed, which can be taken with take_dirty_dirs() or
+    wait_for_dirty_dirs().  Call watch(dirs) after every scan, start()
+    once, and stop() when done."""
+    def __init__(self, fs, clock, slog,
+                 coalesce_secs = 0.5, max_delay_secs = 5.0):
+        if libc is None:
+            raise WatchError("inotify is not available")
+        self.fs = fs
+        self.clock = clock
+        self.slog = slog
+        self.coalesce_secs = coalesce_secs
+        self.max_delay_secs = max_delay_secs
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        (self.wake_read_fd, self.wake_write_fd) = os.pipe()
+
+        self.lock = threading.Condition()
+        self.dir_by_wd = {}
+        self.wd_by_dir = {}
+        self.dirty_dirs = set()
+        self.moves = []
+        # {cookie: path} of dirs moved from, until moved to.
+        self.moved_dir_by_cookie = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # Watch exactly these directories: add new ones and remove old
+    # ones.  Directories that can't be watched (they're gone, or
+    # we're out of watches) are logged and skipped, but their
+    # parents' watches still catch changes to them.
+    def watch(self, dirs):
+        dirs = frozenset(dirs)
+        with self.lock:
+            for dir in set(self.wd_by_dir) - dirs:
+                wd = self.wd_by_dir.pop(dir)
+                self.dir_by_wd.pop(wd, None)
+                libc.inotify_rm_watch(self.fd, wd)
+
+            for dir in dirs - set(self.wd_by_dir):
+                wd = libc.inotify_add_watch(
+                    self.fd, self.fs.encode_path(dir), WATCH_MASK)
+                if wd < 0:
+                    self.slog.could_not_watch(
+                        dir, os.strerror(ctypes.get_errno()))
+                else:
+                    self.wd_by_dir[dir] = wd
+                    self.dir_by_wd[wd] = dir
+
+    @property
+    def watched_dirs(self):
+        with self.lock:
+            return frozenset(self.wd_by_dir)
+
+    def start(self):
+        self.thread = start_thread(self.run, "FileWatcher")
+
+    def stop(self):
+        self.stopped.set()
+        os.write(self.wake_write_fd, "x")
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.fd)
+        os.close(self.wake_read_fd)
+        os.close(self.wake_write_fd)
+
+    # returns a set of directories that have changed since the last
+    # call, which may be empty.
+    def take_dirty_dirs(self):
+        with self.lock:
+            dirty_dirs, self.dirty_dirs = self.dirty_dirs, set()
+            return dirty_dirs
+
+    # returns [FileMove] that have been seen since the last call.
+    def take_moves(self):
+        with self.lock:
+            moves, self.moves = self.moves, []
+            return moves
+
+    # Like take_dirty_dirs, but waits up to timeout secs (or forever)
+    # for something to change.
+    def wait_for_dirty_dirs(self, timeout = None):
+        with self.lock:
+            if not self.dirty_dirs:
+                self.lock.wait(timeout)
+            dirty_dirs, self.dirty_dirs = self.dirty_dirs, set()
+            return dirty_dirs
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        poller.register(self.wake_read_fd, select.POLLIN)
+        coalescer = EventCoalescer()
+        first_time = last_time = None
+
+        while not self.stopped.is_set():
+            # Only wake up on a timer when we have something to publish.
+            if first_time is None:
+                timeout_ms = None
+            else:
+                now = self.clock.unix_fine()
+                deadline = min(last_time + self.coalesce_secs,
+                               first_time + self.max_delay_secs)
+                timeout_ms = max(0, int((deadline - now) * 1000))
+
+            try:
+                ready = poller.poll(timeout_ms)
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if ready:
+                for event in self.read_events():
+                    coalescer.add(*event)
+                if coalescer:
+                    last_time = self.clock.unix_fine()
+                    if first_time is None:
+                        first_time = last_time
+            elif first_time is not None:
+                self.publish(coalescer)
+                coalescer = EventCoalescer()
+                first_time = last_time = None
+                # The rest were moved somewhere we don't watch.
+                self.moved_dir_by_cookie.clear()
+
+    # yields (dir, name, mask, cookie)
+    def read_events(self):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_len = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip("\0")
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # We lost events, so we don't know what changed.
+                self.slog.watch_overflowed()
+                with self.lock:
+                    self.dirty_dirs.update(self.wd_by_dir)
+                    self.lock.notify_all()
+                continue
+
+            with self.lock:
+                dir = self.dir_by_wd.get(wd)
+                if mask & IN_IGNORED:
+                    # The watch is gone, probably because the dir is.
+                    self.dir_by_wd.pop(wd, None)
+                    if dir is not None and self.wd_by_dir.get(dir) == wd:
+                        del self.wd_by_dir[dir]
+                    continue
+            if dir is None:
+                continue
+
+            if name:
+                name = self.fs.decode_path_or_log(name)
+                if name is None:
+                    continue
+            if name and mask & IN_ISDIR:
+                self.track_dir_move(join_paths(dir, name), mask, cookie)
+            yield (dir, name, mask, cookie)
+
+    # When a dir is moved from and then to, renames the watched dirs
+    # under it.  The move is within what we watch (or there'd be no
+    # IN_MOVED_TO), so the watches are still there.
+    def track_dir_move(self, path, mask, cookie):
+        if mask & IN_MOVED_FROM:
+            self.moved_dir_by_cookie[cookie] = path
+        elif mask & IN_MOVED_TO:
+            from_path = self.moved_dir_by_cookie.pop(cookie, None)
+            if from_path is not None:
+                with self.lock:
+                    self.rename_watched_dirs(from_path, path)
+
+    # Must be called with the lock held.
+    def rename_watched_dirs(self, from_dir, to_dir):
+        prefix = from_dir + PATH_SEP
+        for dir, wd in self.wd_by_dir.items():
+            if dir == from_dir or dir.startswith(prefix):
+                new_dir = to_dir + dir[len(from_dir):]
+                del self.wd_by_dir[dir]
+                self.wd_by_dir[new_dir] = wd
+                self.dir_by_wd[wd] = new_dir
+
+    def publish(self, coalescer):
+        with self.lock:
+            self.dirty_dirs.update(coalescer.dirty_dirs)
+            self.moves.extend(coalescer.moves())
+            # Nobody might be taking them.
+            del self.moves[:-MAX_MOVES]
+            self.lock.notify_all()
+
+class EventCoalescer:
+    """Collects a burst of inotify events into a set of dirty dirs and
+    a list of moves."""
+    def __init__(self):
+        self.dirty_dirs = set()
+        self.moved_from_by_cookie = {}
+        self.moved_to_by_cookie = {}
+        self.deleted_by_name = {}
+        self.created_by_name = {}
+
+    def __nonzero__(self):
+        return bool(self.dirty_dirs)
+
+    def add(self, dir, name, mask, cookie):
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # The parent will usually get an event too, but it might
+            # not be watched.
+            self.dirty_dirs.add(dir)
+            self.dirty_dirs.add(parent_path(dir))
+            return
+
+        self.dirty_dirs.add(dir)
+        path = join_paths(dir, name) if name else dir
+        if mask & IN_MOVED_FROM:
+            self.moved_from_by_cookie[cookie] = path
+        elif mask & IN_MOVED_TO:
+            self.moved_to_by_cookie[cookie] = path
+        elif mask & IN_DELETE:
+            self.deleted_by_name[name] = path
+        elif mask & IN_CREATE:
+            self.created_by_name[name] = path
+
+    def moves(self):
+        moves = []
+        for cookie, from_path in self.moved_from_by_cookie.iteritems():
+            to_path = self.moved_to_by_cookie.get(cookie)
+            if to_path is not None:
+                moves.append(FileMove(from_path, to_path))
+
+        # A delete and create of the same name somewhere else is
+        # probably a move across file systems (or by a program that
+        # copies and deletes).
+        for name, from_path in self.deleted_by_name.iteritems():
+            to_path = self.created_by_name.get(name)
+            if to_path is not None and \
+                   parent_path(to_path) != parent_path(from_path):
+                moves.append(FileMove(from_path, to_path))
+        return moves
@@ -27,40 +27,100 @@
 # The purpose of this file is to define how to filter out paths we
 # don't care about when scanning or comparing files.  We work really
 # hard to make sure it is very fast.
+#
+# Paths are relative to their group's root (like history entry
+# paths), so a glob like ".config/google-chrome/*" matches wherever
+# the group is.  Every glob is compiled into one regular expression,
+# so a path is matched once rather than once per glob, and the
+# results (ignored or not) are kept in an LRU cache.
+#
+# A glob that ends in "*" matches everything in a directory whose
+# path (plus "/") it matches, so we can skip such directories while
+# walking (see ignore_dir), rather than listing and stat'ing
+# everything in them only to ignore it.
+#
+# If given an ignore_file_name (such as ".psyncignore"), the rules in
+# ignore files with that name are followed too (see ignorefiles.py).
 
 import fnmatch
 import re
 
-from util import Record
+from util import Record, LruCache
 
-class PathFilter(Record("patterns_to_ignore", "names_to_ignore",
-                        "paths_to_ignore")):
+from ignorefiles import IgnoreFiles
+
+DEFAULT_CACHE_SIZE = 1000000
+
+class PathFilter(Record("names_to_ignore", "pattern", "dir_pattern",
+                        "cache", "ignore_files")):
     """Controls whether to ingore a path or not, which is mostly used
     for scanning and comparing files. ignore_path will be called a
-    lot, and should memoize.  Also, names_to_ignore is used directly
-    as a set in FileSystem scans.  For convenience, globs_to_ignore
-    are converted to regular expressions to ignore."""
-    def __new__(cls, globs_to_ignore, names_to_ignore):
+    lot, and memoizes.  Also, names_to_ignore is used directly as a
+    set in FileSystem scans, and ignore_dir while walking.  For
+    convenience, globs_to_ignore are converted to regular expressions
+    to ignore."""
+    def __new__(cls, globs_to_ignore, names_to_ignore,
+                cache_size = DEFAULT_CACHE_SIZE, ignore_file_name = None):
         names_to_ignore = frozenset(names_to_ignore)
-        patterns_to_ignore = compile_globs(globs_to_ignore)
-        return cls.new(patterns_to_ignore, names_to_ignore, set())
+        pattern = compile_globs(globs_to_ignore)
+        dir_pattern = compile_globs(
+            [glob for glob in globs_to_ignore if glob.endswith("*")])
+        if ignore_file_name:
+            ignore_files = IgnoreFiles(ignore_file_name)
+        else:
+            ignore_files = None
+        return cls.new(names_to_ignore, pattern, dir_pattern,
+                       LruCache(cache_size), ignore_files)
 
+    # Takes a path relative to its root.
     def ignore_path(self, path):
-        if path in self.paths_to_ignore:
-            return True
-        elif (matches_any_name(path, self.names_to_ignore) or
-              matches_any_pattern(path, self.patterns_to_ignore)):
-            self.paths_to_ignore.add(path)
-            return True
-        else:
-            return False
+        ignore = self.cache.get(path)
+        if ignore is None:
+            ignore = (matches_any_name(path, self.names_to_ignore) or
+                      matches_pattern(path, self.pattern))
+            self.cache.set(path, ignore)
+        return ignore
 
+    # Like ignore_path, but also follows the ignore files (as of the
+    # last walk) in the RootedPath's root.
+    def ignore_rpath(self, rpath):
+        return (self.ignore_path(rpath.rel) or
+                (self.ignore_files is not None and
+                 self.ignore_files.ignore_path(rpath.root, rpath.rel)))
+
+    # returns whether everything in a directory (by path relative to
+    # its root) is ignored, by a glob, so it doesn't need to be
+    # walked.  Names are checked by the walk itself.
+    def ignore_dir(self, path):
+        return matches_pattern(path + "/", self.dir_pattern)
+
+# returns one regular expression that matches whatever any of the
+# globs matches, or None if there are no globs.  Globs that start with
+# "*" (like "*.mem") share one ".*", so that the regular expression
+# doesn't scan the whole path again for each of them.
 def compile_globs(globs):
-    return [re.compile(fnmatch.translate(glob), re.IGNORECASE)
-            for glob in globs]
+    if not globs:
+        return None
+    suffixes = [translate_glob(glob[1:]) for glob in globs
+                if glob.startswith("*")]
+    others = [translate_glob(glob) for glob in globs
+              if not glob.startswith("*")]
+    if suffixes:
+        others.append(".*(?:{0})".format("|".join(suffixes)))
+    return re.compile("(?:{0})\\Z".format("|".join(others)),
+                      re.IGNORECASE | re.DOTALL)
+
+# fnmatch.translate anchors the regular expression at the end and
+# sets its flags, which we do once for all globs instead.
+def translate_glob(glob):
+    translated = fnmatch.translate(glob)
+    for suffix in (r"\Z(?ms)", r"\Z"):
+        if translated.endswith(suffix):
+            return translated[:-len(suffix)]
+    return translated
 
 def matches_any_name(path, names):
-    return frozenset(path.split("/")) & names
+    return not names.isdisjoint(path.split("/"))
 
-def matches_any_pattern(path, patterns):
-    return any(pattern.match(path) for pattern in patterns)
+def matches_pattern(path, pattern):
+    return pattern is not None and pattern.match(path) is not None
@@ -30,8 +30,19 @@
 # some kind of cloud or device storage).
 
 from FileSystem import FileSystem, FileStat, join_paths
+from FileHasher import FileHasher
+from throttle import IoThrottle, LoadMonitor, FOREGROUND, BACKGROUND
+from hashtypes import HashType, get_hash_type, register_hash_type
 from PathFilter import PathFilter
+from ignorefiles import IgnoreFiles
 from revisions import RevisionStore
-from scan import scan_and_update_history
+from dircache import DirCache
+from hashcache import HashCache
+from chunker import ChunkSettings, FileChunk, GearChunker
+from chunkstore import ChunkStore
+from rehash import HashMigration, get_hash_migration, migrate_hashes
+from hashorder import get_hash_order, PathWeights
+from FileWatcher import FileWatcher, FileMove, watching_supported
+from scan import scan_and_update_history, scan_subtrees_and_update_history
 from merge import diff_and_merge
 
@@ -0,0 +1,194 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to split files into chunks by their
+# contents ("content-defined chunking"), so that a change in the
+# middle of a file only changes the chunks around it, rather than
+# every chunk after it (as with fixed-size chunks).  That's what lets
+# us sync just the changed parts of a file and share chunks between
+# files.
+#
+# We use FastCDC (Xia et al, 2016): a "gear" rolling hash, where each
+# byte shifts the hash left one bit and adds a random value for the
+# byte, so the hash only depends on the last 32 bytes.  We cut
+# wherever the high bits of the hash are all zero.  To make it fast,
+# we don't look for a cut in the first min_size bytes of a chunk, and
+# to make chunk sizes cluster around avg_size ("normalized
+# chunking"), we use a harder mask (more bits) before avg_size and an
+# easier one after.  No chunk is bigger than max_size.
+#
+# Every peer must cut in the same places, so the gear table, masks and
+# sizes must never change for a given set of settings.
+#
+# A GearChunker is fed the same blocks as the file hash (see
+# FileHasher.hash_many), so chunking doesn't read the file again.
+# Each chunk is also hashed, with the same hash type as the file.
+#
+# A file's hash can also be made from its chunks: the hash of the list
+# of chunk hashes (see chunk_list_digest).  Since the chunks before
+# the last one don't change when a file is appended to, such a hash
+# can be updated by chunking just the end of the file (see
+# hash_file_diff in scan.py).  It's a different hash than the hash of
+# the contents, so it has its own hash type name, which includes the
+# settings, since different settings cut different chunks.
+
+import hashlib
+
+from util import Record
+
+KB = 1024
+
+DEFAULT_MIN_SIZE = 16 * KB
+DEFAULT_AVG_SIZE = 64 * KB
+DEFAULT_MAX_SIZE = 256 * KB
+
+HASH_BITS = 32
+HASH_MASK = (1 << HASH_BITS) - 1
+
+# 256 "random" 32-bit values, made from md5 so they are the same
+# everywhere.
+GEAR = tuple(int(hashlib.md5(chr(index)).hexdigest()[:8], 16)
+             for index in xrange(256))
+
+class FileChunk(Record("loc", "size", "hash")):
+    """A part of a file, starting at loc.  hash is the digest of its
+    data."""
+    pass
+
+class ChunkSettings(Record("min_size", "avg_size", "max_size")):
+    def __new__(cls, min_size = DEFAULT_MIN_SIZE,
+                avg_size = DEFAULT_AVG_SIZE, max_size = DEFAULT_MAX_SIZE):
+        assert 0 < min_size <= avg_size <= max_size, \
+               "chunk sizes must be min <= avg <= max"
+        return cls.new(min_size, avg_size, max_size)
+
+    # The mask before avg_size has 2 more bits than log2(avg_size), and
+    # the mask after has 2 less.  We use the high bits, since they
+    # depend on the most bytes.
+    @property
+    def masks(self):
+        bits = self.avg_size.bit_length() - 1
+        return (high_bits_mask(bits + 2), high_bits_mask(max(bits - 2, 1)))
+
+# returns the name of the hash type of chunk list digests made with
+# the given HashType and ChunkSettings, such as
+# "sha1-cdc-16384-65536-262144".
+def get_chunk_list_hash_type_name(hash_type, settings):
+    return "%s-cdc-%d-%d-%d" % ((hash_type.name,) + tuple(settings))
+
+# returns the hash (with the given HashType) of the (digest, not hex)
+# hashes of the given chunks, in order.
+def chunk_list_digest(hash_type, chunks):
+    hasher = hash_type.constructor()
+    for chunk in chunks:
+        hasher.update(chunk.hash)
+    return hasher.digest()
+
+def high_bits_mask(count):
+    return ((1 << count) - 1) << (HASH_BITS - count)
+
+# returns the end of the chunk that starts at start, looking no
+# further than end.  data is a bytearray.
+#
+# This is where all of the time goes, so the loops are as tight as we
+# can make them.  The hash is kept to 32 bits so that it's always a
+# (fast) int and never a long.  It's still only about 10MB/sec, which
+# is why chunking is experimental.  Computing the hashes of many
+# positions at once, as lanes of one long (shifted and added 5
+# times), gives the same cuts but isn't any faster.
+def find_cut(data, start, end, min_size, avg_size, max_size,
+             hard_mask, easy_mask):
+    size = end - start
+    if size <= min_size:
+        return end
+    if size > max_size:
+        end = start + max_size
+    normal_end = min(start + avg_size, end)
+
+    gear = GEAR
+    hash_mask = HASH_MASK
+    hash = 0
+    # The hash only depends on the last HASH_BITS bytes, so we can
+    # start that many bytes before min_size and get the same hash we
+    # would have if we had started at the beginning.
+    index = start + min_size
+    for byte in data[max(start, index - HASH_BITS):index]:
+        hash = ((hash << 1) + gear[byte]) & hash_mask
+
+    for byte in data[index:normal_end]:
+        hash = ((hash << 1) + gear[byte]) & hash_mask
+        index += 1
+        if not hash & hard_mask:
+            return index
+    for byte in data[index:end]:
+        hash = ((hash << 1) + gear[byte]) & hash_mask
+        index += 1
+        if not hash & easy_mask:
+            return index
+    return end
+
+class GearChunker:
+    """Call update(data) with each block of a file, in order, and then
+    finish(), and chunks will be [FileChunk] of the whole file.
+    Chunks are hashed with hash_type (a HashType).  If the blocks
+    don't start at the beginning of the file, loc is where they
+    start."""
+    def __init__(self, settings, hash_type, loc = 0):
+        self.settings = settings
+        self.hash_type = hash_type
+        self.masks = settings.masks
+        self.pending = bytearray()
+        self.loc = loc
+        self.chunks = []
+
+    def update(self, data):
+        self.pending += data
+        # Once we have max_size, a cut can't depend on what's next.
+        if len(self.pending) >= self.settings.max_size:
+            self.cut(self.settings.max_size)
+
+    def finish(self):
+        self.cut(1)
+        return self.chunks
+
+    # Cuts chunks from pending while there are at least min_pending
+    # bytes.
+    def cut(self, min_pending):
+        (min_size, avg_size, max_size) = self.settings
+        (hard_mask, easy_mask) = self.masks
+        pending = self.pending
+        start = 0
+        while len(pending) - start >= min_pending:
+            end = find_cut(pending, start, len(pending),
+                           min_size, avg_size, max_size,
+                           hard_mask, easy_mask)
+            hasher = self.hash_type.constructor()
+            hasher.update(buffer(pending, start, end - start))
+            self.chunks.append(
+                FileChunk(self.loc + start, end - start, hasher.digest()))
+            start = end
+        del pending[:start]
+        self.loc += start
@@ -0,0 +1,103 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to remember how files were split into
+# chunks (see chunker.py).  Chunk lists belong to contents, not paths,
+# so they're keyed by the file's hash (and hash type), which is how
+# they're linked to history entries: every entry with that hash has
+# that chunk list.  Chunks are also indexed by their own hash, so we
+# can find every file that has a given chunk.
+#
+# Chunk lists are added while hashing (from many threads) and written
+# to the db with save(), like a DirCache.
+#
+# If chunk_list_hashes is set, chunked files are hashed by their chunk
+# lists (see chunk_list_digest), so that a file that was only appended
+# to can be hashed again by chunking just its end.
+
+from util import Record
+
+from chunker import FileChunk, get_chunk_list_hash_type_name
+
+TABLE_NAME = "chunks"
+TABLE_FIELD_TYPES = ["hash_type varchar",
+                     "file_hash varchar",
+                     "loc integer",
+                     "size integer",
+                     "hash varchar",
+                     "primary key (hash_type, file_hash, loc)"]
+TABLE_FIELDS = [ft.split(" ")[0] for ft in TABLE_FIELD_TYPES[:-1]]
+
+class ChunkStore(Record("db", "settings", "min_file_size",
+                        "chunk_list_hashes", "added")):
+    """Stores [FileChunk] by (hash type name, hex file hash).  Only
+    files of at least min_file_size are worth chunking."""
+    def __new__(cls, db, settings, min_file_size = 0,
+                chunk_list_hashes = False):
+        db.create(TABLE_NAME, TABLE_FIELD_TYPES)
+        db.create_index("chunks_by_hash", TABLE_NAME, ["hash_type", "hash"])
+        return cls.new(db, settings, min_file_size, chunk_list_hashes, {})
+
+    # returns the name of the hash type of files of the given size
+    # hashed with the given HashType: the chunk list hash type if
+    # they're chunked and hashed by their chunk lists.
+    def get_file_hash_type_name(self, hash_type, size):
+        if self.chunk_list_hashes and size >= self.min_file_size:
+            return get_chunk_list_hash_type_name(hash_type, self.settings)
+        else:
+            return hash_type.name
+
+    # chunks is [FileChunk] with digests (not hex) as hashes.
+    def add(self, hash_type, file_hash, chunks):
+        self.added[(hash_type, file_hash.encode("hex"))] = chunks
+
+    # returns [FileChunk] with hex hashes, in order, or [] if we don't
+    # have the file's chunks.
+    def read_chunks(self, hash_type, file_hash):
+        return sorted(self.db.select(
+            TABLE_NAME, ["loc", "size", "hash"], into = FileChunk,
+            where = "hash_type = ? and file_hash = ?",
+            params = (hash_type, file_hash)))
+
+    # returns [(file_hash, FileChunk)] of every file with a chunk with
+    # the given (hex) hash.
+    def find_chunk(self, hash_type, hash):
+        return [(file_hash, FileChunk(loc, size, hash))
+                for (file_hash, loc, size) in self.db.select(
+                    TABLE_NAME, ["file_hash", "loc", "size"],
+                    where = "hash_type = ? and hash = ?",
+                    params = (hash_type, hash))]
+
+    def save(self):
+        if self.added:
+            added = self.added.items()
+            for key, _ in added:
+                del self.added[key]
+            self.db.replace(TABLE_NAME, TABLE_FIELDS,
+                            ((hash_type, file_hash,
+                              chunk.loc, chunk.size, chunk.hash.encode("hex"))
+                             for ((hash_type, file_hash), chunks) in added
+                             for chunk in chunks))
@@ -0,0 +1,119 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to remember what is in each directory
+# between scans, so that we don't have to list directories that
+# haven't changed.  Adding, removing, or renaming a child of a
+# directory changes the mtime of the directory, so if the mtime is the
+# same, the children are the same.  Changing a file does not change
+# the mtime of its directory, so we still have to stat the files.  We
+# also still have to visit child directories, since their children may
+# have changed.
+#
+# Children are stored in one string, each name prefixed by its
+# "kind": "d" is a directory, "l" is a link to a directory, and "f" is
+# anything else.  Names can't contain "/", so we use it to separate
+# them.
+
+import time
+
+from util import Record
+
+from FileSystem import (join_paths, PATH_SEP,
+                        DIR_KIND, DIR_LINK_KIND, FILE_KIND)
+
+TABLE_NAME = "dirs"
+TABLE_FIELD_TYPES = ["path varchar primary key",
+                     "mtime real",
+                     "children varchar"]
+TABLE_FIELDS = [ft.split(" ")[0] for ft in TABLE_FIELD_TYPES]
+
+# If a directory changed this recently, we don't trust its mtime.
+# Some file systems only have 1 or 2 second mtimes, so a child added
+# right after we list the directory might not change the mtime.
+RACY_SECS = 2
+
+class DirCache(Record("db", "listings", "updated", "removed")):
+    """A cache of {dir path: (mtime, children)}, read from the db when
+    created, and written back to the db with save().  get and set are
+    safe to call from many threads while walking."""
+    def __new__(cls, db):
+        db.create(TABLE_NAME, TABLE_FIELD_TYPES)
+        listings = dict((path, (mtime, children)) for (path, mtime, children)
+                        in db.select(TABLE_NAME, TABLE_FIELDS))
+        return cls.new(db, listings, {}, set())
+
+    # returns [(kind, name)], or None if not cached or the mtime changed.
+    def get(self, path, mtime):
+        mtime_children = self.listings.get(path)
+        if mtime_children is None or mtime_children[0] != mtime:
+            return None
+        return parse_children(mtime_children[1])
+
+    # children is [(kind, name)]
+    def set(self, path, mtime, children, now = None):
+        if now is None:
+            now = time.time()
+        if now - mtime < RACY_SECS:
+            return
+
+        old = self.listings.get(path)
+        new = (mtime, format_children(children))
+        self.listings[path] = new
+        self.updated[path] = new
+
+        # If a child directory went away, so does its whole subtree.
+        if old is not None:
+            old_dirs = set(name for (kind, name) in parse_children(old[1])
+                           if kind == DIR_KIND)
+            new_dirs = set(name for (kind, name) in children
+                           if kind == DIR_KIND)
+            for name in old_dirs - new_dirs:
+                self.removed.add(join_paths(path, name))
+
+    def save(self):
+        if self.removed:
+            for path in self.removed:
+                # "/" + 1 is "0", so this is everything under path.
+                self.db.delete(TABLE_NAME,
+                               "path = ? or (path > ? and path < ?)",
+                               (path, path + PATH_SEP, path + "0"))
+            self.removed.clear()
+
+        if self.updated:
+            self.db.replace(TABLE_NAME, TABLE_FIELDS,
+                            ((path, mtime, children) for
+                             (path, (mtime, children)) in
+                             self.updated.iteritems()))
+            self.updated.clear()
+
+def parse_children(children):
+    if not children:
+        return []
+    return [(child[0], child[1:]) for child in children.split(PATH_SEP)]
+
+def format_children(children):
+    return PATH_SEP.join(kind + name for (kind, name) in children)
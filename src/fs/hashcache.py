@@ -0,0 +1,118 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to remember the hash of each file by
+# its inode, so that a file that was moved or renamed isn't hashed
+# again.  When a directory is moved, a scan sees every file under it
+# as deleted from the old path and created at the new one, and the
+# created files would all be hashed.  But a move (on the same device)
+# keeps the inode, size, and mtime, so if all of those match what we
+# remembered, so does the contents.
+#
+# Cached hashes are keyed by (device, inode) (see FileIdentity), and
+# are only used if the size, mtime (in nanoseconds), and hash type
+# also match.  A file that's changed in place keeps its inode, so its
+# entry is replaced when it's hashed again.
+#
+# A scan doesn't see the inodes of files it doesn't hash, so we can't
+# tell which entries are for files that are gone.  Instead, entries
+# not hashed or reused for max_age_secs are dropped when saving, so
+# the cache (all of which is read every run) doesn't grow forever.
+
+import time
+
+from util import Record
+
+# Entries not used for this long are dropped.
+MAX_AGE_SECS = 90 * 24 * 60 * 60
+
+TABLE_NAME = "hashes"
+TABLE_FIELD_TYPES = ["dev integer",
+                     "ino integer",
+                     "size integer",
+                     "mtime_ns integer",
+                     "hash_type varchar",
+                     "hash varchar",
+                     "used integer",
+                     "primary key (dev, ino)"]
+TABLE_FIELDS = [ft.split(" ")[0] for ft in TABLE_FIELD_TYPES[:-1]]
+
+class HashCache(Record("db", "hashes", "updated", "max_age_secs")):
+    """A cache of {(dev, ino): (size, mtime_ns, hash_type, hash, used)},
+    read from the db when created, and written back to the db with
+    save().  get and set are safe to call from many threads while
+    hashing.  Hashes are the digests returned by FileSystem.hash, and
+    used is when the entry was last set or gotten (in secs)."""
+    def __new__(cls, db, max_age_secs = MAX_AGE_SECS):
+        db.create(TABLE_NAME, TABLE_FIELD_TYPES)
+        if "used" not in db.get_fields(TABLE_NAME):
+            migrate_to_used(db)
+        hashes = dict(((dev, ino), (size, mtime_ns, hash_type,
+                                    hash.decode("hex"), used))
+                      for (dev, ino, size, mtime_ns, hash_type, hash, used)
+                      in db.select(TABLE_NAME, TABLE_FIELDS))
+        return cls.new(db, hashes, {}, max_age_secs)
+
+    # returns the hash, or None if not cached or the file changed.
+    def get(self, identity, hash_type_name):
+        (dev, ino, size, mtime_ns) = identity
+        cached = self.hashes.get((dev, ino))
+        if cached is None or cached[:3] != (size, mtime_ns, hash_type_name):
+            return None
+        hash = cached[3]
+        self.set(identity, hash_type_name, hash)
+        return hash
+
+    def set(self, identity, hash_type_name, hash):
+        (dev, ino, size, mtime_ns) = identity
+        cached = (size, mtime_ns, hash_type_name, hash, int(time.time()))
+        if self.hashes.get((dev, ino)) != cached:
+            self.hashes[(dev, ino)] = cached
+            self.updated[(dev, ino)] = cached
+
+    def save(self):
+        if self.updated:
+            self.db.replace(TABLE_NAME, TABLE_FIELDS,
+                            ((dev, ino, size, mtime_ns, hash_type,
+                              hash.encode("hex"), used)
+                             for ((dev, ino), (size, mtime_ns, hash_type,
+                                               hash, used))
+                             in self.updated.items()))
+            self.updated.clear()
+        self.prune(int(time.time()) - self.max_age_secs)
+
+    # Drops the entries last used before min_used.
+    def prune(self, min_used):
+        self.db.delete(TABLE_NAME, "used < ?", (min_used,))
+        for (key, cached) in self.hashes.items():
+            if cached[4] < min_used:
+                del self.hashes[key]
+
+# Caches from before entries had a used time count as used now.
+def migrate_to_used(db):
+    db.add_field(TABLE_NAME, "used integer")
+    db.update(TABLE_NAME, ["used"], "used is null",
+              [((int(time.time()),), ())])
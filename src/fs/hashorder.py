@@ -0,0 +1,101 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to pick the order in which files are
+# hashed.  A file isn't synced until it's hashed and its history is
+# inserted, so hashing one big file before many small ones holds them
+# all up.  Hashing small (or recently modified) files first gets more
+# files synced sooner.
+#
+# An order is a function that takes a FileDiff and returns a "key":
+# lower keys are hashed first.  Since diffs are streamed, we can't
+# sort all of them; instead, we hold a window of them in a heap and
+# always take the lowest.  A file is held back by at most window
+# files.
+
+import heapq
+
+from util import Record
+
+DEFAULT_WINDOW = 10000
+
+# Deleted files aren't hashed, so they go right away.
+def smallest_first(fdiff):
+    return 0 if fdiff.was_deleted else fdiff.size
+
+def newest_first(fdiff):
+    return -fdiff.mtime
+
+HASH_ORDERS = {"smallest": smallest_first, "newest": newest_first}
+
+class PathWeights(Record("weights", "order")):
+    """An order that hashes files under path prefixes with higher
+    weights first (by the longest matching prefix, or 0), and then in
+    the given order.  weights is {path prefix: weight}, with paths
+    relative to their group's root."""
+    def __call__(self, fdiff):
+        (_, path) = fdiff.gpath
+        weight = 0
+        longest = -1
+        for prefix, prefix_weight in self.weights.iteritems():
+            if len(prefix) > longest and path.startswith(prefix):
+                weight = prefix_weight
+                longest = len(prefix)
+        return (-weight, self.order(fdiff) if self.order else 0)
+
+# returns an order by name (one of HASH_ORDERS, or None to keep the
+# order they're found in), weighted by path_weights, if given.
+# Raises ValueError for an unknown name.
+def get_hash_order(name, path_weights = None):
+    if name is None:
+        order = None
+    elif name in HASH_ORDERS:
+        order = HASH_ORDERS[name]
+    else:
+        raise ValueError("unknown hash order: {0!r}".format(name))
+
+    if path_weights:
+        return PathWeights(path_weights, order)
+    else:
+        return order
+
+# yields the fdiffs, in the given order (a function, as above), within
+# a window of the given size.  Ties keep the order they came in.
+def order_file_diffs(fdiffs, order, window = DEFAULT_WINDOW):
+    if order is None:
+        for fdiff in fdiffs:
+            yield fdiff
+        return
+
+    heap = []
+    for index, fdiff in enumerate(fdiffs):
+        item = (order(fdiff), index, fdiff)
+        if len(heap) < window:
+            heapq.heappush(heap, item)
+        else:
+            yield heapq.heappushpop(heap, item)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
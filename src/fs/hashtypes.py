@@ -0,0 +1,84 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to keep a registry of the hash
+# algorithms ("hash types") we can hash files with, by name.  The name
+# is stored with every history entry (as its hash_type), so that
+# hashes made by different algorithms are never compared to each
+# other, and so that we can move from one algorithm to another (see
+# rehash.py).
+#
+# BLAKE2 is faster than SHA-1 on 64-bit CPUs, and isn't broken, so
+# it's the default when we have it.  It's in hashlib in python 3.6+,
+# and in the pyblake2 package for older pythons.  Without either, we
+# fall back to SHA-1.
+
+import hashlib
+
+from util import Record
+
+try:
+    from hashlib import blake2b, blake2s
+except ImportError:
+    try:
+        from pyblake2 import blake2b, blake2s
+    except ImportError:
+        blake2b = blake2s = None
+
+class HashType(Record("name", "constructor")):
+    """A hash algorithm, such as sha1.  constructor() returns a new
+    hashlib-style hash object (with update and digest)."""
+    pass
+
+HASH_TYPES = {}
+
+def register_hash_type(name, constructor):
+    HASH_TYPES[name] = HashType(name, constructor)
+
+# returns the HashType with the given name, or None if name is None,
+# which means "don't hash".  Raises ValueError for an unknown name.
+def get_hash_type(name):
+    if name is None:
+        return None
+
+    hash_type = HASH_TYPES.get(name)
+    if hash_type is None:
+        raise ValueError("Unknown hash type {0!r}.  Known types are: {1}"
+                         .format(name, ", ".join(sorted(HASH_TYPES))))
+    return hash_type
+
+# returns the name of a HashType (or "" for None), as stored in
+# history entries.
+def get_hash_type_name(hash_type):
+    return "" if hash_type is None else hash_type.name
+
+register_hash_type("sha1", hashlib.sha1)
+register_hash_type("sha256", hashlib.sha256)
+if blake2b is not None:
+    register_hash_type("blake2b", blake2b)
+    register_hash_type("blake2s", blake2s)
+
+DEFAULT_HASH_TYPE_NAME = "blake2b" if blake2b is not None else "sha1"
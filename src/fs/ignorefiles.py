@@ -0,0 +1,200 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to let users put gitignore-style ignore
+# files (".psyncignore") in their directories, so each project can
+# ignore its own node_modules or build trees.  The rules of an ignore
+# file only apply to the directory it's in and below, and paths are
+# matched relative to that directory:
+#
+#   # a comment
+#   *.log        any file or directory named *.log, at any depth
+#   /build       only build in this directory (anything with a "/"
+#                is relative to this directory)
+#   cache/       only directories named cache
+#   docs/**/*.pdf
+#   !keep.log    don't ignore keep.log, even if an earlier rule did
+#
+# Like git, the last rule that matches wins, rules in deeper ignore
+# files win over shallower ones, and nothing in an ignored directory
+# can be un-ignored, because we never look inside of it.  A group root
+# starts over: ignore files above it don't apply in it.
+#
+# Ignore files are read while walking (see FileSystem.dir_scanner),
+# and only parsed again when their mtime changes.
+
+import os
+import re
+
+from util import Record
+
+DEFAULT_NAME = ".psyncignore"
+
+class IgnoreRule(Record("regex", "negate", "dir_only")):
+    pass
+
+class IgnoreRules(Record("rules")):
+    # returns True (ignore), False (a "!" rule says not to), or None if
+    # no rule matches.  path is relative to the ignore file's dir.
+    def match(self, path, is_dir):
+        for rule in reversed(self.rules):
+            if (is_dir or not rule.dir_only) and rule.regex.match(path):
+                return not rule.negate
+        return None
+
+class IgnoreFiles(Record("name", "loaded")):
+    """The rules of the ignore files (with the given name) found while
+    walking, by (root, dir path relative to the root), with the mtimes
+    of the files they were read from.  Safe to use from many threads
+    while walking."""
+    def __new__(cls, name = DEFAULT_NAME):
+        return cls.new(name, {})
+
+    # returns the IgnoreRules of the ignore file at encoded_path, which
+    # is in rel_dir of root, or None if it can't be read.  The file is
+    # only read again if its mtime changed.
+    def load(self, root, rel_dir, encoded_path):
+        key = (root, rel_dir)
+        try:
+            mtime = os.stat(encoded_path).st_mtime
+            cached = self.loaded.get(key)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(encoded_path, "rb") as file:
+                text = file.read().decode("utf8", "replace")
+        except EnvironmentError:
+            self.forget(root, rel_dir)
+            return None
+
+        rules = parse_ignore_rules(text)
+        self.loaded[key] = (mtime, rules)
+        return rules
+
+    # For when a directory no longer has an ignore file.
+    def forget(self, root, rel_dir):
+        self.loaded.pop((root, rel_dir), None)
+
+    # returns whether a path (relative to root) is ignored by the
+    # ignore files in its directory and above, as last loaded.  Doesn't
+    # read anything.
+    def ignore_path(self, root, rel, is_dir = False):
+        stack = ()
+        names = rel.split("/")
+        for depth in xrange(len(names)):
+            rel_dir = "/".join(names[:depth])
+            cached = self.loaded.get((root, rel_dir))
+            if cached is not None:
+                stack = push_ignore_rules(stack, rel_dir, cached[1])
+            if stack and is_ignored(stack, "/".join(names[:depth+1]),
+                                    is_dir or depth < len(names) - 1):
+                return True
+        return False
+
+# A "stack" is ((base, IgnoreRules),), from shallowest to deepest,
+# where base is the path of the ignore file's dir (relative to the
+# root) plus "/", or "" at the root.
+def push_ignore_rules(stack, rel_dir, rules):
+    return stack + ((rel_dir + "/" if rel_dir else "", rules),)
+
+# returns whether the path (relative to the root) is ignored by the
+# rules in the stack.
+def is_ignored(stack, rel, is_dir):
+    for (base, rules) in reversed(stack):
+        ignore = rules.match(rel[len(base):], is_dir)
+        if ignore is not None:
+            return ignore
+    return False
+
+def parse_ignore_rules(text):
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]  # For a leading literal "#" or "!"
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # Without a "/", a pattern matches a name at any depth.
+        anchored = "/" in line
+        pattern = translate_ignore_pattern(line.lstrip("/"))
+        if not anchored:
+            pattern = "(?:.*/)?" + pattern
+        rules.append(IgnoreRule(re.compile(pattern + r"\Z", re.DOTALL),
+                                negate, dir_only))
+    return IgnoreRules(rules)
+
+# Like fnmatch.translate, but "*" and "?" don't match "/", and "**"
+# does.
+def translate_ignore_pattern(pattern):
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
+        elif char == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif char == "?":
+            parts.append("[^/]")
+            index += 1
+        elif char == "[":
+            close = find_class_end(pattern, index)
+            if close is None:
+                parts.append(re.escape(char))
+                index += 1
+            else:
+                chars = pattern[index+1:close].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append("[" + chars + "]")
+                index = close + 1
+        else:
+            parts.append(re.escape(char))
+            index += 1
+    return "".join(parts)
+
+# returns the index of the "]" that ends the [...] starting at index,
+# or None if there isn't one.
+def find_class_end(pattern, index):
+    index += 1
+    if pattern.startswith("!", index):
+        index += 1
+    if pattern.startswith("]", index):
+        index += 1
+    close = pattern.find("]", index)
+    return None if close < 0 else close
@@ -36,11 +36,22 @@ from history import MergeAction, MergeActionType, calculate_merge_actions
 from util import groupby
 
 # fetch is function of entry -> fetched_path, which will then be moved.
+# If given a committer (a BatchCommitter), it's told of every merge,
+# so the history and merge log are committed in batches as we go.  If
+# given keep_source_gpath, only source history of the gpaths it keeps
+# is merged (see calculate_merge_actions).
 def diff_and_merge(source_history, dest_history, dest_groupids,
                    fetch, revisions, fs, history_store, peerid,
-                   clock, merge_log, slog):
+                   clock, merge_log, slog, committer = None,
+                   keep_source_gpath = None):
     touches, copies, moves, deletes, undeletes, updates, uphists, conflicts = \
-             calculate_merge_actions(source_history, dest_history, revisions)
+             calculate_merge_actions(source_history, dest_history, revisions,
+                                     keep_source_gpath)
+
+    def merged(action):
+        merge(action, history_store, peerid, clock, merge_log, slog)
+        if committer is not None:
+            committer.done()
 
     # We must do copies and moves first, in case we change the source.
     for action in copies:
@@ -51,7 +62,7 @@ def diff_and_merge(source_history, dest_history, dest_groupids,
                                 action.gpath, action.older)
         with slog.copying(source_path, dest_path):
             fs.copy(source_path, dest_path, mtime = action.newer.mtime)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
         
     for action in moves:
         source_latest = action.details
@@ -61,16 +72,16 @@ def diff_and_merge(source_history, dest_history, dest_groupids,
                                 action.gpath, action.older)
         with slog.moving(source_path, dest_path):
             fs.move(source_path, dest_path, mtime = action.newer.mtime)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
     for action in uphists:
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
     for action in touches:
         dest_path = verify_stat(fs, dest_groupids,
                                 action.gpath, action.older)
         fs.touch(dest_path, action.newer.mtime)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
     for action in deletes:
         dest_path = get_dest_path(dest_groupids, action.gpath)
@@ -78,7 +89,7 @@ def diff_and_merge(source_history, dest_history, dest_groupids,
             dest_path = verify_stat(fs, dest_groupids,
                                     action.gpath, action.older)
             trash(fs, dest_path, revisions, action.older, slog)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
     for action in undeletes:
         rev_entry = action.details
@@ -87,7 +98,7 @@ def diff_and_merge(source_history, dest_history, dest_groupids,
         trash(fs, dest_path, revisions, action.older, slog)
         with slog.untrashing(rev_entry, dest_path):
             revisions.copy_out(rev_entry, dest_path)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
     # We're going to simply resolve conflicts by letting the newer
     # mtime win.  Since a deleted mtime is 0, a non-deleted always
@@ -114,7 +125,7 @@ def diff_and_merge(source_history, dest_history, dest_groupids,
         # TODO: Move instead of copying once we have a real fetcher in place.
         with slog.copying(source_path, dest_path):
             fs.copy(source_path, dest_path, mtime = action.newer.mtime)
-        merge(action, history_store, peerid, clock, merge_log, slog)
+        merged(action)
 
 def get_dest_path(dest_groupids, gpath):
     (groupid, path) = gpath
@@ -0,0 +1,122 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to move history from one hash type to
+# another (say, from sha1 to blake2b) without hashing any file twice.
+#
+# Every history entry knows its hash_type, so entries of the old and
+# new types can live side by side.  While moving, we hash files with
+# both types at once (one read, see FileSystem.hash_many), which tells
+# us that an old hash and a new hash are of the same contents.  Then
+# every entry with that old hash (of any peer, and any path) is
+# "retagged" in place with the new hash (see
+# HistoryStore.retag_hashes).
+#
+# Files are hashed with both types when a scan finds them created or
+# changed, and also by migrate_hashes, which goes through the latest
+# entries that still have the old type, a limited number of bytes at a
+# time, so that it can run a bit after every scan until it's done.
+
+from util import Record
+
+from FileSystem import join_paths
+
+class HashMigration(Record("old_hash_type", "retags")):
+    """Collects (old hex hash, new hex hash) pairs until they're
+    flushed to a HistoryStore.  add is safe to call from many
+    threads."""
+    def __new__(cls, old_hash_type):
+        return cls.new(old_hash_type, [])
+
+    def add(self, old_hash, new_hash):
+        self.retags.append((old_hash.encode("hex"), new_hash.encode("hex")))
+
+    def flush(self, history_store, new_hash_type):
+        retags = self.retags[:]
+        del self.retags[:len(retags)]
+        history_store.retag_hashes(
+            self.old_hash_type.name, new_hash_type.name, retags)
+
+# Hashes up to max_bytes of files whose latest entries still have the
+# old hash type, and retags them.  Files that changed since they were
+# last scanned are skipped; the next scan will hash them.  returns
+# how many old hashes were retagged.
+def migrate_hashes(fs, history_store, peerid, groupids, hash_type,
+                   hash_migration, slog, max_bytes):
+    old_hash_type = hash_migration.old_hash_type
+    old_latests = get_old_latests(history_store, peerid, old_hash_type)
+
+    hashed_bytes = 0
+    for entry in old_latests:
+        if hashed_bytes >= max_bytes:
+            break
+
+        root = groupids.to_root(entry.groupid)
+        if root is None:
+            continue
+
+        full_path = join_paths(root, entry.path)
+        if not fs.stat_eq(full_path, entry.size, entry.mtime):
+            continue
+
+        try:
+            with slog.hashing(full_path):
+                new_hash, old_hash = fs.hash_many(
+                    full_path, [hash_type, old_hash_type])
+        except EnvironmentError as err:
+            slog.could_not_hash(full_path, err)
+            continue
+
+        # If it doesn't match, it changed without changing its size or
+        # mtime, and the next rescan won't notice either, but we
+        # shouldn't pretend it's the same.
+        if old_hash.encode("hex") == entry.hash:
+            hash_migration.add(old_hash, new_hash)
+        hashed_bytes += entry.size
+
+    retagged_count = len(hash_migration.retags)
+    hash_migration.flush(history_store, hash_type)
+    return retagged_count
+
+# returns a HashMigration from old_hash_type to hash_type (HashTypes),
+# or None if none of the latest entries of the peer have the old
+# type.  Older entries with the old type are only retagged if their
+# contents show up again, so they don't count.
+def get_hash_migration(history_store, peerid, hash_type, old_hash_type):
+    if (hash_type is None or old_hash_type is None or
+        old_hash_type == hash_type or
+        not history_store.count_hash_type(old_hash_type.name)):
+        return None
+
+    if not get_old_latests(history_store, peerid, old_hash_type):
+        return None
+    return HashMigration(old_hash_type)
+
+# returns [entry] that are latest, not deleted, and of old_hash_type.
+def get_old_latests(history_store, peerid, old_hash_type):
+    return [latest for latest in history_store.read_latests(peerid)
+            if latest.hash_type == old_hash_type.name and
+            not latest.deleted]
@@ -31,17 +31,29 @@
 # file.  We also try to do a few things intelligently, like filtering
 # in the fastest possible way and making sure the files are "stable".
 
-from history import HistoryEntry, group_history_by_gpath
-from FileSystem import DELETED_MTIME, DELETED_SIZE, mtimes_eq, RootedPath
+import itertools
+
+from history import HistoryEntry
+from FileSystem import (DELETED_MTIME, DELETED_SIZE, PATH_SEP,
+                        mtimes_eq, parent_path, RootedPath)
+from chunker import GearChunker, FileChunk, chunk_list_digest
+from hashorder import order_file_diffs
 from fs import FileStat, join_paths
-from util import Record, Enum, partition, type_constructors
+from util import (Record, Enum, partition, type_constructors, batches,
+                  parallel_map)
 
 FileDiffType = Enum("created", "changed", "deleted")
 
+# When hashing in parallel, don't read more than this much at once.
+MAX_HASH_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+
 # gpath is a GroupedPath (as in history)
 # rpath is a RootedPath (as in new scan)
+# hash_type is the name of the hash's type, once it's hashed
+# latest is the latest HistoryEntry of the path, if there is one
 @type_constructors(FileDiffType)
-class FileDiff(Record("type", "gpath", "rpath", "size", "mtime", "hash")):
+class FileDiff(Record("type", "gpath", "rpath", "size", "mtime", "hash",
+                      "hash_type", "latest")):
     @property
     def was_deleted(entry):
         return entry.mtime == DELETED_MTIME
@@ -50,29 +62,80 @@ class FileDiff(Record("type", "gpath", "rpath", "size", "mtime", "hash")):
 # system, find what's different, and update the history.  To do so, we
 # need to be able to convert from root paths to groupids and back.  To
 # do so, we expect an object called "groupids" which takes a .to_root
-# and .from_root.
+# and .from_root, and has .roots (for scanning subtrees).
+#
+# scan_threads is how many directories to list at once.  Anything
+# more than 1 is only worth it on a network file system.  If given a
+# dir_cache, unchanged directories aren't listed again.  If given a
+# set of scanned_dirs, every directory scanned is added to it (for a
+# FileWatcher).  hash_threads is how many files to hash at once.  If
+# given a hash_cache, files that were only moved or renamed aren't
+# hashed again.  hash_type is a HashType (see hashtypes.py), and if
+# given a hash_migration (see rehash.py), files are also hashed with
+# its old hash type, and entries with the old hashes are retagged.  If
+# given a chunk_store (a ChunkStore), big files are also split into
+# chunks while hashing, and the chunks are stored.  If given a
+# hash_order (see hashorder.py), files are hashed in that order rather
+# than in the order they're found.
+#
+# If given a batch_size, we stream instead (see
+# stream_scan_and_update_history), which is much better for big scans.
+#
+# Only the latest entry of each path is read (see
+# HistoryStore.read_latests), so the cost of a scan grows with the
+# number of files, not the number of times they've changed.  returns
+# [entry] that are the latest of each path after the scan.
 def scan_and_update_history(fs, fs_root, root_mark, path_filter, hash_type,
-                            history_store, peerid, groupids, clock, slog):
-    with slog.time("read history") as rt:
-        history_entries = history_store.read_entries(peerid)
-        rt.set_result({"history entries": len(history_entries)})
+                            history_store, peerid, groupids, clock, slog,
+                            scan_threads = 1, dir_cache = None,
+                            batch_size = None, scanned_dirs = None,
+                            hash_threads = 1, hash_cache = None,
+                            hash_migration = None, chunk_store = None,
+                            hash_order = None):
+    if batch_size:
+        return stream_scan_and_update_history(
+            fs, fs_root, root_mark, path_filter, hash_type,
+            history_store, peerid, groupids, clock, slog,
+            scan_threads, dir_cache, batch_size, scanned_dirs, hash_threads,
+            hash_cache, hash_migration, chunk_store, hash_order)
+
+    with slog.time("read latest history") as rt:
+        latests = history_store.read_latests(peerid)
+        rt.set_result({"latest entries": len(latests)})
 
     with slog.time("scan files") as rt:
         file_stats = list(fs.list_stats(
-            fs_root, root_mark, names_to_ignore = path_filter.names_to_ignore))
+            fs_root, root_mark, names_to_ignore = path_filter.names_to_ignore,
+            ignore_dir = path_filter.ignore_dir,
+            ignore_files = path_filter.ignore_files,
+            threads = scan_threads, dir_cache = dir_cache,
+            dirs = scanned_dirs))
         rt.set_result({"file stats": len(file_stats)})
 
+    if dir_cache is not None:
+        with slog.time("save dir cache"):
+            dir_cache.save()
+
     with slog.time("diff file stats") as rt:
-        fdiffs = diff_file_stats(file_stats, history_entries, groupids, slog)
+        fdiffs = diff_file_stats(file_stats, latests, groupids, slog)
         ignored_fdiffs, fdiffs = partition(fdiffs,
-            lambda fdiff: path_filter.ignore_path(fdiff.rpath.full))
+            lambda fdiff: path_filter.ignore_rpath(fdiff.rpath))
         slog.ignored_rpaths(fdiff.rpath for fdiff in ignored_fdiffs)
+        if hash_order is not None:
+            fdiffs.sort(key = hash_order)
         rt.set_result({"file diffs": len(fdiffs)})
 
     with slog.time("hash files") as rt:
-        hashed_fdiffs = list(hash_file_diffs(fs, fdiffs, hash_type, slog))
+        hashed_fdiffs = list(hash_file_diffs(
+            fs, fdiffs, hash_type, slog, threads = hash_threads,
+            hash_cache = hash_cache, hash_migration = hash_migration,
+            chunk_store = chunk_store))
         rt.set_result({"hashed file diffs": len(hashed_fdiffs)})
 
+    if hash_cache is not None:
+        with slog.time("save hash cache"):
+            hash_cache.save()
+
     # We rescan the files to make sure they are stable.  We might
     # decided to do this before hashing if there are lots of big
     # unstable files.  But I think we'll usually be stable.
@@ -101,17 +164,215 @@ def scan_and_update_history(fs, fs_root, root_mark, path_filter, hash_type,
         if new_entries:
             history_store.add_entries(new_entries)
 
-    # Techincally, we don't have to do this, but it's nice to log this
-    # after every scan.
-    with slog.time("reread history") as rt:
-        history_entries = history_store.read_entries(peerid)
-        history_by_gpath = group_history_by_gpath(history_entries)
-        total_size = sum(history.latest.size for history in
-                         history_by_gpath.itervalues())
-        rt.set_result({"path count": len(history_by_gpath),
+    if hash_migration is not None:
+        with slog.time("retag hashes"):
+            hash_migration.flush(history_store, hash_type)
+
+    if chunk_store is not None:
+        with slog.time("save chunks"):
+            chunk_store.save()
+
+    return reread_history(history_store, peerid, slog)
+
+# Like scan_and_update_history, but rather than doing each step for
+# all files before moving on to the next, every file flows through
+# the steps as soon as it's found:
+#
+#   list -> diff -> filter -> hash -> check stability -> insert
+#
+# Each step is a generator, so only a few files are "in flight" at
+# once, and history is inserted batch_size entries at a time.  On a
+# first scan, which can take hours, files start being synced right
+# away, and if we're killed, the next scan picks up where we left off
+# rather than starting over.
+#
+# Deletes can only be found after all files are listed, so they come
+# at the end.
+def stream_scan_and_update_history(fs, fs_root, root_mark, path_filter,
+                                   hash_type, history_store, peerid,
+                                   groupids, clock, slog, scan_threads = 1,
+                                   dir_cache = None, batch_size = 1000,
+                                   scanned_dirs = None, hash_threads = 1,
+                                   hash_cache = None, hash_migration = None,
+                                   chunk_store = None, hash_order = None):
+    with slog.time("read latest history") as rt:
+        latests = history_store.read_latests(peerid)
+        rt.set_result({"latest entries": len(latests)})
+
+    with slog.time("scan, hash, and insert history") as rt:
+        file_stats = fs.list_stats(
+            fs_root, root_mark, names_to_ignore = path_filter.names_to_ignore,
+            ignore_dir = path_filter.ignore_dir,
+            ignore_files = path_filter.ignore_files,
+            threads = scan_threads, dir_cache = dir_cache,
+            dirs = scanned_dirs)
+        fdiffs = diff_file_stats(file_stats, latests, groupids, slog)
+        inserted_count = hash_and_insert_file_diffs(
+            fs, fdiffs, path_filter, hash_type, history_store, peerid,
+            clock, slog, batch_size, hash_threads, hash_cache,
+            hash_migration, chunk_store, hash_order)
+        rt.set_result({"inserted history entries": inserted_count})
+
+    if dir_cache is not None:
+        with slog.time("save dir cache"):
+            dir_cache.save()
+
+    if hash_cache is not None:
+        with slog.time("save hash cache"):
+            hash_cache.save()
+
+    return reread_history(history_store, peerid, slog)
+
+# Like stream_scan_and_update_history, but only scans the given
+# subtrees (full paths of directories, such as the dirty dirs from a
+# FileWatcher).  Only the history under each subtree is read (using
+# HistoryStore.read_latests_under), so a file that isn't listed is
+# only considered deleted if it's in one of the subtrees.  The cost is
+# proportional to the size of the subtrees, not everything.
+#
+# Each subtree belongs to the group of the nearest directory at or
+# above it that is a group root.  Groups rooted inside of a subtree
+# are read entirely, even if their roots no longer exist.  If a
+# subtree no longer exists, everything in it is deleted.
+#
+# If given a set of scanned_dirs (as from an earlier scan), the dirs
+# in each subtree are removed from it first, and then those scanned
+# are added, so dirs that are gone aren't in it anymore.
+#
+# returns the number of history entries inserted.
+def scan_subtrees_and_update_history(fs, subtrees, root_mark, path_filter,
+                                     hash_type, history_store, peerid,
+                                     groupids, clock, slog, scan_threads = 1,
+                                     dir_cache = None, batch_size = 1000,
+                                     scanned_dirs = None, hash_threads = 1,
+                                     hash_cache = None,
+                                     hash_migration = None,
+                                     chunk_store = None, hash_order = None):
+    inserted_count = 0
+    for subtree in collapse_subtrees(subtrees):
+        root = find_group_root(subtree, groupids)
+        if root is None:
+            slog.ignored_subtree_without_root(subtree)
+            continue
+
+        if scanned_dirs is not None:
+            scanned_dirs.difference_update(
+                find_paths_under(subtree, scanned_dirs, include_path = True))
+
+        with slog.time("scan subtree") as rt:
+            if fs.isdir(subtree):
+                file_stats = list(fs.list_stats(
+                    root, root_mark,
+                    names_to_ignore = path_filter.names_to_ignore,
+                    ignore_dir = path_filter.ignore_dir,
+                    ignore_files = path_filter.ignore_files,
+                    threads = scan_threads, dir_cache = dir_cache,
+                    dirs = scanned_dirs, subtree = subtree))
+            else:
+                file_stats = []
+
+            latests = history_store.read_latests_under(
+                peerid, groupids.from_root(root), subtree[len(root)+1:])
+            # A nested root that was deleted has no file stats, but its
+            # files still need to be deleted.
+            nested_roots = set(rpath.root for (rpath, _, _) in file_stats)
+            nested_roots.update(find_roots_under(subtree, groupids))
+            nested_roots.discard(root)
+            for nested_root in nested_roots:
+                nested_groupid = groupids.from_root(nested_root)
+                if nested_groupid is not None:
+                    latests.extend(history_store.read_latests_under(
+                        peerid, nested_groupid, ""))
+
+            fdiffs = diff_file_stats(file_stats, latests, groupids, slog)
+            subtree_inserted_count = hash_and_insert_file_diffs(
+                fs, fdiffs, path_filter, hash_type, history_store, peerid,
+                clock, slog, batch_size, hash_threads, hash_cache,
+                hash_migration, chunk_store, hash_order)
+            inserted_count += subtree_inserted_count
+            rt.set_result({"subtree": subtree,
+                           "file stats": len(file_stats),
+                           "latest entries": len(latests),
+                           "inserted history entries":
+                               subtree_inserted_count})
+
+    if dir_cache is not None:
+        with slog.time("save dir cache"):
+            dir_cache.save()
+
+    if hash_cache is not None:
+        with slog.time("save hash cache"):
+            hash_cache.save()
+
+    return inserted_count
+
+# The streaming steps after diffing: filter -> order -> hash -> check
+# stability -> insert in batches.  returns the number of history
+# entries inserted.
+def hash_and_insert_file_diffs(fs, fdiffs, path_filter, hash_type,
+                               history_store, peerid, clock, slog,
+                               batch_size, hash_threads = 1,
+                               hash_cache = None, hash_migration = None,
+                               chunk_store = None, hash_order = None):
+    fdiffs = filter_ignored_file_diffs(fdiffs, path_filter, slog)
+    fdiffs = order_file_diffs(fdiffs, hash_order)
+    hashed_fdiffs = hash_file_diffs(
+        fs, fdiffs, hash_type, slog, threads = hash_threads,
+        hash_cache = hash_cache, hash_migration = hash_migration,
+        chunk_store = chunk_store)
+    stable_fdiffs = filter_stable_file_diffs(fs, hashed_fdiffs, slog)
+
+    inserted_count = 0
+    for batch in batches(stable_fdiffs, batch_size):
+        new_entries = list(new_history_entries_from_file_diffs(
+            batch, peerid, clock))
+        history_store.add_entries(new_entries)
+        inserted_count += len(new_entries)
+        if hash_migration is not None:
+            hash_migration.flush(history_store, hash_type)
+        if chunk_store is not None:
+            chunk_store.save()
+    return inserted_count
+
+# Removes paths that are in (or the same as) other paths.
+def collapse_subtrees(paths):
+    collapsed = []
+    for path in sorted(set(paths)):
+        if not (collapsed and
+                (path == collapsed[-1] or
+                 path.startswith(collapsed[-1] + PATH_SEP))):
+            collapsed.append(path)
+    return collapsed
+
+# returns the path, or nearest parent, which is a group root, or None.
+def find_group_root(path, groupids):
+    while path:
+        if groupids.from_root(path) is not None:
+            return path
+        path = parent_path(path)
+    return None
+
+# returns [root] of the groups rooted under the path (not at it).
+def find_roots_under(path, groupids):
+    return find_paths_under(path, groupids.roots)
+
+# returns [path] of the paths that are under the path (or it, if
+# include_path).
+def find_paths_under(path, paths, include_path = False):
+    prefix = path + PATH_SEP
+    return [other for other in paths
+            if other.startswith(prefix) or (include_path and other == path)]
+
+# Techincally, we don't have to do this, but it's nice to log this
+# after every scan.  returns [entry] that are the latest of each path.
+def reread_history(history_store, peerid, slog):
+    with slog.time("reread latest history") as rt:
+        latests = history_store.read_latests(peerid)
+        total_size = sum(latest.size for latest in latests)
+        rt.set_result({"path count": len(latests),
                        "total size": total_size})
 
-    return history_entries
+    return latests
 
 # yields FileDiff
 # This is the heart of diffing:
@@ -120,10 +381,12 @@ def scan_and_update_history(fs, fs_root, root_mark, path_filter, hash_type,
 #   If the file and history differ: changed
 # The trickiest one is to find the missing files, since it requires a
 # complete list of files.  A partial list wouldn't work correctly.
-def diff_file_stats(file_stats, history_entries, groupids, slog):
-    with slog.time("group history by path") as rt:
-        history_by_gpath = group_history_by_gpath(history_entries)
-        rt.set_result({"path count": len(history_by_gpath)})
+# latests is [entry] with only the latest entry of each path (see
+# HistoryStore.read_latests).
+def diff_file_stats(file_stats, latests, groupids, slog):
+    with slog.time("index latest history by path") as rt:
+        latest_by_gpath = dict((latest.gpath, latest) for latest in latests)
+        rt.set_result({"path count": len(latest_by_gpath)})
 
     with slog.time("compare to latest history"):
         for (rpath, size, mtime) in file_stats:
@@ -132,20 +395,21 @@ def diff_file_stats(file_stats, history_entries, groupids, slog):
                 slog.ignored_rpath_without_groupid(rpath)
             else:
                 gpath = (groupid, rpath.rel)
-                history = history_by_gpath.pop(gpath, None)
-                if history is None:
-                    yield FileDiff.created(gpath, rpath, size, mtime, None)
+                latest = latest_by_gpath.pop(gpath, None)
+                if latest is None:
+                    yield FileDiff.created(
+                        gpath, rpath, size, mtime, None, None, None)
                 else:
-                    latest = history.latest
                     if latest.size != size \
                            or not mtimes_eq(latest.mtime, mtime):
-                        yield FileDiff.changed(gpath, rpath, size, mtime, None)
+                        yield FileDiff.changed(
+                            gpath, rpath, size, mtime, None, None, latest)
                     else:
                         pass # unchanged
 
     with slog.time("find missing paths"):
-        for missing_gpath, missing_history in history_by_gpath.iteritems():
-            if not missing_history.latest.deleted:
+        for missing_gpath, missing_latest in latest_by_gpath.iteritems():
+            if not missing_latest.deleted:
                 (groupid, path) = missing_gpath
                 root = groupids.to_root(groupid)
                 if root is None:
@@ -153,29 +417,205 @@ def diff_file_stats(file_stats, history_entries, groupids, slog):
                 else:
                     yield FileDiff.deleted(
                         missing_gpath, RootedPath(root, path),
-                        DELETED_SIZE, DELETED_MTIME, "")
+                        DELETED_SIZE, DELETED_MTIME, "", "",
+                        missing_latest)
+
+# yields FileDiff that aren't ignored by the path_filter.
+def filter_ignored_file_diffs(fdiffs, path_filter, slog):
+    for fdiff in fdiffs:
+        if path_filter.ignore_rpath(fdiff.rpath):
+            slog.ignored_rpaths([fdiff.rpath])
+        else:
+            yield fdiff
+
+# yields FileDiff whose file hasn't changed since we diffed it, which
+# we check by stat'ing it again right after hashing.  A deleted file
+# must still be deleted.
+def filter_stable_file_diffs(fs, fdiffs, slog):
+    for fdiff in fdiffs:
+        rescan_size, rescan_mtime = DELETED_SIZE, DELETED_MTIME
+        for (_, rescan_size, rescan_mtime) in fs.stats([fdiff.rpath]):
+            pass
+
+        if fdiff.size == rescan_size and \
+               mtimes_eq(fdiff.mtime, rescan_mtime):
+            yield fdiff
+        else:
+            slog.unstable_file_diff(fdiff)
 
 # yields a file_stat_diff with the hash set if hash is successful.
 # If not successful, we log the error and simply don't yield the diff.
-def hash_file_diffs(fs, fdiffs, hash_type, slog):
-    for fdiff in fdiffs:
-        if fdiff.was_deleted:
+#
+# If threads > 1, that many files are hashed at once (hashlib releases
+# the GIL, so this can use every core), but they are still yielded in
+# the same order.  To avoid reading too many big files at once, we
+# don't start hashing a file if that would put more than
+# max_bytes_in_flight bytes of files being hashed (or hashed but not
+# yet yielded).
+#
+# If given a hash_cache (a HashCache), a file with the same identity
+# (device, inode, size, and mtime) as one we've hashed before gets
+# the same hash without being read, and everything hashed is added to
+# it.  If given a hash_migration, files are hashed with its old hash
+# type too, and the pairs of hashes are added to it.  If given a
+# chunk_store, files of at least its min_file_size are chunked while
+# they're hashed, and their chunks are added to it.  If the
+# chunk_store has chunk_list_hashes, a file that grew since its latest
+# entry (which has a chunk list) is only chunked from its last chunk
+# on (see hash_file_diff).
+def hash_file_diffs(fs, fdiffs, hash_type, slog, threads = 1,
+                    max_bytes_in_flight = MAX_HASH_BYTES_IN_FLIGHT,
+                    hash_cache = None, hash_migration = None,
+                    chunk_store = None):
+    if hash_type is None:
+        hash_cache = hash_migration = chunk_store = None
+
+    # The chunk store can only be read from this thread, so we read the
+    # old chunks here, as the fdiffs are taken.
+    fdiffs_and_old_chunks = (
+        (fdiff, read_appended_chunks(fdiff, hash_type, chunk_store))
+        for fdiff in fdiffs)
+
+    def hash((fdiff, old_chunks)):
+        return hash_file_diff(fs, fdiff, hash_type, slog, hash_cache,
+                              hash_migration, chunk_store, old_chunks)
+
+    def weigh((fdiff, _)):
+        return get_hash_size(fdiff)
+
+    if threads > 1:
+        results = parallel_map(hash, fdiffs_and_old_chunks, threads,
+                               weigh = weigh,
+                               max_weight = max_bytes_in_flight)
+    else:
+        results = itertools.imap(hash, fdiffs_and_old_chunks)
+
+    for fdiff, err in results:
+        if err is None:
             yield fdiff
         else:
-            full_path = fdiff.rpath.full
-            if not fs.isfile(full_path):
-                slog.not_a_file(full_path)
-            try:
-                # TODO: Put in nice inner-file hashing updates.
-                with slog.hashing(full_path):
-                    hash = fs.hash(full_path, hash_type)
-
-                yield fdiff.set_hash(hash)
-            except IOError as err:
-                slog.could_not_hash(full_path, err)
+            slog.could_not_hash(fdiff.rpath.full, err)
+
+# returns (fdiff with hash, None) or (fdiff, IOError or OSError)
+#
+# If given old_chunks (see read_appended_chunks), the file is assumed
+# to have only been appended to, and is only chunked from the start of
+# the last old chunk (which was cut by the old end of the file).  We
+# only check that assumption by hashing the first old chunk and the
+# one before the last (wherever the file was really modified in the
+# middle, we'd miss it), so it's a trade of safety for speed.
+def hash_file_diff(fs, fdiff, hash_type, slog, hash_cache = None,
+                   hash_migration = None, chunk_store = None,
+                   old_chunks = None):
+    if fdiff.was_deleted:
+        return fdiff, None
+    if hash_type is None:
+        return fdiff.alter(hash = "", hash_type = ""), None
+
+    full_path = fdiff.rpath.full
+    if not fs.isfile(full_path):
+        slog.not_a_file(full_path)
+    try:
+        if chunk_store is not None:
+            hash_type_name = chunk_store.get_file_hash_type_name(
+                hash_type, fdiff.size)
+        else:
+            hash_type_name = hash_type.name
+        hashes_chunk_list = (hash_type_name != hash_type.name)
+
+        if hash_cache is not None:
+            identity = fs.identify(full_path)
+            hash = hash_cache.get(identity, hash_type_name)
+            if hash is not None:
+                slog.reused_cached_hash(full_path)
+                return fdiff.alter(hash = hash,
+                                   hash_type = hash_type_name), None
+
+        chunks = None
+        if old_chunks:
+            with slog.hashing(full_path):
+                chunks = rechunk_appended_file(
+                    fs, full_path, hash_type, chunk_store.settings,
+                    old_chunks)
+            if chunks is None:
+                slog.appended_file_changed(full_path)
+
+        if chunks is not None:
+            hash = chunk_list_digest(hash_type, chunks)
+        else:
+            hash_types = [hash_type]
+            # Chunk list hashes can't be paired with old hashes.
+            if hash_migration is not None and not hashes_chunk_list:
+                hash_types.append(hash_migration.old_hash_type)
+            if (chunk_store is not None and
+                fdiff.size >= chunk_store.min_file_size):
+                chunker = GearChunker(chunk_store.settings, hash_type)
+            else:
+                chunker = None
+
+            with slog.hashing(full_path):
+                hashes = fs.hash_many(full_path, hash_types, chunker)
+
+            hash = hashes[0]
+            if len(hashes) > 1:
+                hash_migration.add(hashes[1], hash)
+            if chunker is not None:
+                chunks = chunker.chunks
+                if hashes_chunk_list:
+                    hash = chunk_list_digest(hash_type, chunks)
+
+        if chunks is not None:
+            chunk_store.add(hash_type_name, hash, chunks)
+
+        # If the file changed while we were hashing it, the hash
+        # doesn't go with either identity.
+        if hash_cache is not None and identity == fs.identify(full_path):
+            hash_cache.set(identity, hash_type_name, hash)
+        return fdiff.alter(hash = hash, hash_type = hash_type_name), None
+    except EnvironmentError as err:
+        return fdiff, err
+
+# returns the [FileChunk] (with digest hashes) of the latest entry of
+# a changed file, if the file grew and the entry's hash is a chunk
+# list hash of the chunk_store whose chunks we have.  Otherwise, None.
+# Must be called on the chunk_store's thread.
+def read_appended_chunks(fdiff, hash_type, chunk_store):
+    if chunk_store is None or not chunk_store.chunk_list_hashes:
+        return None
+    latest = fdiff.latest
+    if (fdiff.type != FileDiffType.changed or latest.deleted or
+        latest.size >= fdiff.size or
+        latest.hash_type != chunk_store.get_file_hash_type_name(
+            hash_type, latest.size)):
+        return None
+
+    chunks = chunk_store.read_chunks(latest.hash_type, latest.hash)
+    if sum(chunk.size for chunk in chunks) != latest.size:
+        return None
+    return [chunk.set_hash(chunk.hash.decode("hex")) for chunk in chunks]
+
+# returns the [FileChunk] of a file which had old_chunks before it was
+# appended to, or None if the file's start or the end of its second
+# to last old chunk doesn't match old_chunks.
+def rechunk_appended_file(fs, full_path, hash_type, settings, old_chunks):
+    kept_chunks = old_chunks[:-1]
+    for chunk in kept_chunks[:1] + kept_chunks[1:][-1:]:
+        (hash,) = fs.hash_many(full_path, [hash_type],
+                               start = chunk.loc, length = chunk.size)
+        if hash != chunk.hash:
+            return None
+
+    tail_loc = old_chunks[-1].loc
+    chunker = GearChunker(settings, hash_type, loc = tail_loc)
+    fs.hash_many(full_path, [], chunker, start = tail_loc)
+    return kept_chunks + chunker.chunks
+
+def get_hash_size(fdiff):
+    return 0 if fdiff.was_deleted else fdiff.size
 
 # Convert a file diff into a new history entry.  The hash is encoded
-# in hex.  We take the current time for the "utime".
+# in hex, and tagged with the name of its hash type.  We take the
+# current time for the "utime".
 def new_history_entries_from_file_diffs(fdiffs, peerid, clock):
     utime = int(clock.unix())
     author_peerid = peerid
@@ -184,4 +624,5 @@ def new_history_entries_from_file_diffs(fdiffs, peerid, clock):
         groupid, path = fdiff.gpath
         yield HistoryEntry(utime, peerid, groupid, path,
                            fdiff.size, fdiff.mtime, fdiff.hash.encode("hex"),
-                           author_peerid, author_utime, str(fdiff.type))
+                           author_peerid, author_utime, str(fdiff.type),
+                           fdiff.hash_type if fdiff.hash else "")
@@ -0,0 +1,102 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to find where the data is in a sparse
+# file (such as a VM disk image), so that we don't have to read its
+# holes.  A hole reads as zeros, but takes no space on disk, so we
+# hash a hole as zeros without reading it (see FileHasher), and copy
+# a file by writing only its data, leaving holes in the copy too (see
+# FileSystem.copy).
+#
+# lseek with SEEK_DATA finds the next data at or after an offset, and
+# SEEK_HOLE the next hole (the end of the file counts as a hole).  Not
+# every OS or file system supports them.  Some support them, but
+# report the whole file as data, which is still correct.
+
+import errno
+import os
+import sys
+
+# python 2 doesn't have os.SEEK_DATA and os.SEEK_HOLE, and their
+# values depend on the OS.
+if hasattr(os, "SEEK_DATA"):
+    SEEK_DATA, SEEK_HOLE = os.SEEK_DATA, os.SEEK_HOLE
+elif sys.platform.startswith(("linux", "sunos")):
+    SEEK_DATA, SEEK_HOLE = 3, 4
+elif sys.platform == "darwin":
+    SEEK_DATA, SEEK_HOLE = 4, 3
+else:
+    SEEK_DATA = SEEK_HOLE = None
+
+# Not every OS has errno.ENOTSUP.
+UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in
+                         ("EINVAL", "ENOTSUP", "EOPNOTSUPP")
+                         if hasattr(errno, name))
+
+# returns whether a file (by os.stat result) takes less space on disk
+# than its size, which means it has holes.
+def is_sparse(stat):
+    blocks = getattr(stat, "st_blocks", None)
+    return blocks is not None and blocks * 512 < stat.st_size
+
+# returns [(loc, size)] of the data in an open file (by fd) of the
+# given size, in order, or None if we can't tell.  Whatever isn't in
+# them is holes.  Leaves the file's position at 0.
+def get_data_extents(fd, size):
+    if SEEK_DATA is None:
+        return None
+
+    extents = []
+    loc = 0
+    try:
+        while loc < size:
+            try:
+                data_loc = os.lseek(fd, loc, SEEK_DATA)
+            except OSError as err:
+                # There's no more data, just a hole to the end.
+                if err.errno == errno.ENXIO:
+                    break
+                raise
+            if data_loc >= size:
+                break
+            hole_loc = min(os.lseek(fd, data_loc, SEEK_HOLE), size)
+            extents.append((data_loc, hole_loc - data_loc))
+            loc = hole_loc
+    except OSError as err:
+        if err.errno in UNSUPPORTED_ERRNOS:
+            return None
+        raise
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    return extents
+
+# returns (size, [(loc, size)]) of the data in an open file (by fd),
+# or (size, None) if it doesn't have holes or we can't tell.
+def get_sparse_data_extents(fd):
+    stat = os.fstat(fd)
+    if not is_sparse(stat):
+        return stat.st_size, None
+    return stat.st_size, get_data_extents(fd, stat.st_size)
@@ -0,0 +1,289 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The purpose of this file is to keep hashing (and other bulk disk IO)
+# from making the rest of the system unusable, especially during a
+# first scan, which can read everything for hours.
+#
+# An IoThrottle limits bytes/sec and IO operations/sec with token
+# buckets.  Work is either "foreground" (like copying a file the user
+# is waiting for) or "background" (like hashing).  Foreground work
+# never waits, but it does use up the budget, and while there's been
+# foreground work recently, background work waits for it.
+#
+# A LoadMonitor watches how busy the system is: the percentage of time
+# tasks are stalled waiting for IO (/proc/pressure/io, Linux 4.20+)
+# and the load average per CPU (/proc/loadavg).  When either is too
+# high, background work is slowed down, and sped back up slowly once
+# things are calm (like TCP congestion control).  With no byte or op
+# limit, slowing down means only being busy for a fraction of the
+# time.  Where those files don't exist, the load is never "high".
+#
+# But both count our own IO too, so when hashing a lot on an
+# otherwise idle system, they're high because of us.  So when they're
+# high, we first "probe": pause background work for probe_secs and
+# measure again (the stalls during the pause, and the tasks that are
+# running rather than the load average, which changes too slowly).
+# Only if the system is still busy while we're paused do we slow
+# down.  If it isn't, the load was ours, and we don't probe again for
+# trust_secs.
+
+import multiprocessing
+import threading
+import time
+
+FOREGROUND = "foreground"
+BACKGROUND = "background"
+
+# After foreground work, background work waits this long.
+FOREGROUND_GRACE_SECS = 0.5
+# While waiting for the foreground, check again this often.
+MAX_SLEEP_SECS = 1.0
+# The most time between takes we count as busy doing IO.
+MAX_BUSY_SECS = 1.0
+
+IO_PRESSURE_PATH = "/proc/pressure/io"
+LOADAVG_PATH = "/proc/loadavg"
+
+class TokenBucket:
+    """Refills at rate tokens/sec, holding up to burst tokens.  Taking
+    more tokens than there are leaves the bucket in debt."""
+    def __init__(self, rate, burst = None, now = None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.time() if now is None else now
+
+    # returns how many secs until the debt (if any) is paid, if it
+    # refills at rate * factor.
+    def take(self, count, now, factor = 1.0):
+        rate = self.rate * factor
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= count
+        return 0 if self.tokens >= 0 else -self.tokens / rate
+
+class LoadMonitor:
+    """Keeps a factor from min_factor to 1.0 of how fast background IO
+    should go, based on IO pressure and load not caused by us.  It's
+    halved every interval_secs that the system is overloaded, and
+    raised by recover_step every interval_secs that it isn't.  While
+    probing, get_pause says how long background IO should wait."""
+    def __init__(self, max_io_pressure = 10.0, max_load_per_cpu = 1.5,
+                 min_factor = 1.0 / 32, recover_step = 0.1,
+                 interval_secs = 1.0, probe_secs = 0.5, trust_secs = 30.0):
+        self.max_io_pressure = max_io_pressure
+        self.max_load_per_cpu = max_load_per_cpu
+        self.min_factor = min_factor
+        self.recover_step = recover_step
+        self.interval_secs = interval_secs
+        self.probe_secs = probe_secs
+        self.trust_secs = trust_secs
+        self.factor = 1.0
+        self.checked = None
+        # (time, total usecs stalled) when we last read the pressure.
+        self.stalled = None
+        self.probe_until = None
+        self.trusted_until = None
+        try:
+            self.cpu_count = multiprocessing.cpu_count()
+        except NotImplementedError:
+            self.cpu_count = 1
+
+    def get_factor(self, now):
+        self.update(now)
+        return self.factor
+
+    # returns how many secs background IO should wait (while probing).
+    def get_pause(self, now):
+        self.update(now)
+        if self.probe_until is None:
+            return 0
+        return self.probe_until - now
+
+    def update(self, now):
+        if self.probe_until is not None:
+            if now >= self.probe_until:
+                self.probe_until = None
+                self.checked = now
+                if self.overloaded(now, self.read_running_load()):
+                    self.slow_down()
+                else:
+                    self.trusted_until = now + self.trust_secs
+                    self.speed_up()
+            return
+
+        if self.checked is not None and \
+               now - self.checked < self.interval_secs:
+            return
+        self.checked = now
+        if not self.overloaded(now, read_load()):
+            self.speed_up()
+        elif self.trusted_until is not None and now < self.trusted_until:
+            # We just saw that it's only us.
+            self.speed_up()
+        else:
+            self.probe_until = now + self.probe_secs
+
+    def slow_down(self):
+        self.factor = max(self.min_factor, self.factor / 2)
+
+    def speed_up(self):
+        self.factor = min(1.0, self.factor + self.recover_step)
+
+    # load is the load of the system (not per CPU), or None.
+    def overloaded(self, now, load):
+        io_pressure = self.read_io_pressure(now)
+        if io_pressure is not None and io_pressure > self.max_io_pressure:
+            return True
+
+        return load is not None and \
+               load / self.cpu_count > self.max_load_per_cpu
+
+    # returns the percentage of the time since the last call that some
+    # task was stalled on IO, or None if not known.
+    def read_io_pressure(self, now):
+        total = read_io_stall_usecs()
+        if total is None:
+            return None
+        (last, self.stalled) = (self.stalled, (now, total))
+        if last is None or now <= last[0]:
+            return None
+        (last_time, last_total) = last
+        return (total - last_total) / ((now - last_time) * 10000.0)
+
+    # returns the number of tasks running (or ready to run) other than
+    # the one reading this, or None if not known.
+    def read_running_load(self):
+        running = read_running_count()
+        if running is None:
+            return None
+        return max(0, running - 1)
+
+class IoThrottle:
+    """Call take(byte_count, op_count, priority) after (or before) each
+    read or write.  It sleeps as long as needed to stay under
+    bytes_per_sec and ops_per_sec (either can be None for no limit),
+    slowed down by the load_monitor (if given).  Safe to use from
+    many threads."""
+    def __init__(self, bytes_per_sec = None, ops_per_sec = None,
+                 load_monitor = None, clock = time.time, sleep = time.sleep):
+        now = clock()
+        self.byte_bucket = (TokenBucket(bytes_per_sec, now = now)
+                            if bytes_per_sec else None)
+        self.op_bucket = (TokenBucket(ops_per_sec, now = now)
+                          if ops_per_sec else None)
+        self.load_monitor = load_monitor
+        self.clock = clock
+        self.sleep = sleep
+        self.foreground_until = 0
+        self.lock = threading.Lock()
+        # The last time take returned, per thread, to know how long
+        # background work has been busy since.
+        self.threads = threading.local()
+
+    def take(self, byte_count, op_count = 1, priority = BACKGROUND):
+        if priority == FOREGROUND:
+            with self.lock:
+                now = self.clock()
+                self.foreground_until = now + FOREGROUND_GRACE_SECS
+                self.take_tokens(byte_count, op_count, now, 1.0)
+            return
+
+        # Let the foreground go first, and stay out of the way of a
+        # probe of the load.
+        while True:
+            with self.lock:
+                now = self.clock()
+                wait = self.foreground_until - now
+                if self.load_monitor is not None:
+                    wait = max(wait, self.load_monitor.get_pause(now))
+            if wait <= 0:
+                break
+            self.sleep(min(wait, MAX_SLEEP_SECS))
+
+        with self.lock:
+            now = self.clock()
+            if self.load_monitor is None:
+                factor = 1.0
+            else:
+                factor = self.load_monitor.get_factor(now)
+            wait = self.take_tokens(byte_count, op_count, now, factor)
+
+        # Only be busy factor of the time.  If it's been a while since
+        # the last take, we weren't busy doing IO that whole time.
+        last_done = getattr(self.threads, "last_done", None)
+        if factor < 1.0 and last_done is not None:
+            busy = min(max(0, now - last_done), MAX_BUSY_SECS)
+            wait = max(wait, busy * (1 - factor) / factor)
+
+        if wait > 0:
+            self.sleep(wait)
+        self.threads.last_done = self.clock()
+
+    # returns how long to wait for the tokens.
+    def take_tokens(self, byte_count, op_count, now, factor):
+        wait = 0
+        if self.byte_bucket is not None:
+            wait = self.byte_bucket.take(byte_count, now, factor)
+        if self.op_bucket is not None:
+            wait = max(wait, self.op_bucket.take(op_count, now, factor))
+        return wait
+
+# returns the total microseconds that some task was stalled on IO,
+# or None if not available.
+def read_io_stall_usecs(path = IO_PRESSURE_PATH):
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if fields and fields[0] == "some":
+                    for field in fields[1:]:
+                        name, _, value = field.partition("=")
+                        if name == "total":
+                            return int(value)
+    except (EnvironmentError, ValueError):
+        pass
+    return None
+
+# returns the 1 minute load average, or None if not available.
+def read_load(path = LOADAVG_PATH):
+    try:
+        with open(path) as file:
+            return float(file.read().split()[0])
+    except (EnvironmentError, ValueError, IndexError):
+        return None
+
+# returns how many tasks are running (or ready to run) right now,
+# including the one reading it, or None if not available.  Unlike the
+# load average, tasks waiting on IO don't count.
+def read_running_count(path = LOADAVG_PATH):
+    try:
+        with open(path) as file:
+            return int(file.read().split()[3].partition("/")[0])
+    except (EnvironmentError, ValueError, IndexError):
+        return None
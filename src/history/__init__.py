@@ -29,8 +29,12 @@
 # file system).  It also contains the log for comparing histories and
 # determining what kinds of actions are necessary to merge histories.
 
-from store import HistoryStore
-from entry import History, HistoryEntry, group_history_by_gpath
+from store import HistoryStore, Watermark
+from entry import (History, HistoryEntry, group_history_by_gpath,
+                   group_histories_by_gpath)
+from columns import HistoryColumns
 from diff import HistoryDiff, HistoryDiffType, diff_histories
 from diff import MergeAction, MergeActionType, calculate_merge_actions
 from mergelog import MergeLog
+from compaction import (RetentionPolicy, CompactionCursors,
+                        compact_history)
@@ -0,0 +1,247 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# The purpose of this file is to hold lots of history in little
+# memory.  A HistoryEntry is a tuple of 11 objects, most of which are
+# strings that are the same in most entries (peerid, groupid,
+# author_peerid, author_action, hash_type) or in many (path, for every
+# version of a file).  Each takes 50-100 bytes, so a few million
+# entries take gigabytes.
+#
+# HistoryColumns stores each field in its own column instead: strings
+# are interned to small ids, numbers go in arrays, and hashes are kept
+# as raw bytes in one buffer.  A HistoryEntry is only made when asked
+# for, so it takes several times less memory.  Grouping by gpath (see
+# group_by_gpath) makes ColumnsHistories, which only make the latest
+# entry of each path right away.
+#
+# To diff two of them, rather than key both by GroupedPaths (a tuple
+# and a hash of two strings per path), we give the ids of one the ids
+# of the same strings in the other (see translate_ids), which takes
+# one lookup per string rather than per entry, and key both by ints
+# made from the ids of the groupid and path (see group_by_gpath_key).
+
+import copy
+import itertools
+from array import array
+
+from util import Record
+
+from entry import HistoryEntry, GroupedPath
+
+# Python 2's array has no 64-bit type code, and "l" is only 32 bits on
+# some platforms (Windows), where we use doubles, which are exact
+# enough (up to 2**53) for times and sizes.
+INT_TYPECODE = "l" if array("l").itemsize >= 8 else "d"
+ID_TYPECODE = "i"
+
+class HistoryColumns:
+    """A list-like, append-only container of HistoryEntry.  Iterating
+    and indexing make entries as needed.  A snapshot() shares the
+    columns, and is safe to read while more are appended to the
+    original."""
+    def __init__(self, entries = ()):
+        self.strings = []
+        self.string_ids = {}
+        self.utimes = array(INT_TYPECODE)
+        self.peerids = array(ID_TYPECODE)
+        self.groupids = array(ID_TYPECODE)
+        self.paths = array(ID_TYPECODE)
+        self.sizes = array(INT_TYPECODE)
+        self.mtimes = array(INT_TYPECODE)
+        self.hash_ends = array(INT_TYPECODE)
+        self.hash_bytes = bytearray()
+        # {index: hash} of hashes that aren't lowercase hex, and so
+        # can't be stored as raw bytes.
+        self.odd_hashes = {}
+        self.author_peerids = array(ID_TYPECODE)
+        self.author_utimes = array(INT_TYPECODE)
+        self.author_actions = array(ID_TYPECODE)
+        self.hash_types = array(ID_TYPECODE)
+        self.length = 0
+        self.read_only = False
+        self.extend(entries)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (self[index] for index in xrange(self.length))
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        strings = self.strings
+        to_int = int if INT_TYPECODE == "d" else identity
+        return HistoryEntry(to_int(self.utimes[index]),
+                            strings[self.peerids[index]],
+                            strings[self.groupids[index]],
+                            strings[self.paths[index]],
+                            to_int(self.sizes[index]),
+                            to_int(self.mtimes[index]),
+                            self.get_hash(index),
+                            strings[self.author_peerids[index]],
+                            to_int(self.author_utimes[index]),
+                            strings[self.author_actions[index]],
+                            strings[self.hash_types[index]])
+
+    def get_hash(self, index):
+        odd_hash = self.odd_hashes.get(index)
+        if odd_hash is not None:
+            return odd_hash
+        start = int(self.hash_ends[index - 1]) if index > 0 else 0
+        end = int(self.hash_ends[index])
+        return str(self.hash_bytes[start:end]).encode("hex")
+
+    # returns the id of the string, interning it if it's new.
+    def intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def append(self, entry):
+        assert not self.read_only, "can't append to a snapshot"
+        intern = self.intern
+        self.utimes.append(entry.utime)
+        self.peerids.append(intern(entry.peerid))
+        self.groupids.append(intern(entry.groupid))
+        self.paths.append(intern(entry.path))
+        self.sizes.append(entry.size)
+        self.mtimes.append(entry.mtime)
+        self.append_hash(entry.hash)
+        self.author_peerids.append(intern(entry.author_peerid))
+        self.author_utimes.append(entry.author_utime)
+        self.author_actions.append(intern(entry.author_action))
+        self.hash_types.append(intern(entry.hash_type))
+        self.length += 1
+
+    def append_hash(self, hash):
+        try:
+            raw = hash.decode("hex")
+        except (TypeError, ValueError, UnicodeError):
+            raw = None
+        if raw is None or raw.encode("hex") != hash:
+            self.odd_hashes[self.length] = hash
+            raw = ""
+        self.hash_bytes.extend(raw)
+        self.hash_ends.append(len(self.hash_bytes))
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    # returns a read-only HistoryColumns of the entries so far.  It
+    # shares the columns rather than copying them, which is safe
+    # because they're only ever appended to.
+    def snapshot(self):
+        snapshot = copy.copy(self)
+        snapshot.read_only = True
+        return snapshot
+
+    # returns {gpath: ColumnsHistory}, like group_history_by_gpath,
+    # but without making every entry.
+    def group_by_gpath(self):
+        strings = self.strings
+        key_base = len(strings)
+        return dict((GroupedPath(strings[key % key_base],
+                                 strings[key // key_base]), history)
+                    for (key, history)
+                    in self.group_by_gpath_key(key_base).iteritems())
+
+    # returns {key: ColumnsHistory}, where each key is an int made from
+    # the ids of the groupid and path.  If given id_map (see
+    # translate_ids), the ids are translated by it first.  key_base must
+    # be more than any (translated) id.
+    def group_by_gpath_key(self, key_base, id_map = None):
+        groupids = itertools.islice(self.groupids, self.length)
+        paths = itertools.islice(self.paths, self.length)
+        if id_map is not None:
+            groupids = itertools.imap(id_map.__getitem__, groupids)
+            paths = itertools.imap(id_map.__getitem__, paths)
+
+        indexes_by_key = {}
+        for (index, (groupid, path)) in enumerate(
+                itertools.izip(groupids, paths)):
+            key = path * key_base + groupid
+            indexes = indexes_by_key.get(key)
+            if indexes is None:
+                indexes_by_key[key] = [index]
+            else:
+                indexes.append(index)
+
+        return dict((key, ColumnsHistory(self, indexes))
+                    for (key, indexes) in indexes_by_key.iteritems())
+
+    # returns (id_map, key_base): id_map is an array of the ids of
+    # other's strings (by their ids in other) in our ids, and strings
+    # we don't have get new ids from len(strings) on.  key_base is more
+    # than any of them, for group_by_gpath_key.
+    def translate_ids(self, other):
+        # The strings may be added to by the original of a snapshot,
+        # so we only count those already there.
+        string_count = len(self.strings)
+        string_ids = self.string_ids
+        next_id = string_count
+        id_map = array(ID_TYPECODE)
+        for string in list(other.strings):
+            string_id = string_ids.get(string)
+            if string_id is None or string_id >= string_count:
+                string_id = next_id
+                next_id += 1
+            id_map.append(string_id)
+        return (id_map, next_id)
+
+    # returns the index of the latest of the entries at indexes.
+    def get_latest_index(self, indexes):
+        utimes = self.utimes
+        latest_utime = max(utimes[index] for index in indexes)
+        tied = [index for index in indexes if utimes[index] == latest_utime]
+        if len(tied) == 1:
+            return tied[0]
+        # Like max(entries), which compares the rest of the fields.
+        return max(tied, key = self.__getitem__)
+
+class ColumnsHistory(Record("columns", "indexes", "latest")):
+    """Like a History, but of some entries of a HistoryColumns, which
+    are only made when iterated over."""
+    def __new__(cls, columns, indexes):
+        latest = columns[columns.get_latest_index(indexes)]
+        return cls.new(columns, indexes, latest)
+
+    @property
+    def entries(self):
+        return list(self)
+
+    def __iter__(self):
+        columns = self.columns
+        return (columns[index] for index in self.indexes)
+
+def identity(value):
+    return value
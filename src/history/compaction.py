@@ -0,0 +1,184 @@
+# Copyright (c) 2011, Peter Thatcher
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#   1. Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#   3. The name of the author may not be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# The purpose of this file is to keep history from growing forever.
+# Every change of a file adds an entry, and a file that changes a lot
+# can have thousands, which are all read and compared when diffing.
+# Compaction removes old entries of a path, but always keeps:
+#
+#  the latest entry (see HistoryStore.read_latests)
+#  whatever the RetentionPolicy says to keep
+#  any entry that matches the latest entry of another peer's history
+#    of the same path in the same db
+#
+# That last one is what diff_histories needs to know that one version
+# came after another (see has_matching_entry).  Without it, a peer
+# that hasn't synced in a while would look like it's in conflict
+# rather than just being older.  Peers whose histories are in other
+# dbs (like the other side of a psync) have to be given as
+# peer_latests.
+#
+# Compaction goes through paths in order a batch at a time, and each
+# batch is its own transaction, so a scan never waits long for it.
+# Where it left off is remembered in the db (per peerid), so each run
+# can do a bounded amount of work and the next run continues from
+# there.  Once it gets to the end, it starts over.
+
+from util import Record, groupby
+
+from diff import entries_match
+from entry import HistoryEntry
+
+CURSOR_TABLE_NAME = "compaction_cursors"
+CURSOR_TABLE_FIELD_TYPES = ["peerid varchar primary key",
+                            "groupid varchar",
+                            "path varchar"]
+CURSOR_TABLE_FIELDS = [ft.split(" ")[0] for ft in CURSOR_TABLE_FIELD_TYPES]
+
+class RetentionPolicy(Record("keep_versions", "keep_secs",
+                             "keep_revisions")):
+    """Which old entries of each path to keep: the newest keep_versions
+    of them, and those newer than keep_secs.  If keep_revisions, those
+    whose contents are in the revisions (see RevisionStore) are kept
+    too.  A keep_versions of None keeps no number of versions, and a
+    keep_secs of None keeps them no matter how old.  If both are
+    None, everything is kept.  The newest entry is always kept."""
+    def __new__(cls, keep_versions = None, keep_secs = None,
+                keep_revisions = True):
+        return cls.new(keep_versions, keep_secs, keep_revisions)
+
+    @property
+    def keeps_everything(self):
+        return self.keep_versions is None and self.keep_secs is None
+
+class CompactionCursors(Record("db")):
+    """The last gpath compacted for each peerid, so that compaction can
+    pick up where it left off."""
+    def __new__(cls, db):
+        db.create(CURSOR_TABLE_NAME, CURSOR_TABLE_FIELD_TYPES)
+        return cls.new(db)
+
+    # returns (groupid, path), or None to start from the beginning.
+    def get(self, peerid):
+        for (groupid, path) in self.db.select(
+                CURSOR_TABLE_NAME, ["groupid", "path"],
+                where = "peerid = ?", params = (peerid,)):
+            return (groupid, path)
+        return None
+
+    def set(self, peerid, gpath):
+        (groupid, path) = gpath
+        self.db.replace(CURSOR_TABLE_NAME, CURSOR_TABLE_FIELDS,
+                        [(peerid, groupid, path)])
+
+    def clear(self, peerid):
+        self.db.delete(CURSOR_TABLE_NAME, "peerid = ?", (peerid,))
+
+# Compacts the history of up to max_paths paths of the peer, batch_size
+# paths at a time, starting where the last call left off.  revisions
+# is a RevisionStore (or anything that can tell if an entry is "in"
+# it), or None.  peer_latests is [entry] of the latest entries of
+# peers whose histories aren't in the history_store's db, whose
+# matching entries are kept too.  returns the number of entries
+# removed.
+def compact_history(history_store, peerid, policy, cursors, clock, slog,
+                    revisions = None, max_paths = 10000, batch_size = 100,
+                    peer_latests = ()):
+    if policy.keeps_everything:
+        return 0
+
+    peer_latests_by_gpath = groupby(peer_latests, HistoryEntry.get_gpath)
+
+    now = clock.unix()
+    removed_count = 0
+    path_count = 0
+    with slog.time("compact history") as rt:
+        while path_count < max_paths:
+            latests = history_store.read_latests_after(
+                peerid, cursors.get(peerid),
+                min(batch_size, max_paths - path_count))
+            if not latests:
+                cursors.clear(peerid)
+                break
+
+            removable = []
+            for latest in latests:
+                rows = history_store.read_gpath_rows(
+                    peerid, latest.groupid, latest.path)
+                if len(rows) > 1:
+                    other_latests = history_store.read_other_latests(
+                        peerid, latest.groupid, latest.path)
+                    other_latests.extend(
+                        peer_latests_by_gpath.get(latest.gpath, ()))
+                    removable.extend(get_removable_rows(
+                        rows, latest, policy, other_latests, revisions,
+                        now))
+            # If we die between these, the batch is just compacted
+            # again, which doesn't hurt.
+            history_store.remove_rows(removable)
+            cursors.set(peerid, latests[-1].gpath)
+            removed_count += len(removable)
+            path_count += len(latests)
+        rt.set_result({"paths": path_count,
+                       "removed history entries": removed_count})
+    return removed_count
+
+# returns [(rowid, entry)] that can be removed from the rows of one
+# path (oldest first, as from HistoryStore.read_gpath_rows).  latest
+# is the path's entry in the latest table, which is never removed,
+# and neither is the newest row.  other_latests are the latest entries
+# of the same path of other peers, which are needed to diff against
+# them.
+def get_removable_rows(rows, latest, policy, other_latests, revisions,
+                       now):
+    # Without keep_versions, only keep_secs (and the rest) keep rows.
+    if policy.keep_versions is None:
+        kept_rowids = set()
+    else:
+        kept_rowids = set(rowid for (rowid, _) in
+                          rows[max(len(rows) - policy.keep_versions, 0):])
+    # Rows are in order of (utime, rowid), so this is the newest.
+    kept_rowids.add(rows[-1][0])
+
+    def is_removable((rowid, entry)):
+        if rowid in kept_rowids or entry == latest:
+            return False
+        if policy.keep_secs is not None and \
+               entry.utime > now - policy.keep_secs:
+            return False
+        if any(entries_match(entry, other_latest)
+               for other_latest in other_latests):
+            return False
+        # This is last because it looks at the file system.
+        if policy.keep_revisions and revisions is not None and \
+               entry in revisions:
+            return False
+        return True
+
+    removable = [row for row in rows if is_removable(row)]
+    assert latest not in [entry for (_, entry) in removable]
+    return removable
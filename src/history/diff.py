@@ -28,7 +28,7 @@
 # and determine what actions would be necessary to merge the history
 # of one into the history of the other.
 
-from entry import History, HistoryEntry, group_history_by_gpath
+from entry import History, HistoryEntry, group_histories_by_gpath
 from util import Record, Enum, type_constructors, setdefault, groupby
 
 # A history conflict means that's there's a conflict, but the contents
@@ -45,7 +45,9 @@ class HistoryDiff(Record("type", "gpath", "latest1", "latest2")):
         gpath = get_gpath(latest1, latest2)
         return cls.new(type, gpath, latest1, latest2)
     
-# yields all HistoryDiffs
+# yields all HistoryDiffs.  The histories can be keyed by anything
+# that's the same for the same gpath in both (see
+# group_histories_by_gpath).
 def diff_histories(history_by_gpath1, history_by_gpath2):
     for gpath1, history1 in history_by_gpath1.iteritems():
         history2 = history_by_gpath2.get(gpath1)
@@ -70,9 +72,10 @@ def diff_histories(history_by_gpath1, history_by_gpath2):
             yield HistoryDiff.older(None, history2.latest)
 
 # True is size and hash are the same, even if other metadata is
-# different.
+# different.  If the hashes are of different types, we can't tell.
 def entries_contents_match(entry1, entry2):
     return (entry1.size  == entry2.size and
+            entry1.hash_type == entry2.hash_type and
             entry1.hash  == entry2.hash)
 
 # True only if entries are exactly the same, including author peerid
@@ -81,10 +84,15 @@ def entries_contents_match(entry1, entry2):
 # changes a file, but I don't like the change, so I change it BACK.
 # In that case, it would have the same contents hash, size, and
 # possibly mtime as the old version, but the utime would be different.
+#
+# If one peer has moved to a new hash type and the other hasn't, the
+# hashes can't be compared, but the author peerid and utime are
+# enough to know it's the same version.
 def entries_match(entry1, entry2):
     return (entry1.size  == entry2.size and
             entry1.mtime == entry2.mtime and
-            entry1.hash  == entry2.hash and
+            (entry1.hash_type != entry2.hash_type or
+             entry1.hash  == entry2.hash) and
             entry1.author_peerid == entry2.author_peerid and
             entry1.author_utime == entry2.author_utime)
         
@@ -119,9 +127,13 @@ class MergeAction(Record("type", "gpath", "older", "newer", "details")):
 #  if history conflict: resolve by updating local history
 #  if conflict: pass along as a conflict
 #  otherwise: update
-def calculate_merge_actions(source_entries, dest_entries, revisions):
+#
+# If given keep_source_gpath (a function of gpath -> bool), source
+# entries of other gpaths are ignored.
+def calculate_merge_actions(source_entries, dest_entries, revisions,
+                            keep_source_gpath = None):
     actions = iter_merge_actions_without_moves(
-        source_entries, dest_entries, revisions)
+        source_entries, dest_entries, revisions, keep_source_gpath)
     action_by_type = groupby(actions, MergeAction.get_type)
     touches, copies, moves, deletes, undeletes, updates, uphists, conflicts = \
              (action_by_type.get(type, []) for type in MergeActionType)
@@ -148,9 +160,15 @@ def calculate_merge_actions(source_entries, dest_entries, revisions):
     return (touches, copies, moves, deletes, undeletes,
             updates, uphists, conflicts)
 
-def iter_merge_actions_without_moves(source_entries, dest_entries, revisions):
-    source_history_by_gpath = group_history_by_gpath(source_entries)
-    dest_history_by_gpath = group_history_by_gpath(dest_entries)
+def iter_merge_actions_without_moves(source_entries, dest_entries, revisions,
+                                     keep_source_gpath = None):
+    (source_history_by_gpath, dest_history_by_gpath) = \
+            group_histories_by_gpath(source_entries, dest_entries)
+    if keep_source_gpath is not None:
+        source_history_by_gpath = dict(
+            (key, history)
+            for (key, history) in source_history_by_gpath.iteritems()
+            if keep_source_gpath(history.latest.gpath))
     dest_latests_by_hash = \
             latests_by_hash_from_history_by_gpath(dest_history_by_gpath)
     dest_entries_by_hash = \
@@ -47,8 +47,8 @@
 # mtime: mtime on the file system.  If it changed, the file may have
 #   changed, but maybe not.  Watch out: Windows shaves off a bit.
 #  
-# hash: hex-encoded hash digest.  Right now, we use a sha1.  The value
-#   might also be empty, which would disable certain features.
+# hash: hex-encoded hash digest, made with hash_type.  The value might
+#   also be empty, which would disable certain features.
 #
 # author_peerid and author_utime: The peerid and utime of when the
 #   file was discovered.  This is crucial for knowing that a
@@ -58,6 +58,10 @@
 #
 # author_action: "create", "delete", or "change", a convenience value
 #   so we can know why the author updated the history.
+#
+# hash_type: the name of the algorithm that made the hash, such as
+#   "sha1" or "blake2b" (see fs/hashtypes.py), or "" if there is no
+#   hash.  Hashes of different types can't be compared.
 
 import operator
 
@@ -99,9 +103,26 @@ class GroupedPath(Record("groupid", "path")):
     pass
 
 def group_history_by_gpath(entries):
+    # HistoryColumns (see columns.py) can group without making every
+    # entry.
+    if hasattr(entries, "group_by_gpath"):
+        return entries.group_by_gpath()
     # TODO: Make faster (give entry a cached gpath)?
     return groupby(entries, HistoryEntry.get_gpath, into=History)
 
+# returns ({key: history}, {key: history}) of two sets of entries, for
+# diffing them (see diff_histories).  Each key is a gpath, or if both
+# are HistoryColumns, an int that's the same for the same gpath in
+# both (see columns.py), which is smaller and faster.
+def group_histories_by_gpath(entries1, entries2):
+    if hasattr(entries1, "translate_ids") and \
+           hasattr(entries2, "translate_ids"):
+        (id_map, key_base) = entries1.translate_ids(entries2)
+        return (entries1.group_by_gpath_key(key_base),
+                entries2.group_by_gpath_key(key_base, id_map))
+    return (group_history_by_gpath(entries1),
+            group_history_by_gpath(entries2))
+
 def group_history_by_peerid(entries):
     return groupby(entries, operator.itemgetter(1), into=History)
 
@@ -30,6 +30,8 @@
 
 from util import Record, sql
 
+from store import select_page, iter_pages
+
 TABLE_NAME = "merges"
 TABLE_FIELD_TYPES = ["utime integer",
                      "peerid varchar",
@@ -39,6 +41,9 @@ TABLE_FIELD_TYPES = ["utime integer",
                      "details varchar",
                      "author_peerid varchar"]
 TABLE_FIELDS = [ft.split(" ")[0] for ft in TABLE_FIELD_TYPES]
+INDEXES = [("merges_by_peerid_utime", ["peerid", "utime"])]
+# Replaced by merges_by_peerid_utime.
+OLD_INDEXES = ["merges_by_utime"]
 
 class MergeLogEntry(Record(*TABLE_FIELDS)):
     pass
@@ -46,11 +51,36 @@ class MergeLogEntry(Record(*TABLE_FIELDS)):
 class MergeLog(Record("db", "clock")):
     def __new__(cls, db, clock):
         db.create(TABLE_NAME, TABLE_FIELD_TYPES)
+        for index_name in OLD_INDEXES:
+            db.drop_index(index_name)
+        for (index_name, fields) in INDEXES:
+            db.create_index(index_name, TABLE_NAME, fields)
         return cls.new(db, clock)
 
-    def read_actions(self):
-        return list(self.db.select(TABLE_NAME, TABLE_FIELDS,
-                                   into=MergeLogEntry))
+    # returns [entry] of the actions merged into peerid.  If given
+    # since (a utime), only the actions logged after it.
+    def read_actions(self, peerid, since = None):
+        if since is None:
+            return list(self.db.select(TABLE_NAME, TABLE_FIELDS,
+                                       into=MergeLogEntry,
+                                       where = "peerid = ?",
+                                       params = (peerid,)))
+        else:
+            return list(self.db.select(TABLE_NAME, TABLE_FIELDS,
+                                       into=MergeLogEntry,
+                                       where = "peerid = ? and utime > ?",
+                                       params = (peerid, since),
+                                       order_by = ["utime"]))
+
+    # Like HistoryStore.read_entries_page, but of merge log entries.
+    def read_actions_page(self, peerid, since, limit):
+        return select_page(self.db, TABLE_NAME, TABLE_FIELDS, MergeLogEntry,
+                           "peerid = ?", (peerid,), since, limit)
+
+    # Like HistoryStore.iter_entries_since, but of merge log entries.
+    def iter_actions_since(self, peerid, since = None, page_size = 1000):
+        return iter_pages(lambda since: self.read_actions_page(
+            peerid, since, page_size), since)
 
     def add_action(self, action):
         utime = self.clock.unix()
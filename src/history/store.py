@@ -44,36 +44,210 @@ TABLE_FIELD_TYPES = ["utime integer",
                      "hash varchar",
                      "author_peerid varchar",
                      "author_utime integer",
-                     "author_action varchar"]
+                     "author_action varchar",
+                     "hash_type varchar"]
 TABLE_FIELDS = [ft.split(" ")[0] for ft in TABLE_FIELD_TYPES]
 
 # Have to import HistoryEntry after TABLE_FIELDS is set, since
 # HistoryEntry is based on TABLE_FIELDS.
 from entry import HistoryEntry, group_history_by_peerid
+from columns import HistoryColumns
+
+PATH_SEP = "/"
+
+# What hashes were made with before entries had a hash_type.
+LEGACY_HASH_TYPE = "sha1"
+
+# Every query is by peerid, so many peers' histories can share a db
+# without reading one costing as much as reading all of them.
+INDEXES = [("files_by_gpath_utime", ["peerid", "groupid", "path", "utime"]),
+           ("files_by_utime", ["peerid", "utime"]),
+           ("files_by_hash", ["hash_type", "hash"])]
+# Replaced by files_by_gpath_utime.
+OLD_INDEXES = ["files_by_gpath"]
+
+# The latest entry of every (peerid, groupid, path), kept up to date
+# by add_entries, so that a scan only has to read one entry per file,
+# not every entry ever.  It has the same fields as TABLE_NAME.
+LATEST_TABLE_NAME = "latest"
+LATEST_INDEX = ("latest_by_gpath", ["peerid", "groupid", "path"])
+# For finding the latest entries of every peer of one path.
+LATEST_PATH_INDEX = ("latest_by_path", ["groupid", "path"])
 
 class HistoryStore(Record("db", "slog", "cache_by_peerid")):
     def __new__(cls, db, slog):
         db.create(TABLE_NAME, TABLE_FIELD_TYPES)
+        if "hash_type" not in db.get_fields(TABLE_NAME):
+            migrate_to_hash_types(db)
+        for index_name in OLD_INDEXES:
+            db.drop_index(index_name)
+        for (index_name, fields) in INDEXES:
+            db.create_index(index_name, TABLE_NAME, fields)
+        create_latest_table(db)
+        (index_name, fields) = LATEST_PATH_INDEX
+        db.create_index(index_name, LATEST_TABLE_NAME, fields)
         return cls.new(db, slog, {})
 
-    # return [entry]
-    def read_entries(self, peerid):
+    # return [entry].  If given since (a utime), only those inserted
+    # after it (see read_entries_since).  Otherwise, it's a
+    # HistoryColumns (see columns.py) rather than a list, since that
+    # takes much less memory to cache.
+    def read_entries(self, peerid, since = None):
+        if since is not None:
+            return self.read_entries_since(peerid, since)
+
         cached = setdefault(self.cache_by_peerid, peerid, lambda: \
-                            HistoryCache(list(self.select_entries(peerid))))
-        # copy list for thread safety
-        return list(cached.entries)
+                            HistoryCache(HistoryColumns(
+                                self.select_entries(peerid))))
+        # snapshot for thread safety
+        return cached.entries.snapshot()
 
     # Reads 100,000/sec on my 2008 Macbook.  If you sort by utime, it goes
     # down to 40,000/sec, so that doesn't seem like a good idea.
     def select_entries(self, peerid):
-        # TODO: use a where clause when selecting by peerid.  It will
-        # be a lot faster!
-        return (entry for entry in 
-                self.db.select(TABLE_NAME, TABLE_FIELDS, into=HistoryEntry)
-                if entry.peerid == peerid)
+        return self.db.select(TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+                              where = "peerid = ?", params = (peerid,))
+
+    # return [entry] of one path (in one group), oldest first.
+    def read_gpath_entries(self, peerid, groupid, path):
+        return list(self.db.select(
+            TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+            where = "peerid = ? and groupid = ? and path = ?",
+            params = (peerid, groupid, path), order_by = ["utime"]))
+
+    # Like read_gpath_entries, but returns [(rowid, entry)], oldest
+    # first.  Entries can have the same utime (it's in seconds), so
+    # only the rowid tells them apart (see remove_rows).
+    def read_gpath_rows(self, peerid, groupid, path):
+        return [(values[0], HistoryEntry(*values[1:])) for values in
+                self.db.select(
+                    TABLE_NAME, ["rowid"] + TABLE_FIELDS,
+                    where = "peerid = ? and groupid = ? and path = ?",
+                    params = (peerid, groupid, path),
+                    order_by = ["utime", "rowid"])]
+
+    # return [entry] with the given hash (in hex) and hash type (name).
+    # If given a peerid, only that peer's entries, or else every
+    # peer's, which is how to find every copy of some contents.
+    def read_entries_by_hash(self, hash_type, hash, peerid = None):
+        if peerid is None:
+            return list(self.db.select(
+                TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+                where = "hash_type = ? and hash = ?",
+                params = (hash_type, hash)))
+        else:
+            return list(self.db.select(
+                TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+                where = "hash_type = ? and hash = ? and peerid = ?",
+                params = (hash_type, hash, peerid)))
+
+    # return [entry] inserted after the given utime, oldest first.
+    def read_entries_since(self, peerid, utime):
+        return list(self.db.select(
+            TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+            where = "peerid = ? and utime > ?",
+            params = (peerid, utime), order_by = ["utime"]))
+
+    # returns ([entry], Watermark) of up to limit entries after since
+    # (a Watermark, or None for from the start), oldest first.  The
+    # Watermark is of the last entry, for reading the next page, or
+    # since if there were none.
+    def read_entries_page(self, peerid, since, limit):
+        return select_page(self.db, TABLE_NAME, TABLE_FIELDS, HistoryEntry,
+                           "peerid = ?", (peerid,), since, limit)
+
+    # yields ([entry], Watermark) pages of entries after since, until
+    # there are no more, so a peer can catch up on what it missed
+    # without reading everything, or everything at once.  Save the
+    # last Watermark to pick up there next time.
+    def iter_entries_since(self, peerid, since = None, page_size = 1000):
+        return iter_pages(lambda since: self.read_entries_page(
+            peerid, since, page_size), since)
+
+    # return [entry] whose path is path_prefix or under it, for just
+    # one group.  This uses the files_by_gpath_utime index rather than
+    # reading everything, so it's fast for a small part of a big
+    # history.  An empty path_prefix means the whole group.
+    def read_entries_under(self, peerid, groupid, path_prefix):
+        return list(select_entries_under(
+            self.db, TABLE_NAME, peerid, groupid, path_prefix))
+
+    # return [entry] that are the latest of each path (of any group).
+    # This is all a scan needs, and is as many entries as there are
+    # paths, no matter how many times they've changed.
+    def read_latests(self, peerid):
+        return list(self.db.select(
+            LATEST_TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+            where = "peerid = ?", params = (peerid,)))
+
+    # Like read_entries_under, but only the latest of each path.
+    def read_latests_under(self, peerid, groupid, path_prefix):
+        return list(select_entries_under(
+            self.db, LATEST_TABLE_NAME, peerid, groupid, path_prefix))
+
+    # return [entry] that are the latest of up to limit paths that come
+    # after after_gpath (or from the start, if None), in order of
+    # (groupid, path).  This is for going through every path a bit at
+    # a time.
+    def read_latests_after(self, peerid, after_gpath, limit):
+        if after_gpath is None:
+            where = "peerid = ?"
+            params = (peerid,)
+        else:
+            (groupid, path) = after_gpath
+            where = ("peerid = ? and "
+                     "(groupid > ? or (groupid = ? and path > ?))")
+            params = (peerid, groupid, groupid, path)
+        return list(self.db.select(
+            LATEST_TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+            where = where, params = params,
+            order_by = ["groupid", "path"], limit = limit))
+
+    # return [entry] that are the latest of one path for every peer
+    # but the given one.
+    def read_other_latests(self, peerid, groupid, path):
+        return list(self.db.select(
+            LATEST_TABLE_NAME, TABLE_FIELDS, into=HistoryEntry,
+            where = "groupid = ? and path = ? and peerid != ?",
+            params = (groupid, path, peerid)))
 
+    # returns the number of entries with the given hash type (name).
+    def count_hash_type(self, hash_type):
+        for (count,) in self.db.select(TABLE_NAME, ["count(*)"],
+                                       where = "hash_type = ?",
+                                       params = (hash_type,)):
+            return count
+
+    # Changes the hash of every entry (of any peer) with the old hash
+    # type and hash to the new hash type and hash.  retags is
+    # [(old_hash, new_hash)], in hex, of the same contents.
+    def retag_hashes(self, old_hash_type, new_hash_type, retags):
+        if not retags:
+            return
+
+        with self.db.transaction():
+            for table_name in (TABLE_NAME, LATEST_TABLE_NAME):
+                self.db.update(table_name, ["hash_type", "hash"],
+                               "hash_type = ? and hash = ?",
+                               (((new_hash_type, new_hash),
+                                 (old_hash_type, old_hash))
+                                for (old_hash, new_hash) in retags))
+        # Rather than find the entries in the cache, just read them
+        # again next time.
+        self.cache_by_peerid.clear()
+        self.slog.retagged_hashes(old_hash_type, new_hash_type, len(retags))
+
+    # The entries and the latest entries are written in one
+    # transaction, so they can't get out of sync.  An entry only
+    # replaces the latest of its path if it isn't older, so of entries
+    # with the same utime, the last inserted is the latest.
+    # The latest entries are copied from the new rows within sqlite,
+    # which is much faster than passing them in again.
     def add_entries(self, new_entries):
-        self.db.insert(TABLE_NAME, TABLE_FIELDS, new_entries)
+        with self.db.transaction():
+            last_rowid = get_last_rowid(self.db, TABLE_NAME)
+            self.db.insert(TABLE_NAME, TABLE_FIELDS, new_entries)
+            update_latests(self.db, last_rowid)
         self.slog.inserted_history(new_entries)
 
         for peerid, new_entries in \
@@ -82,6 +256,122 @@ class HistoryStore(Record("db", "slog", "cache_by_peerid")):
             if cache is not None:
                 cache.add_entries(new_entries)
 
+    # Removes old entries, given as [(rowid, entry)] from
+    # read_gpath_rows (see compaction.py).  The latest entry of a path
+    # must never be removed, or the latest table would be wrong.
+    def remove_rows(self, old_rows):
+        if not old_rows:
+            return
+
+        self.db.delete_many(TABLE_NAME, "rowid = ?",
+                            ((rowid,) for (rowid, _) in old_rows))
+        old_entries = [entry for (_, entry) in old_rows]
+        # Like retag_hashes, just read them again next time.
+        for entry in old_entries:
+            self.cache_by_peerid.pop(entry.peerid, None)
+        self.slog.removed_history(old_entries)
+
 class HistoryCache(Record("entries")):
     def add_entries(self, entries):
         self.entries.extend(entries)
+
+class Watermark(Record("utime", "rowid")):
+    """Where reading a table in order of utime left off.  Many rows
+    can have the same utime, so the rowid (which goes up with every
+    insert) tells them apart.  A row inserted with a utime older than
+    a Watermark won't be read after it."""
+    # returns a Watermark that's after everything at or before utime.
+    @classmethod
+    def after_utime(cls, utime):
+        return cls(utime, MAX_ROWID)
+
+MAX_ROWID = 2 ** 63 - 1
+
+# returns ([row], Watermark) of up to limit rows of the table after
+# since (a Watermark, or None for from the start), in order of utime,
+# and where where is true (if given).  The table must have a utime
+# field.
+def select_page(db, table_name, fields, into, where, params, since, limit):
+    if since is not None:
+        # The "utime >= ?" is redundant, but lets sqlite seek in the
+        # index rather than filter from the start.
+        since_where = ("utime >= ? and "
+                       "(utime > ? or (utime = ? and rowid > ?))")
+        where = since_where if where is None else \
+                "{0} and {1}".format(where, since_where)
+        params = tuple(params) + (since.utime, since.utime, since.utime,
+                                  since.rowid)
+    rows = []
+    for values in db.select(table_name, ["rowid", "utime"] + fields,
+                            where = where, params = params,
+                            order_by = ["utime", "rowid"], limit = limit):
+        rows.append(into(*values[2:]))
+        since = Watermark(values[1], values[0])
+    return (rows, since)
+
+# yields ([row], Watermark) from read_page(since) until a page is
+# empty.
+def iter_pages(read_page, since):
+    while True:
+        (rows, since) = read_page(since)
+        if not rows:
+            break
+        yield (rows, since)
+
+# yields entries of the table whose path is path_prefix or under it,
+# for just one group.  An empty path_prefix means the whole group.
+def select_entries_under(db, table_name, peerid, groupid, path_prefix):
+    if not path_prefix:
+        return db.select(
+            table_name, TABLE_FIELDS, into=HistoryEntry,
+            where = "peerid = ? and groupid = ?",
+            params = (peerid, groupid))
+    else:
+        # "/" + 1 is "0", so this is everything under path_prefix.
+        return db.select(
+            table_name, TABLE_FIELDS, into=HistoryEntry,
+            where = ("peerid = ? and groupid = ? and "
+                     "(path = ? or (path > ? and path < ?))"),
+            params = (peerid, groupid, path_prefix,
+                      path_prefix + PATH_SEP, path_prefix + "0"))
+
+# Updates the latest table from the entries after last_rowid.  In
+# order of (utime, rowid), and only replacing what isn't newer, so of
+# entries with the same utime, the last inserted is the latest.
+def update_latests(db, last_rowid):
+    db.upsert_select(LATEST_TABLE_NAME, TABLE_NAME, TABLE_FIELDS,
+                     LATEST_INDEX[1], "rowid > ?", (last_rowid,),
+                     "excluded.utime >= {0}.utime".format(LATEST_TABLE_NAME),
+                     ["utime", "rowid"])
+
+# returns the largest rowid of the table, or 0 if it's empty.
+def get_last_rowid(db, table_name):
+    for (rowid,) in db.select(table_name, ["max(rowid)"]):
+        return rowid or 0
+    return 0
+
+# Creates the latest table if it doesn't exist, and if it's empty but
+# there are entries (for dbs from before it existed), fills it from
+# them.  Creating a table commits right away, so we can't tell it's
+# new by whether it exists: if we died while filling it, it's there
+# but empty.
+def create_latest_table(db):
+    (index_name, fields) = LATEST_INDEX
+    db.create(LATEST_TABLE_NAME, TABLE_FIELD_TYPES)
+    db.create_index(index_name, LATEST_TABLE_NAME, fields, unique = True)
+    if is_empty(db, LATEST_TABLE_NAME) and not is_empty(db, TABLE_NAME):
+        with db.transaction():
+            update_latests(db, 0)
+
+def is_empty(db, table_name):
+    for _ in db.select(table_name, ["1"], limit = 1):
+        return False
+    return True
+
+# Before entries had a hash_type, every hash was made with
+# LEGACY_HASH_TYPE.  Entries with no hash have no hash_type.
+def migrate_to_hash_types(db):
+    db.add_field(TABLE_NAME, "hash_type varchar")
+    db.update(TABLE_NAME, ["hash_type"], "hash != ''",
+              [((LEGACY_HASH_TYPE,), ())])
+    db.update(TABLE_NAME, ["hash_type"], "hash = ''", [(("",), ())])
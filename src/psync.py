@@ -30,15 +30,20 @@ if sys.version_info < (2, 6):
 
 from contextlib import contextmanager
 
-import hashlib
 import os
 import sqlite3
 import traceback
 
-from fs import (FileSystem, PathFilter, RevisionStore,
-                join_paths, scan_and_update_history, diff_and_merge)
-from history import HistoryStore, MergeLog
-from util import Record, Clock, RunTime, SqlDb, flip_dict
+from fs import (FileSystem, FileHasher, PathFilter, RevisionStore, DirCache,
+                HashCache, join_paths, scan_and_update_history,
+                scan_subtrees_and_update_history, diff_and_merge,
+                get_hash_type, get_hash_migration, migrate_hashes,
+                IoThrottle, LoadMonitor, ChunkSettings, ChunkStore,
+                get_hash_order, FileWatcher, watching_supported)
+from fs.hashtypes import DEFAULT_HASH_TYPE_NAME
+from history import (HistoryStore, MergeLog, RetentionPolicy,
+                     CompactionCursors, compact_history)
+from util import Record, Clock, RunTime, SqlDb, BatchCommitter, flip_dict
                   
 class StatusLog:
     """ All the loggable events of the entire application are routed
@@ -86,22 +91,56 @@ class StatusLog:
     def ignored_rpath_without_groupid(self, gpath):
         self.log("ignore rpath without groupid", gpath)
 
+    def ignored_subtree_without_root(self, path):
+        self.log("ignore subtree without root", path)
+
     def ignored_gpath_without_root(self, gpath):
         self.log("ignore gpath without root", gpath)
 
     def not_a_file(self, path):
         self.log("not a file", path)
 
-    def could_not_hash(self, path):
-        self.log("could not hash", path)
+    def unstable_file_diff(self, fdiff):
+        self.log("unstable", fdiff.rpath)
+
+    def could_not_watch(self, path, err):
+        self.log("could not watch", path, err)
+
+    def watch_overflowed(self):
+        self.log("watch overflowed; rescanning everything watched")
+
+    def watching_unsupported(self):
+        self.log("watching is not supported here (inotify only)")
+
+    def watching(self, source_dirs, dest_dirs):
+        self.log("watching", len(source_dirs), len(dest_dirs))
+
+    def dirs_changed(self, source_dirs, dest_dirs):
+        self.log("changed", sorted(source_dirs), sorted(dest_dirs))
+
+    def could_not_hash(self, path, err):
+        self.log("could not hash", path, err)
 
     def inserted_history(self, entries):
         for entry in entries:
             self.log("inserted", entry)
 
+    def removed_history(self, entries):
+        for entry in entries:
+            self.log("removed", entry)
+
     def merged(self, action):
         self.log("merged", action)
 
+    def reused_cached_hash(self, path):
+        self.log("reused cached hash", path)
+
+    def appended_file_changed(self, path):
+        self.log("appended file changed", path)
+
+    def retagged_hashes(self, old_hash_type, new_hash_type, count):
+        self.log("retagged hashes", old_hash_type, new_hash_type, count)
+
     @contextmanager
     def hashing(self, path):
         self.log("begin hashing", path)
@@ -138,11 +177,20 @@ class Config:
     """ This is the config for the entire app.  Right now, there is no
     config file.  Just edit this."""
 
-    # The hash algorithm used when hashing files.  A value of "None"
-    # will disable hashing.  That is a lot faster when finding new
-    # files, but then fast moves, copies, and undeletes are
+    # The name of the hash algorithm used when hashing files (see
+    # fs/hashtypes.py), such as "sha1" or "blake2b".  A value of
+    # "None" will disable hashing.  That is a lot faster when finding
+    # new files, but then fast moves, copies, and undeletes are
     # impossible.
-    hash_type = hashlib.sha1
+    hash_type = DEFAULT_HASH_TYPE_NAME
+
+    # If history has hashes of this type (and it's not hash_type),
+    # files are hashed with both types at once, and the old hashes are
+    # replaced with new ones.  After every scan, up to
+    # hash_migration_bytes of files that haven't changed are hashed
+    # again just to replace their old hashes, until there are none.
+    old_hash_type = "sha1"
+    hash_migration_bytes = 1024 * 1024 * 1024
 
     # A special file.  If present in a directory, that directory will
     # become a new "group root".  If they are never present, then this
@@ -153,12 +201,128 @@ class Config:
     # root directory.
     db_path = ".psync/psync.db"
 
+    # How the db is stored and synced (see SqlDb.configure).  With a
+    # write-ahead log and "normal" syncing, a commit doesn't sync to
+    # disk, so recording history is much faster.  A power loss can
+    # lose the last few commits, but not corrupt the db.
+    db_journal_mode = "wal"
+    db_synchronous = "normal"
+    db_cache_size = -16 * 1024
+    db_mmap_size = 64 * 1024 * 1024
+
+    # While merging, the history and merge log are committed after
+    # every merge_commit_count merges or merge_commit_secs, whichever
+    # comes first.  Until then, other processes can't write to the
+    # dbs, and if we die, those merges aren't recorded even though the
+    # files have changed.
+    merge_commit_count = 1000
+    merge_commit_secs = 5.0
+
     # The "trash", relative to the root directory. Multiple versions
     # (revisions) of the same file can go in there, so you never lose
     # data that was deleted.  If it's None, then the files really do
     # get deleted.
     revisions_path = ".psync/revisions/"
 
+    # How much old history to keep (see history/compaction.py).  The
+    # newest history_keep_versions entries of each file are kept, and
+    # those newer than history_keep_secs, and if
+    # history_keep_revisions, those still in the revisions.  The
+    # latest entry of each file is always kept.  If both are None,
+    # history is never compacted.  After every run, up to
+    # history_compaction_paths files are compacted, picking up where
+    # the last run left off.
+    history_keep_versions = None
+    history_keep_secs = None
+    history_keep_revisions = True
+    history_compaction_paths = 10000
+
+    # If True, keep running after syncing: watch the directories of
+    # both sides (with inotify, so Linux only), and whenever some in
+    # the source change, scan only those (and those changed in the
+    # dest) and merge again.  Stop with Ctrl-C.
+    watch = False
+
+    # How many directories to list at once while scanning.  On a local
+    # disk, 1 is as fast as any.  On a network file system (NFS, SMB),
+    # where every listdir and stat is a round trip, 8 or 16 can make a
+    # scan many times faster.
+    scan_threads = 1
+
+    # Whether to remember the children of each directory between
+    # scans, so that directories that haven't changed (by mtime)
+    # aren't listed again.
+    cache_dir_listings = True
+
+    # If set, scanning streams files through listing, hashing, and
+    # recording history, and history is committed this many entries
+    # at a time.  That way, on a big first scan, files start to sync
+    # right away, and if we're killed, we don't start over.  If None,
+    # each step is done for all files before the next.
+    scan_batch_size = 1000
+
+    # How many files to hash at once.  hashlib doesn't hold the GIL
+    # while hashing, so on a fast disk (SSD), this can be as many as
+    # you have cores.  On a spinning disk, 1 is probably best.
+    hash_threads = 1
+
+    # Which files to hash first, so that as many files as possible are
+    # synced as soon as possible: "smallest" (files), "newest"
+    # (modified), or None (in the order they're found).  Files under
+    # the path prefixes in hash_path_weights (relative to their group
+    # roots, such as {"Documents/": 1}) are hashed before others,
+    # higher weights first.
+    hash_order = "smallest"
+    hash_path_weights = {}
+
+    # Whether to remember the hash of each file by its inode, so that
+    # moving or renaming files (or whole directories) doesn't mean
+    # hashing them again.
+    cache_hashes = True
+
+    # The block size to hash files with.  If None, it's tuned while
+    # hashing by measuring throughput.
+    hash_block_size = None
+
+    # Experimental: whether to split files of at least
+    # chunk_min_file_size into chunks by their contents while hashing
+    # them (see fs/chunker.py) and store the chunks, for syncing only
+    # the parts of files that changed.  Finding the cuts is done in
+    # python, at about 10MB/sec against over 100MB/sec for hashing, so
+    # it slows down hashing by 10x or more.  Every peer must use the
+    # same chunk sizes, or they won't find the same chunks.
+    chunk_files = False
+    chunk_min_file_size = 1024 * 1024
+    chunk_min_size = 16 * 1024
+    chunk_avg_size = 64 * 1024
+    chunk_max_size = 256 * 1024
+    # Whether to hash chunked files by their lists of chunks rather
+    # than by their contents, so that a file that was only appended to
+    # (such as a log) is hashed again by reading just its end.  Only
+    # the start of the file and the end of the old chunks are checked,
+    # so a change in the middle of such a file could be missed.  Peers
+    # that don't do this will have different hashes for the same
+    # files.  Requires chunk_files.
+    rehash_appends = False
+
+    # Limits on how fast to read files for hashing, in bytes and IO
+    # operations per second, so a big scan doesn't make everything
+    # else slow.  None is no limit.  Copying files isn't limited, but
+    # hashing waits while we copy.
+    io_bytes_per_sec = None
+    io_ops_per_sec = None
+
+    # Whether to slow down hashing when the system is busy (when
+    # /proc/pressure/io or /proc/loadavg is high, on Linux).  Since
+    # both count our own IO too, hashing pauses now and then to see
+    # whether the load is ours (see fs/throttle.py).
+    throttle_io_on_load = True
+
+    # Whether to hash big files by mmap'ing them rather than reading
+    # them.  It's a bit faster, but if another process truncates a
+    # file while we're hashing it, we crash (SIGBUS).
+    hash_with_mmap = False
+
     # Names to filter out while scanning.  If the name of a directory
     # is given, that directory will not be scanned, which is much
     # faster than filtering after scanning.  So, filtering names like
@@ -179,10 +343,11 @@ class Config:
         # These are debatable.
         ".hg", ".git", ".evolution"])
 
-    # Unix-style "globs" to ignore.  These are slower to test, but are
-    # memoized, so they are really only slower on the first scan.  For
-    # 5 patterns, the initial scan time is doubled.  But, that time is
-    # dwarfed by the hash time anyway.
+    # Unix-style "globs" to ignore, matched against paths relative to
+    # their group roots.  They're compiled into one regular expression
+    # and memoized, so they cost little.  A glob that ends in "*" (like
+    # ".config/google-chrome/*") also keeps the directory it matches
+    # from being scanned at all.
     globs_to_ignore = \
         [# Parallels big files we probably should never sync
          "*.hds", "*.mem",
@@ -193,9 +358,15 @@ class Config:
          # emacs temp files, which we probably never care to sync
          "*~", "*~$", "~*.tmp"]
 
+    # Files in which to put gitignore-style rules for ignoring files in
+    # a directory and below, such as "node_modules/" (see
+    # fs/ignorefiles.py).  Ignored directories aren't scanned.
+    ignore_file_name = ".psyncignore"
+
     # Finally, if you want complete control, you can implement your
     # own PathFilter.
-    path_filter = PathFilter(globs_to_ignore, names_to_ignore)
+    path_filter = PathFilter(globs_to_ignore, names_to_ignore,
+                             ignore_file_name = ignore_file_name)
 
 
 class Groupids(Record("root_by_groupid", "groupid_by_root")):
@@ -209,6 +380,10 @@ class Groupids(Record("root_by_groupid", "groupid_by_root")):
     def from_root(self, root):
         return self.groupid_by_root.get(root, None)
 
+    @property
+    def roots(self):
+        return self.groupid_by_root.keys()
+
 # python psync.py source dest
 if __name__ == "__main__":
     source_root, dest_root = sys.argv[1:]
@@ -225,37 +400,115 @@ if __name__ == "__main__":
 
     clock = Clock()
     slog = StatusLog(clock)
-    fs = FileSystem(slog)
+    if (conf.io_bytes_per_sec or conf.io_ops_per_sec or
+        conf.throttle_io_on_load):
+        throttle = IoThrottle(
+            conf.io_bytes_per_sec, conf.io_ops_per_sec,
+            LoadMonitor() if conf.throttle_io_on_load else None)
+    else:
+        throttle = None
+    fs = FileSystem(slog, FileHasher(block_size = conf.hash_block_size,
+                                     use_mmap = conf.hash_with_mmap,
+                                     throttle = throttle),
+                    throttle)
+    hash_type = get_hash_type(conf.hash_type)
+    old_hash_type = get_hash_type(conf.old_hash_type)
+    hash_order = get_hash_order(conf.hash_order, conf.hash_path_weights)
 
     source_db_path = os.path.join(source_root, conf.db_path)
     dest_db_path = os.path.join(dest_root, conf.db_path)
     revisions_root = os.path.join(dest_root, conf.revisions_path)
+    source_revisions_root = os.path.join(source_root, conf.revisions_path)
+    retention_policy = RetentionPolicy(conf.history_keep_versions,
+                                       conf.history_keep_secs,
+                                       conf.history_keep_revisions)
 
     fs.create_parent_dirs(source_db_path)
     fs.create_parent_dirs(dest_db_path)
-    with sqlite3.connect(source_db_path) as source_db:
-        with sqlite3.connect(dest_db_path) as dest_db:
-            source_history_store = HistoryStore(SqlDb(source_db), slog)
-            dest_history_store = HistoryStore(SqlDb(dest_db), slog)
+    with sqlite3.connect(source_db_path) as source_db_conn:
+        with sqlite3.connect(dest_db_path) as dest_db_conn:
+            source_db = SqlDb(source_db_conn)
+            dest_db = SqlDb(dest_db_conn)
+            for db in (source_db, dest_db):
+                db.configure(conf.db_journal_mode, conf.db_synchronous,
+                             conf.db_cache_size, conf.db_mmap_size)
+            source_history_store = HistoryStore(source_db, slog)
+            dest_history_store = HistoryStore(dest_db, slog)
             revisions = RevisionStore(fs, revisions_root)
-            merge_log = MergeLog(SqlDb(source_db), clock)
-
-            source_history = scan_and_update_history(
+            merge_log = MergeLog(source_db, clock)
+            if conf.cache_dir_listings:
+                source_dir_cache = DirCache(source_db)
+                dest_dir_cache = DirCache(dest_db)
+            else:
+                source_dir_cache = dest_dir_cache = None
+            if conf.cache_hashes:
+                source_hash_cache = HashCache(source_db)
+                dest_hash_cache = HashCache(dest_db)
+            else:
+                source_hash_cache = dest_hash_cache = None
+            if conf.chunk_files:
+                chunk_settings = ChunkSettings(conf.chunk_min_size,
+                                               conf.chunk_avg_size,
+                                               conf.chunk_max_size)
+                source_chunk_store = ChunkStore(
+                    source_db, chunk_settings, conf.chunk_min_file_size,
+                    conf.rehash_appends)
+                dest_chunk_store = ChunkStore(
+                    dest_db, chunk_settings, conf.chunk_min_file_size,
+                    conf.rehash_appends)
+            else:
+                source_chunk_store = dest_chunk_store = None
+            source_hash_migration = get_hash_migration(
+                source_history_store, source_peerid, hash_type, old_hash_type)
+            dest_hash_migration = get_hash_migration(
+                dest_history_store, dest_peerid, hash_type, old_hash_type)
+
+            # Every directory scanned, so we know what to watch.
+            source_scanned_dirs = set()
+            dest_scanned_dirs = set()
+            scan_and_update_history(
                 fs, source_root,
-                conf.group_root_marker, conf.path_filter, conf.hash_type,
+                conf.group_root_marker, conf.path_filter, hash_type,
                 source_history_store, source_peerid, source_groupids,
-                clock, slog)
-
-            dest_history = scan_and_update_history(
+                clock, slog, scan_threads = conf.scan_threads,
+                dir_cache = source_dir_cache,
+                batch_size = conf.scan_batch_size,
+                scanned_dirs = source_scanned_dirs,
+                hash_threads = conf.hash_threads,
+                hash_order = hash_order,
+                hash_cache = source_hash_cache,
+                hash_migration = source_hash_migration,
+                chunk_store = source_chunk_store)
+            if source_hash_migration is not None:
+                migrate_hashes(fs, source_history_store, source_peerid,
+                               source_groupids, hash_type,
+                               source_hash_migration, slog,
+                               conf.hash_migration_bytes)
+
+            scan_and_update_history(
                 fs, dest_root,
-                conf.group_root_marker, conf.path_filter, conf.hash_type,
+                conf.group_root_marker, conf.path_filter, hash_type,
                 dest_history_store, dest_peerid, dest_groupids,
-                clock, slog)
-
-            filtered_source_history = \
-                (entry for entry in source_history
-                 if (dest_groupids.to_root(entry.groupid) is not None and
-                     not conf.path_filter.ignore_path(entry.path)))
+                clock, slog, scan_threads = conf.scan_threads,
+                dir_cache = dest_dir_cache,
+                batch_size = conf.scan_batch_size,
+                scanned_dirs = dest_scanned_dirs,
+                hash_threads = conf.hash_threads,
+                hash_order = hash_order,
+                hash_cache = dest_hash_cache,
+                hash_migration = dest_hash_migration,
+                chunk_store = dest_chunk_store)
+            if dest_hash_migration is not None:
+                migrate_hashes(fs, dest_history_store, dest_peerid,
+                               dest_groupids, hash_type,
+                               dest_hash_migration, slog,
+                               conf.hash_migration_bytes)
+
+            # Filtered once per path rather than per entry, and after
+            # grouping, so the histories can be grouped as columns.
+            def keep_source_gpath((groupid, path)):
+                return (dest_groupids.to_root(groupid) is not None and
+                        not conf.path_filter.ignore_path(path))
 
             def fetch(entry):
                 # We just pretend we fetched it.  Once diff_and_merge
@@ -267,9 +520,115 @@ if __name__ == "__main__":
 
             # TODO: handle errors,
             #   especially unknown groupid, created! and changed! errors
-            diff_and_merge(filtered_source_history, dest_history, dest_groupids,
-                           fetch, revisions, fs, dest_history_store, dest_peerid,
-                           clock, merge_log, slog)
+            # Each merge writes history and the merge log, which we
+            # commit in batches, so if we die, only the merges of the
+            # last batch are lost.  The files have already changed, so
+            # if a merge fails, the ones before it are still committed.
+            def merge_source_into_dest():
+                # Scanning only needs the latest entries, but merging
+                # needs the whole histories.
+                source_history = source_history_store.read_entries(
+                    source_peerid)
+                dest_history = dest_history_store.read_entries(dest_peerid)
+
+                with source_db.transaction(rollback_on_error = False):
+                    with dest_db.transaction(rollback_on_error = False):
+                        diff_and_merge(
+                            source_history, dest_history,
+                            dest_groupids, fetch, revisions, fs,
+                            dest_history_store, dest_peerid,
+                            clock, merge_log, slog,
+                            committer = BatchCommitter(
+                                (source_db, dest_db), clock,
+                                conf.merge_commit_count,
+                                conf.merge_commit_secs),
+                            keep_source_gpath = keep_source_gpath)
+
+            merge_source_into_dest()
+
+            # Each side keeps the entries that match the latest of the
+            # other, so the next diff_histories can still tell which
+            # is newer.
+            if not retention_policy.keeps_everything:
+                source_latests = source_history_store.read_latests(
+                    source_peerid)
+                dest_latests = dest_history_store.read_latests(dest_peerid)
+                for (history_store, peerid, db, history_revisions,
+                     peer_latests) in (
+                        (source_history_store, source_peerid, source_db,
+                         RevisionStore(fs, source_revisions_root),
+                         dest_latests),
+                        (dest_history_store, dest_peerid, dest_db,
+                         revisions, source_latests)):
+                    compact_history(
+                        history_store, peerid, retention_policy,
+                        CompactionCursors(db), clock, slog,
+                        revisions = history_revisions,
+                        max_paths = conf.history_compaction_paths,
+                        peer_latests = peer_latests)
+
+            for db in (source_db, dest_db):
+                db.maintain()
+
+            if conf.watch and not watching_supported():
+                slog.watching_unsupported()
+            elif conf.watch:
+                # Merging writes to the dest, so its watcher sees our
+                # own changes.  They're rescanned along with the next
+                # change to the source, which finds nothing new.  Dirs
+                # the merge removed can't be watched again (that's
+                # logged), and are forgotten by that rescan.
+                source_watcher = FileWatcher(fs, clock, slog)
+                dest_watcher = FileWatcher(fs, clock, slog)
+                try:
+                    source_watcher.watch(source_scanned_dirs)
+                    dest_watcher.watch(dest_scanned_dirs)
+                    source_watcher.start()
+                    dest_watcher.start()
+                    slog.watching(source_scanned_dirs, dest_scanned_dirs)
+                    while True:
+                        # With a timeout, so Ctrl-C isn't ignored.
+                        source_dirs = source_watcher.wait_for_dirty_dirs(1.0)
+                        if not source_dirs:
+                            continue
+                        dest_dirs = dest_watcher.take_dirty_dirs()
+                        slog.dirs_changed(source_dirs, dest_dirs)
+
+                        # The dest first, so the merge knows about
+                        # changes on both sides.
+                        for (dirs, history_store, peerid, groupids,
+                             dir_cache, hash_cache, chunk_store,
+                             scanned_dirs) in (
+                                (dest_dirs, dest_history_store,
+                                 dest_peerid, dest_groupids,
+                                 dest_dir_cache, dest_hash_cache,
+                                 dest_chunk_store, dest_scanned_dirs),
+                                (source_dirs, source_history_store,
+                                 source_peerid, source_groupids,
+                                 source_dir_cache, source_hash_cache,
+                                 source_chunk_store, source_scanned_dirs)):
+                            scan_subtrees_and_update_history(
+                                fs, dirs,
+                                conf.group_root_marker, conf.path_filter,
+                                hash_type, history_store, peerid, groupids,
+                                clock, slog,
+                                scan_threads = conf.scan_threads,
+                                dir_cache = dir_cache,
+                                batch_size = conf.scan_batch_size or 1000,
+                                scanned_dirs = scanned_dirs,
+                                hash_threads = conf.hash_threads,
+                                hash_order = hash_order,
+                                hash_cache = hash_cache,
+                                chunk_store = chunk_store)
+                        merge_source_into_dest()
+
+                        source_watcher.watch(source_scanned_dirs)
+                        dest_watcher.watch(dest_scanned_dirs)
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    source_watcher.stop()
+                    dest_watcher.stop()
 
             # for merge_action in sorted(merge_log.read_actions(dest_peerid)):
             #   print merge_action
@@ -39,13 +39,25 @@
 # 7.  Smaller (memory-wise) than normal objects.
 # 8.  Nicer than named tuples (which don't have nice setters).
 
+import operator
+
 def Record(*slots, **kargs):
     base = kargs.get("base", RecordBase)
     assert issubclass(base, RecordBase)
     return base.add_slots(*slots)
 
+class RecordType(type):
+    """Gives every Record class empty __slots__, even subclasses that
+    don't say so (like "class Foo(Record(...)): pass"), so that a
+    Record is just a tuple, without a __dict__ or __weakref__."""
+    def __new__(mcs, name, bases, namespace):
+        namespace.setdefault("__slots__", ())
+        return type.__new__(mcs, name, bases, namespace)
+
 class RecordBase(tuple):
+    __metaclass__ = RecordType
     SLOTS = ()
+    INDEX_BY_SLOT = {}
 
     ## Override this one instead of __init__.
     def __new__(cls, *values):
@@ -84,10 +96,19 @@ class RecordBase(tuple):
         return cls.new(*(dct.get(slot, default) for slot in cls.SLOTS))
 
 
+    # Like with set_*, we don't go through new() or __new__, since
+    # the values are already right.  Unknown slots are ignored.  Slicing
+    # (which subclasses don't override, unlike __iter__) is much faster
+    # than iterating.
     def alter(self, **kargs):
-        return self.new(*(kargs.get(self.SLOTS[index], value)
-                          for (index, value) in enumerate(self.values)))
-        
+        values = list(self[:])
+        index_by_slot = self.INDEX_BY_SLOT
+        for (slot, value) in kargs.iteritems():
+            index = index_by_slot.get(slot)
+            if index is not None:
+                values[index] = value
+        return tuple.__new__(self.__class__, values)
+
     ### For Building Subclasses ###
     @classmethod
     def add_slots(old_cls, *slots):
@@ -96,13 +117,16 @@ class RecordBase(tuple):
 
         old_size = len(cls.SLOTS)
         cls.SLOTS += slots
+        cls.INDEX_BY_SLOT = dict((slot, index)
+                                 for (index, slot) in enumerate(cls.SLOTS))
         for index, slot in enumerate(slots):
             index += old_size
 
             getter = cls.make_getter(slot, index)
             setter = cls.make_setter(slot, index)
 
-            setattr(cls, slot, property(fget = getter))
+            # itemgetter is much faster than calling getter.
+            setattr(cls, slot, property(fget = operator.itemgetter(index)))
             setattr(cls, setter.__name__, setter)
             setattr(cls, getter.__name__, getter)
 
@@ -120,9 +144,8 @@ class RecordBase(tuple):
     @classmethod
     def make_setter(cls, slot, index):
         def setter(self, value):
-            return self.new(*(value if cur_index == index else cur_value
-                              for (cur_index, cur_value)
-                              in enumerate(self.values)))
+            return tuple.__new__(self.__class__,
+                                 self[:index] + (value,) + self[index+1:])
 
         setter.__name__ = "set_" + slot
         return setter
@@ -24,18 +24,100 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from contextlib import contextmanager
 import sqlite3
 
 import sql
 from Record import Record
 
-class SqlDb(Record("db_conn")):
-    """Abstracts the db_conn and cursor behavior a little bit."""
+class SqlDb(Record("db_conn", "transaction_depth")):
+    """Abstracts the db_conn and cursor behavior a little bit.  Every
+    write is committed right away, unless it's in a transaction(), so
+    share one SqlDb per db_conn."""
+    def __new__(cls, db_conn):
+        return cls.new(db_conn, [0])
+
+    # Within a "with db.transaction():", writes aren't committed until
+    # the end, which is much faster for many small writes, since every
+    # commit is a sync to disk.  If there's an error, they're all
+    # rolled back, unless not rollback_on_error, in which case what was
+    # written is committed anyway.  Transactions can be nested; only
+    # the outermost one commits.
+    @contextmanager
+    def transaction(self, rollback_on_error = True):
+        depth = self.transaction_depth
+        depth[0] += 1
+        try:
+            yield self
+        except:
+            depth[0] -= 1
+            if depth[0] == 0:
+                if rollback_on_error:
+                    self.db_conn.rollback()
+                else:
+                    self.db_conn.commit()
+            raise
+        else:
+            depth[0] -= 1
+            self.commit()
+
+    def commit(self):
+        if self.transaction_depth[0] == 0:
+            self.db_conn.commit()
+
+    # Within the outermost transaction, commits what's been written so
+    # far, and the transaction goes on.  Within a nested one, does
+    # nothing, since the nested one expects to be all or nothing.
+    def commit_transaction(self):
+        if self.transaction_depth[0] == 1:
+            self.db_conn.commit()
+
+    # Sets how the db is stored and synced.  Any value that is None is
+    # left alone.
+    #
+    # journal_mode "wal" (write-ahead log) makes commits much cheaper,
+    # and lets readers read while we write.  synchronous "normal" (with
+    # "wal") only syncs at checkpoints, so a power loss can lose the
+    # last few commits, but can't corrupt the db.  cache_size is in
+    # pages, or in KB if negative.  mmap_size is in bytes.
+    def configure(self, journal_mode = None, synchronous = None,
+                  cache_size = None, mmap_size = None):
+        for (name, value) in (("journal_mode", journal_mode),
+                              ("synchronous", synchronous),
+                              ("cache_size", cache_size),
+                              ("mmap_size", mmap_size)):
+            if value is not None:
+                self.set_pragma(name, value)
+
+    # returns the new value, which may not be what was asked for (not
+    # every db can use wal, for example).
+    def set_pragma(self, name, value):
+        db_cursor = self.db_conn.cursor()
+        for row in db_cursor.execute(sql.set_pragma(name, value)):
+            return row[0]
+
+    def get_pragma(self, name):
+        db_cursor = self.db_conn.cursor()
+        for row in db_cursor.execute(sql.get_pragma(name)):
+            return row[0]
+
+    # Maintenance to do now and then (such as at the end of a run):
+    # moves the write-ahead log into the db (so it doesn't grow
+    # forever), and lets sqlite update the statistics it uses to plan
+    # queries.
+    def maintain(self):
+        self.commit()
+        db_cursor = self.db_conn.cursor()
+        if self.get_pragma("journal_mode") == "wal":
+            db_cursor.execute(sql.set_pragma("wal_checkpoint", "truncate",
+                                             call = True))
+        db_cursor.execute(sql.get_pragma("optimize"))
+
     def drop(self, table_name):
         db_cursor = self.db_conn.cursor()
         try:
             db_cursor.execute(sql.drop_table(table_name))
-            self.db_conn.commit()
+            self.commit()
         except sqlite3.OperationalError:
             pass  # Already dropped?
 
@@ -43,22 +125,115 @@ class SqlDb(Record("db_conn")):
         db_cursor = self.db_conn.cursor()
         try:
             db_cursor.execute(sql.create_table(table_name, field_types))
-            self.db_conn.commit()
+            self.commit()
         except sqlite3.OperationalError:
             pass  # Already exists?
 
     def insert(self, table_name, table_fields, tuples):
         db_cursor = self.db_conn.cursor()
-        insert_statement = sql.insert(table_name, table_fields)
-        for tup in tuples:
-            db_cursor.execute(insert_statement, tup)
-        self.db_conn.commit()
+        db_cursor.executemany(sql.insert(table_name, table_fields), tuples)
+        self.commit()
+
+    # Like insert, but replaces rows with the same primary key.
+    def replace(self, table_name, table_fields, tuples):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.executemany(sql.replace(table_name, table_fields), tuples)
+        self.commit()
 
-    def select(self, table_name, fields, into=None):
+    # Copies rows of from_table_name into table_name, but a row with
+    # the same key_fields is only updated where update_where is true
+    # (see sql.upsert_select).  where is a sql expression with ? for
+    # each value in params.  order_by is [field].
+    def upsert_select(self, table_name, from_table_name, table_fields,
+                      key_fields, where, params, update_where, order_by):
         db_cursor = self.db_conn.cursor()
-        for values in db_cursor.execute(sql.select(table_name, fields)):
+        db_cursor.execute(sql.upsert_select(table_name, from_table_name,
+                                            table_fields, key_fields, where,
+                                            update_where, order_by),
+                          params)
+        self.commit()
+
+    # Sets fields to values where where is true, for each
+    # (values, params) in updates.  where is a sql expression with ?
+    # for each value in params.
+    def update(self, table_name, fields, where, updates):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.executemany(sql.update(table_name, fields, where),
+                              (tuple(values) + tuple(params)
+                               for (values, params) in updates))
+        self.commit()
+
+    # returns [field name] of an existing table.
+    def get_fields(self, table_name):
+        db_cursor = self.db_conn.cursor()
+        return [row[1] for row in
+                db_cursor.execute(sql.table_info(table_name))]
+
+    # Adds a field (column) to an existing table, for migrating old
+    # tables.  Existing rows get null.
+    def add_field(self, table_name, field_type):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.execute(sql.add_field(table_name, field_type))
+        self.commit()
+
+    # where is a sql expression with ? for each value in params.
+    def delete(self, table_name, where, params = ()):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.execute(sql.delete(table_name, where), params)
+        self.commit()
+
+    # Like delete, but once for each params in params_list.
+    def delete_many(self, table_name, where, params_list):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.executemany(sql.delete(table_name, where), params_list)
+        self.commit()
+
+    def create_index(self, index_name, table_name, fields, unique = False):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.execute(sql.create_index(index_name, table_name, fields,
+                                           unique))
+        self.commit()
+
+    def drop_index(self, index_name):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.execute(sql.drop_index(index_name))
+        self.commit()
+
+    # where is a sql expression with ? for each value in params.
+    # order_by is [field].  limit is the most rows to select.
+    def select(self, table_name, fields, into=None, where=None, params=(),
+               order_by=None, limit=None):
+        db_cursor = self.db_conn.cursor()
+        for values in db_cursor.execute(
+                sql.select(table_name, fields, where, order_by, limit),
+                params):
             if into is not None:
                 values = into(*values)
             yield values
     
     
+
+class BatchCommitter:
+    """Call done() after each of many small units of work written to
+    the dbs (SqlDbs) within their transactions, and every max_count
+    of them (or every max_secs) the transactions are committed.  So
+    writing is almost as fast as one big transaction, but if we die,
+    only the last batch is lost, and other processes aren't locked out
+    of the dbs the whole time."""
+    def __init__(self, dbs, clock, max_count = 1000, max_secs = 5.0):
+        self.dbs = dbs
+        self.clock = clock
+        self.max_count = max_count
+        self.max_secs = max_secs
+        self.count = 0
+        self.started = clock.unix_fine()
+
+    def done(self):
+        self.count += 1
+        now = self.clock.unix_fine()
+        if self.count >= self.max_count or \
+               now - self.started >= self.max_secs:
+            for db in self.dbs:
+                db.commit_transaction()
+            self.count = 0
+            self.started = now
@@ -33,4 +33,4 @@ from decorators import decorator, decorator_with_args, into, type_constructors
 from Record import Record
 from Enum import Enum
 from RunTimer import RunTimer, RunTime
-from SqlDb import SqlDb
+from SqlDb import SqlDb, BatchCommitter
@@ -38,8 +38,64 @@ def insert(table_name, fields):
     return "insert into {0} ({1}) values ({2})".format(
         table_name, ", ".join(fields), ", ".join("?" for _ in fields))
 
-def select(table_name, fields):
-    return "select {1} from {0}".format(
-        table_name, ", ".join(fields))
+def replace(table_name, fields):
+    return "replace into {0} ({1}) values ({2})".format(
+        table_name, ", ".join(fields), ", ".join("?" for _ in fields))
+
+def update(table_name, fields, where):
+    return "update {0} set {1} where {2}".format(
+        table_name, ", ".join(field + " = ?" for field in fields), where)
+
+def add_field(table_name, field_type):
+    return "alter table {0} add column {1}".format(table_name, field_type)
+
+def table_info(table_name):
+    return "pragma table_info({0})".format(table_name)
+
+def delete(table_name, where):
+    return "delete from {0} where {1}".format(table_name, where)
+
+def create_index(index_name, table_name, fields, unique = False):
+    return "create {0}index if not exists {1} on {2} ({3})".format(
+        "unique " if unique else "", index_name, table_name, ", ".join(fields))
+
+# Inserts the rows of from_table_name where where is true, in order,
+# but if there's already a row with the same key_fields (which must
+# have a unique index), updates the rest of its fields instead, only
+# where update_where is true.  In update_where, the existing row is
+# table_name and the new one is "excluded".  Needs sqlite 3.24.
+def upsert_select(table_name, from_table_name, fields, key_fields, where,
+                  update_where, order_by):
+    # where can't be left out, or "on" would be parsed as a join.
+    return "insert into {0} ({1}) {2} on conflict ({3}) " \
+           "do update set {4} where {5}".format(
+        table_name, ", ".join(fields),
+        select(from_table_name, fields, where, order_by),
+        ", ".join(key_fields),
+        ", ".join("{0} = excluded.{0}".format(field) for field in fields
+                  if field not in key_fields),
+        update_where)
+
+# If call, it's "pragma name(value)", which some pragmas need.
+def set_pragma(name, value, call = False):
+    if call:
+        return "pragma {0}({1})".format(name, value)
+    else:
+        return "pragma {0} = {1}".format(name, value)
+
+def get_pragma(name):
+    return "pragma {0}".format(name)
 
+def drop_index(index_name):
+    return "drop index if exists {0}".format(index_name)
 
+def select(table_name, fields, where = None, order_by = None,
+           limit = None):
+    statement = "select {1} from {0}".format(table_name, ", ".join(fields))
+    if where is not None:
+        statement += " where {0}".format(where)
+    if order_by is not None:
+        statement += " order by {0}".format(", ".join(order_by))
+    if limit is not None:
+        statement += " limit {0:d}".format(limit)
+    return statement
@@ -27,6 +27,8 @@
 # This is semi-random collection of utilities that I find I need all
 # of the time.
 
+import Queue
+import sys
 import threading
 import time
     
@@ -39,6 +41,36 @@ class Clock:
     def unix_fine(_):
         return time.time()
 
+class LruCache:
+    """A dict of at most about max_size items, which drops the least
+    recently used items when it's full.  Rather than keeping items in
+    order (which costs more than most of what we'd cache), there are
+    two generations: new items and items used since the last turnover
+    go in the new one, and when it's full, the old one is dropped and
+    the new one becomes old.  Safe to use from many threads."""
+    def __init__(self, max_size):
+        self.max_size = max(max_size // 2, 1)
+        self.new = {}
+        self.old = {}
+
+    def __len__(self):
+        return len(self.new) + len(self.old)
+
+    # returns the value for key, or default if there isn't one.
+    def get(self, key, default = None):
+        value = self.new.get(key, default)
+        if value is default:
+            value = self.old.get(key, default)
+            if value is not default:
+                self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        new = self.new
+        new[key] = value
+        if len(new) >= self.max_size:
+            self.old, self.new = new, {}
+
 def groupby(vals, key = None, into = None):
     """Returns {key: values}, where values are grouped by key and put
     into the data structure given by the arg 'into', or a list if none
@@ -72,6 +104,18 @@ def partition(vals, predicate):
         (trues if predicate(val) else falses).append(val)
     return trues, falses
 
+def batches(vals, size):
+    """Yields lists of up to size vals at a time, without reading more
+    than size vals ahead."""
+    batch = []
+    for val in vals:
+        batch.append(val)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def flip_dict(dct):
     """Turn {key: value} into {val: key}."""
     return dict((v, k) for (k, v) in dct.iteritems())
@@ -84,4 +128,84 @@ def start_thread(func, name = None, isdaemon = True):
     thread.start()
     return thread
 
+def parallel_map(func, vals, thread_count, weigh = None, max_weight = None,
+                 max_count = None):
+    """Like itertools.imap(func, vals), but calls func from
+    thread_count threads at once.  The results are still yielded in
+    the order of vals, and vals are read lazily.  To bound how much is
+    in flight (started, but not yet yielded), we won't start a val
+    while there are max_count in flight, or if its weight (from
+    weigh(val)) would push the total over max_weight, unless nothing
+    else is in flight.  If func raises an exception, it's raised here,
+    in order."""
+    if max_count is None:
+        max_count = thread_count * 2
+    task_queue = Queue.Queue()
+    results = {}
+    results_ready = threading.Condition()
+
+    def work():
+        while True:
+            task = task_queue.get()
+            if task is None:
+                return
+
+            index, val = task
+            try:
+                result = (func(val), None)
+            except Exception:
+                result = (None, sys.exc_info())
+            with results_ready:
+                results[index] = result
+                results_ready.notify()
+
+    threads = [start_thread(work, "parallel_map_{0}".format(index))
+               for index in xrange(thread_count)]
+    try:
+        vals = iter(vals)
+        weights = {}
+        total_weight = 0
+        next_index = started_index = 0
+        next_val, next_weight = None, 0
+        vals_done = False
+        while True:
+            # Start as many as we can.
+            while not vals_done:
+                if next_val is None:
+                    try:
+                        next_val = next(vals)
+                    except StopIteration:
+                        vals_done = True
+                        break
+                    next_weight = weigh(next_val) if weigh else 0
+
+                in_flight = started_index - next_index
+                if in_flight >= max_count or \
+                       (in_flight > 0 and max_weight is not None and
+                        total_weight + next_weight > max_weight):
+                    break
+
+                weights[started_index] = next_weight
+                total_weight += next_weight
+                task_queue.put((started_index, next_val))
+                started_index += 1
+                next_val = None
+
+            if next_index == started_index:
+                return
+
+            # Then wait for the next one in order.
+            with results_ready:
+                while next_index not in results:
+                    results_ready.wait()
+                result, error = results.pop(next_index)
+            total_weight -= weights.pop(next_index)
+            next_index += 1
 
+            if error is not None:
+                err_type, err, trace = error
+                raise err_type, err, trace
+            yield result
+    finally:
+        for _ in threads:
+            task_queue.put(None)